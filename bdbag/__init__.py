@@ -102,6 +102,21 @@ def add_mime_types(types):
             mimetypes.add_type(type=t, ext=e if e.startswith(".") else "".join([".", e]))
 
 
+def add_mime_encodings(encodings):
+    if not encodings:
+        return
+    for e in encodings.keys():
+        mimetypes.encodings_map[e if e.startswith(".") else "".join([".", e])] = encodings[e]
+
+
+# Zstandard compressed tar archives are identified as "application/x-tar+zstd", in the same way as gzip compressed tar
+# archives are identified as "application/x-tar+gzip".
+MIME_ENCODING_MAP = {
+    "zst": "zstd"
+}
+add_mime_encodings(MIME_ENCODING_MAP)
+
+
 def guess_mime_type(file_path):
     mtype = mimetypes.guess_type(file_path, strict=False)
     content_type = 'application/octet-stream'
@@ -24,10 +24,12 @@ import time
 import tempfile
 import tarfile
 import gzip
-from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, is_zipfile
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, is_zipfile
 import bdbag.bdbagit as bdbagit
 import bdbag.bdbagit_profile as bdbp
 import bdbag.bdbag_ro as bdbro
+import bdbag.bdbag_fixity as bdbfx
+import bdbag.bdbag_archive as bdbarc
 from datetime import date, datetime
 from tzlocal import get_localzone
 from collections import OrderedDict
@@ -140,14 +142,15 @@ def is_bag(bag_path):
 def check_payload_consistency(bag, skip_remote=False, quiet=False):
     logger.info("Checking payload consistency. This can take some time for large bags with many payload files...")
 
+    # reuse the payload inventory (and the name indexes derived from it) unless files were added, removed or renamed
+    bag.current_payload_inventory()
     only_in_manifests, only_on_fs, only_in_fetch = bag.compare_manifests_with_fs_and_fetch()
     payload_consistent = not only_on_fs
 
     if not skip_remote:
         # check for changes to remote entries vs. known fetch.txt entries
         updated_remote_files = sorted(bag.remote_entries.keys())
-        existing_remote_files = sorted(list(bag.files_to_be_fetched(False)))
-        modified_remote_files = list(set(updated_remote_files) - set(existing_remote_files))
+        modified_remote_files = list(set(updated_remote_files) - set(bag.files_to_be_fetched(False)))
         if modified_remote_files:
             payload_consistent = False
             if not quiet:
@@ -162,7 +165,7 @@ def check_payload_consistency(bag, skip_remote=False, quiet=False):
             payload_consistent = False
 
         # check for fetch files that are simply missing from the payload
-        unresolved_fetch_files = list(set(bag.files_to_be_fetched()) - set(bag.payload_files()))
+        unresolved_fetch_files = sorted(bag.fetch_name_index() - bag.filesystem_name_index())
         if unresolved_fetch_files:
             payload_consistent = False
             if not quiet:
@@ -170,7 +173,9 @@ def check_payload_consistency(bag, skip_remote=False, quiet=False):
                                % (", ".join(unresolved_fetch_files) if len(unresolved_fetch_files) > 1 else
                                   unresolved_fetch_files[0]))
 
-        # check for size mismatches of local files that may have been fetched already
+        # check for size mismatches of local files that may have been fetched already. The sizes are read from the
+        # file system rather than from the payload inventory, since a reused inventory is only known to be current with
+        # respect to files being added, removed or renamed, not to files being rewritten in place
         for url, size, path in bag.fetch_entries():
             output_path = os.path.normpath(os.path.join(bag.path, path))
             if os.path.exists(output_path):
@@ -243,7 +248,8 @@ def make_bag(bag_path,
              ro_metadata=None,
              ro_metadata_file=None,
              idempotent=None,
-             strict=False):
+             strict=False,
+             incremental=False):
     bag = None
     try:
         bag = bdbagit.BDBag(bag_path)
@@ -255,6 +261,7 @@ def make_bag(bag_path,
     bag_version = bag_config.get(BAG_SPEC_VERSION_TAG, DEFAULT_BAG_SPEC_VERSION)
     bag_algorithms = algs if algs else bag_config.get(BAG_ALGORITHMS_TAG, ['md5', 'sha256'])
     bag_processes = bag_config.get(BAG_PROCESSES_TAG, 1)
+    bag_executor = bag_config.get(BAG_EXECUTOR_TAG, DEFAULT_BAG_EXECUTOR)
     idempotent_config = bag_config.get(BAG_ARCHIVE_IDEMPOTENT, False)
     idempotent = idempotent_config if (idempotent_config and idempotent is None) else \
         False if idempotent is None else idempotent
@@ -303,6 +310,7 @@ def make_bag(bag_path,
 
     if bag:
         if update:
+            fixity_cache = None
             try:
                 logger.info("Updating bag: %s" % bag_path)
                 bag.info.update(bag_metadata)
@@ -313,10 +321,16 @@ def make_bag(bag_path,
                     save_manifests = True
                 if bag_ro_metadata:
                     bdbro.serialize_bag_ro_metadata(bag_ro_metadata, bag_path)
-                bag.save(bag_processes, manifests=save_manifests)
+                if save_manifests:
+                    fixity_cache = bdbfx.get_fixity_cache(bag_config)
+                bag.save(bag_processes, manifests=save_manifests, fixity_cache=fixity_cache, incremental=incremental,
+                         executor=bag_executor)
             except Exception as e:
                 logger.error("Exception while updating bag manifests: %s", e)
                 raise e
+            finally:
+                if fixity_cache:
+                    fixity_cache.close()
         else:
             logger.info("The directory %s is already a bag." % bag_path)
     # otherwise, create
@@ -324,16 +338,23 @@ def make_bag(bag_path,
         remote_files = None
         if remote_file_manifest:
             remote_files = generate_remote_files_from_manifest(remote_file_manifest, bag_algorithms)
-        bag = bdbagit.make_bag(bag_path,
-                               bag_info=bag_metadata,
-                               processes=bag_processes,
-                               checksums=bag_algorithms,
-                               remote_entries=remote_files,
-                               spec_version=bag_version)
+        fixity_cache = bdbfx.get_fixity_cache(bag_config)
+        try:
+            bag = bdbagit.make_bag(bag_path,
+                                   bag_info=bag_metadata,
+                                   processes=bag_processes,
+                                   checksums=bag_algorithms,
+                                   remote_entries=remote_files,
+                                   spec_version=bag_version,
+                                   fixity_cache=fixity_cache,
+                                   executor=bag_executor)
+        finally:
+            if fixity_cache:
+                fixity_cache.close()
         logger.info('Created bag: %s' % bag_path)
         if bag_ro_metadata:
             bdbro.serialize_bag_ro_metadata(bag_ro_metadata, bag_path)
-            bag.save(bag_processes)
+            bag.save(bag_processes, executor=bag_executor)
 
     if strict:
         try:
@@ -350,7 +371,7 @@ def make_bag(bag_path,
     return bag
 
 
-def archive_bag(bag_path, bag_archiver, config_file=None, idempotent=None):
+def archive_bag(bag_path, bag_archiver, config_file=None, idempotent=None, threads=None):
     bag_archiver = bag_archiver.lower()
     bag_path = bag_path.rstrip(os.path.sep)
 
@@ -358,6 +379,9 @@ def archive_bag(bag_path, bag_archiver, config_file=None, idempotent=None):
     idempotent_config = config[BAG_CONFIG_TAG].get(BAG_ARCHIVE_IDEMPOTENT, False)
     idempotent = idempotent_config if (idempotent_config and idempotent is None) else \
         False if idempotent is None else idempotent
+    if threads is None:
+        threads = config[BAG_CONFIG_TAG].get(BAG_ARCHIVE_THREADS_TAG, 1)
+    level = config[BAG_CONFIG_TAG].get(BAG_ARCHIVE_ZSTD_LEVEL_TAG, bdbarc.DEFAULT_ZSTD_LEVEL)
 
     try:
         validate_bag_structure(bag_path, skip_remote=True)
@@ -379,64 +403,81 @@ def archive_bag(bag_path, bag_archiver, config_file=None, idempotent=None):
         tarmode = 'w:bz2'
     elif bag_archiver == 'xz' and sys.version_info >= (3, 3):
         tarmode = 'w:xz'
+    elif bag_archiver in ('zst', 'tar.zst'):
+        tarmode = 'w:zst'
+        fn = '.'.join([os.path.basename(bag_path), 'tar', 'zst'])
     elif bag_archiver == 'zip':
         zfp = os.path.join(os.path.dirname(bag_path), fn)
-        archive = zip_bag_dir(bag_path, zfp, idempotent)
+        archive = zip_bag_dir(bag_path, zfp, idempotent, bdbarc.get_zip_compression_policy(config[BAG_CONFIG_TAG]),
+                              threads)
     else:
         raise RuntimeError("Archive format not supported for bag file: %s \n "
-                           "Supported archive formats are ZIP or TAR/GZ/BZ2%s" %
+                           "Supported archive formats are ZIP or TAR/GZ/BZ2%s/ZST" %
                            (bag_path,  ("/XZ" if sys.version_info >= (3, 3) else "")))
 
     if tarmode:
-        archive = tar_bag_dir(bag_path, fn, tarmode, idempotent)
+        archive = tar_bag_dir(bag_path, fn, tarmode, idempotent, threads, level)
 
     logger.info('Created bag archive: %s' % archive)
 
     return archive
 
 
-def tar_bag_dir(bag_path, tar_file_path, tarmode, idempotent=False):
+def tar_bag_dir(bag_path, tar_file_path, tarmode, idempotent=False, threads=1, level=None):
 
     def filter_mtime(tarinfo):
         # a fixed mtime is a core requirement for a reproducible archive
         tarinfo.mtime = 0
         return tarinfo
 
-    is_idempotent_tgz = False
-    if idempotent and tarmode == 'w:gz':
-        is_idempotent_tgz = True
-        tarmode = 'w'
-        tar_file_path = '.'.join([os.path.basename(bag_path), "tar"])
-
     tfp = os.path.join(os.path.dirname(bag_path), tar_file_path)
-    t = tarfile.open(tfp, tarmode)
+    arcname = os.path.relpath(bag_path, os.path.dirname(bag_path))
+
+    # With more than one thread, a TGZ is compressed in parallel blocks by a ParallelGzipFile. Its output is
+    # deterministic, so it only needs a fixed mtime in the gzip header to be idempotent.
+    if threads and threads > 1 and tarmode == 'w:gz':
+        archive = os.path.abspath(tfp)
+        logger.debug("Compressing bag archive using %d threads." % threads)
+        with io.open(archive, 'wb') as f_out:
+            with bdbarc.ParallelGzipFile(f_out, threads, filename=os.path.splitext(archive)[0] + ".tar",
+                                         mtime=0 if idempotent else None) as gzf:
+                with tarfile.open(fileobj=gzf, mode='w') as t:
+                    t.add(bag_path, arcname, recursive=True, filter=filter_mtime if idempotent else None)
+        return archive
+
+    # An idempotent TGZ needs a gzip header with mtime=0, which can't be passed through the tarfile API. Instead, the
+    # tar stream is written directly into a GzipFile created with mtime=0, in a single pass. The gzip header records
+    # the name of the equivalent uncompressed .tar file, so that the output is identical to gzipping that file.
+    if idempotent and tarmode == 'w:gz':
+        archive = os.path.abspath(os.path.splitext(tfp)[0] + ".tgz")
+        with io.open(archive, 'wb') as f_out:
+            with gzip.GzipFile(filename=os.path.splitext(archive)[0] + ".tar", mode='wb', fileobj=f_out,
+                               mtime=0) as gzf:
+                with tarfile.open(fileobj=gzf, mode='w') as t:
+                    t.add(bag_path, arcname, recursive=True, filter=filter_mtime)
+        return archive
+
+    if tarmode == 'w:zst':
+        # Zstandard compression is provided by the optional "zstandard" package, and can use multiple threads
+        t = bdbarc.ZstdTarFile.open(tfp, tarmode, level=level, threads=threads)
+    else:
+        t = tarfile.open(tfp, tarmode)
     t.add(bag_path,
-          os.path.relpath(bag_path, os.path.dirname(bag_path)),
+          arcname,
           recursive=True,
           filter=filter_mtime if idempotent else None)
     t.close()
-    archive = t.name
-
-    # TGZ is a special case which we have to GZIP separately because we can't pass through the needed mtime=0 argument
-    # via the tarfile API - this is obviously less efficient than performing a tar|gzip in a single pass but oh well.
-    if is_idempotent_tgz:
-        archive = os.path.splitext(t.name)[0] + ".tgz"
-        with io.open(t.name, 'rb') as f_in, io.open(archive, 'wb') as f_out:
-            with gzip.GzipFile(filename=t.name, mode='wb', fileobj=f_out, mtime=0) as gzf:
-                while True:
-                    chunk = f_in.read(io.DEFAULT_BUFFER_SIZE)
-                    if not chunk:
-                        break
-                    gzf.write(chunk)
-                gzf.flush()
-        os.remove(t.name)
 
-    return archive
+    return t.name
 
 
-def zip_bag_dir(bag_path, zip_file_path, idempotent=False):
+def zip_bag_dir(bag_path, zip_file_path, idempotent=False, compression_policy=None, threads=1):
     # The majority of this code came from https://fekir.info/post/reproducible-zip-archives/ with the exception of the
     # buffered writing of file entries (instead of ZipFile.writestr) which was added for scalability reasons.
+    # If a compression_policy (bdbag_archive.ZipCompressionPolicy) is given, files that it identifies as already
+    # compressed are stored rather than deflated. With more than one thread, files are deflated concurrently by a
+    # thread pool and appended to the archive in the same (sorted) order as they would otherwise be written, so the
+    # archive is identical to one created with a single thread.
     zipfile = ZipFile(zip_file_path, 'w', ZIP_DEFLATED, allowZip64=True)
     entries = []
     for root, dirs, files in os.walk(bag_path):
@@ -445,39 +486,68 @@ def zip_bag_dir(bag_path, zip_file_path, idempotent=False):
         for f in files:
             entries.append(os.path.relpath(os.path.join(root, f), os.path.dirname(bag_path)))
     entries.sort()
+    compress_types = dict()
     for e in entries:
-        filepath = os.path.join(os.path.dirname(bag_path), e)
-        if sys.version_info < (3,):
-            zipfile.write(filepath, e)
+        if not e.endswith(os.path.sep):
+            filepath = os.path.join(os.path.dirname(bag_path), e)
+            compress_types[e] = compression_policy.compress_type(filepath) if compression_policy else ZIP_DEFLATED
+    stored = list(compress_types.values()).count(ZIP_STORED)
+    deflated = None
+    if threads and threads > 1 and sys.version_info >= (3,):
+        if bdbarc.can_write_deflated_members(zipfile):
+            logger.debug("Compressing bag archive using %d threads." % threads)
+            deflated = bdbarc.deflate_files([os.path.join(os.path.dirname(bag_path), e) for e in entries
+                                             if compress_types.get(e) == ZIP_DEFLATED], threads)
         else:
-            if idempotent:
-                # a fixed mtime is a core requirement for a reproducible archive
-                date_time = (1980, 1, 1, 0, 0, 0)
-            else:
-                st = os.stat(filepath)
-                mtime = time.localtime(st.st_mtime)
-                date_time = mtime[0:6]
-            info = ZipInfo(
-                filename=e,
-                date_time=date_time
-            )
-            info.create_system = 3  # unix
-            if e.endswith(os.path.sep):
-                info.external_attr = 0o40755 << 16 | 0x010
-                info.compress_type = ZIP_STORED
-                info.CRC = 0  # unclear why necessary, maybe a bug?
-                zipfile.writestr(info, b'')
+            logger.warning("Parallel compression of zip archive members is not supported on this version of Python. "
+                           "Compressing members using a single thread.")
+    try:
+        for e in entries:
+            filepath = os.path.join(os.path.dirname(bag_path), e)
+            if sys.version_info < (3,):
+                zipfile.write(filepath, e)
             else:
-                info.external_attr = 0o100644 << 16
-                info.compress_type = ZIP_DEFLATED
-                with io.open(filepath, 'rb') as data, zipfile.open(info, 'w') as out:
-                    while True:
-                        chunk = data.read(io.DEFAULT_BUFFER_SIZE)
-                        if not chunk:
-                            break
-                        out.write(chunk)
-                    out.flush()
-    zipfile.close()
+                if idempotent:
+                    # a fixed mtime is a core requirement for a reproducible archive
+                    date_time = (1980, 1, 1, 0, 0, 0)
+                else:
+                    st = os.stat(filepath)
+                    mtime = time.localtime(st.st_mtime)
+                    date_time = mtime[0:6]
+                info = ZipInfo(
+                    filename=e,
+                    date_time=date_time
+                )
+                info.create_system = 3  # unix
+                if e.endswith(os.path.sep):
+                    info.external_attr = 0o40755 << 16 | 0x010
+                    info.compress_type = ZIP_STORED
+                    info.CRC = 0  # unclear why necessary, maybe a bug?
+                    zipfile.writestr(info, b'')
+                else:
+                    info.external_attr = 0o100644 << 16
+                    info.compress_type = compress_types[e]
+                    if deflated and info.compress_type == ZIP_DEFLATED:
+                        crc, file_size, data = next(deflated)
+                        with data:
+                            bdbarc.write_deflated_member(zipfile, info, data, crc, file_size,
+                                                         force_zip64=file_size > ZIP64_LIMIT)
+                        continue
+                    # the size of a member must be known up front for ZipFile to write it with ZIP64 extensions
+                    force_zip64 = os.path.getsize(filepath) > ZIP64_LIMIT
+                    with io.open(filepath, 'rb') as data, zipfile.open(info, 'w', force_zip64=force_zip64) as out:
+                        while True:
+                            chunk = data.read(io.DEFAULT_BUFFER_SIZE)
+                            if not chunk:
+                                break
+                            out.write(chunk)
+                        out.flush()
+    finally:
+        if deflated:
+            deflated.close()
+        zipfile.close()
+    if stored:
+        logger.info("Stored %d already compressed file(s) in the archive without compression." % stored)
     return zipfile.filename
 
 
@@ -492,6 +562,8 @@ def extract_bag(bag_path, output_path=None, temp=False, config_file=None):
     # determine output path for extraction
     base_path = extracted_path = None
     bag_dir = os.path.splitext(os.path.basename(bag_path))[0]
+    if bag_dir.endswith(".tar"):
+        bag_dir = os.path.splitext(bag_dir)[0]
     if os.path.isfile(bag_path):
         if temp:
             base_path = tempfile.mkdtemp(prefix='bag_')
@@ -505,6 +577,12 @@ def extract_bag(bag_path, output_path=None, temp=False, config_file=None):
             logger.info("Extracting ZIP archived file: %s" % bag_path)
             archive = ZipFile(bag_path)
             files = archive.namelist()
+        elif bdbarc.is_zstd_file(bag_path):
+            logger.info("Extracting TAR/ZST archived file: %s" % bag_path)
+            # a Zstandard compressed tar can only be read sequentially, so it is re-opened after the preflight listing
+            with bdbarc.ZstdTarFile.open(bag_path, "r:zst") as archive:
+                files = archive.getnames()
+            archive = bdbarc.ZstdTarFile.open(bag_path, "r:zst")
         elif tarfile.is_tarfile(bag_path):
             logger.info("Extracting TAR/GZ/BZ2%s archived file: %s" %
                         (("/XZ" if sys.version_info >= (3, 3) else ""), bag_path))
@@ -512,7 +590,7 @@ def extract_bag(bag_path, output_path=None, temp=False, config_file=None):
             files = archive.getnames()
         else:
             raise RuntimeError("Archive format not supported for file: %s\n"
-                               "Supported archive formats are ZIP or TAR/GZ/BZ2%s" %
+                               "Supported archive formats are ZIP or TAR/GZ/BZ2%s/ZST" %
                                (bag_path,  ("/XZ" if sys.version_info >= (3, 3) else "")))
         archived_bag_dir = bag_parent_dir_from_archive(files)
         extracted_path = os.path.join(base_path, archived_bag_dir or bag_dir)
@@ -560,16 +638,31 @@ def extract_bag(bag_path, output_path=None, temp=False, config_file=None):
     return extracted_path
 
 
-def validate_bag(bag_path, fast=False, callback=None, config_file=None):
+def validate_bag(bag_path, fast=False, callback=None, config_file=None, fail_fast=False, verified=None,
+                 filter_expr=None, sample=None):
     config = read_config(config_file)
     bag_config = config['bag_config']
     bag_processes = bag_config.get('bag_processes', 1)
+    bag_executor = bag_config.get(BAG_EXECUTOR_TAG, DEFAULT_BAG_EXECUTOR)
+    fixity_cache = checkpoint = None
 
     try:
-        logger.info("Validating bag: %s" % bag_path)
-        bag = bdbagit.BDBag(bag_path)
-        bag.validate(bag_processes if not callback else 1, fast=fast, callback=callback)
+        logger.info("Validating bag: %s%s" %
+                    (bag_path, "" if not filter_expr else ", using filter expression [%s]" % filter_expr))
+        bag = bdbagit.BDBag(bag_path, compact_manifests=bag_config.get(BAG_COMPACT_MANIFESTS_TAG, False))
+        if not fast:
+            fixity_cache = bdbfx.get_fixity_cache(bag_config, validation=True)
+            # a filtered or sampled validation does not check every file, so it must neither skip the files recorded
+            # by an interrupted full validation nor remove its journal
+            if not (filter_expr or sample):
+                checkpoint = bdbfx.get_validation_checkpoint(bag_config, bag_path)
+        bag.validate(bag_processes, fast=fast, callback=callback, fixity_cache=fixity_cache,
+                     executor=bag_executor, fail_fast=fail_fast, verified=verified, filter_expr=filter_expr,
+                     sample=sample, checkpoint=checkpoint)
+        if checkpoint:
+            checkpoint.remove()
         logger.info("Bag %s is valid" % bag_path)
+        return bag.sample_report
     except bdbagit.BagValidationError as e:
         logger.warning("BagValidationError: A BagValidationError may be transient if the bag contains unresolved "
                        "remote file references from a fetch.txt file. In this case the bag is incomplete but not "
@@ -580,6 +673,11 @@ def validate_bag(bag_path, fast=False, callback=None, config_file=None):
         raise e
     except Exception as e:  # pragma: no cover
         raise RuntimeError("Unhandled exception while validating bag: %s" % e)
+    finally:
+        if fixity_cache:
+            fixity_cache.close()
+        if checkpoint:
+            checkpoint.close()
 
 
 def validate_bag_structure(bag_path, skip_remote=True):
@@ -729,7 +827,8 @@ def resolve_fetch(bag_path,
                   config_file=None,
                   filter_expr=None,
                   **kwargs):
-    bag = bdbagit.BDBag(bag_path)
+    bag_config = read_config(config_file).get(BAG_CONFIG_TAG, dict())
+    bag = bdbagit.BDBag(bag_path, compact_manifests=bag_config.get(BAG_COMPACT_MANIFESTS_TAG, False))
     if force or not check_payload_consistency(bag, skip_remote=False, quiet=kwargs.get("quiet", True)):
         logger.info("Attempting to resolve remote file references from %s%s" %
                     (os.path.join(bag_path, "fetch.txt"),
@@ -783,15 +882,19 @@ def materialize(input_path,
                         "Only a properly structured bag directory can be fully materialized." % bag_path)
             return bag_path
 
+        # Files are verified against the bag manifests as they are fetched, so that they need not be read back again
+        verified = dict()
         if not resolve_fetch(bag_path,
                              force=force,
                              callback=fetch_callback,
                              keychain_file=keychain_file,
                              config_file=config_file,
                              filter_expr=filter_expr,
+                             verified=verified,
                              **kwargs):
             logger.warning("One or more bag files were not fetched successfully.")
 
-        validate_bag(bag_path, fast=False, callback=validation_callback, config_file=config_file)
+        validate_bag(bag_path, fast=False, callback=validation_callback, config_file=config_file, verified=verified,
+                     filter_expr=filter_expr)
 
     return bag_path
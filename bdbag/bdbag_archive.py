@@ -0,0 +1,365 @@
+#
+# Copyright 2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import io
+import os
+import sys
+import time
+import zlib
+import struct
+import shutil
+import tarfile
+import fnmatch
+import logging
+import tempfile
+import platform
+from zipfile import ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, LargeZipFile
+from importlib import import_module
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from bdbag import stob, guess_mime_type
+from bdbag.bdbag_config import BAG_ARCHIVE_ZIP_STORE_TAG, BAG_ARCHIVE_ZIP_STORE_ENABLED_TAG, \
+    BAG_ARCHIVE_ZIP_STORE_EXTENSIONS_TAG, BAG_ARCHIVE_ZIP_STORE_MIME_TYPES_TAG, BAG_ARCHIVE_ZIP_STORE_PROBE_BYTES_TAG, \
+    BAG_ARCHIVE_ZIP_STORE_PROBE_RATIO_TAG, DEFAULT_ZIP_STORE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+ZSTD = None
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DEFAULT_ZSTD_LEVEL = 3
+
+# The size of the independently compressed blocks, and the amount of preceding uncompressed data that is used as the
+# preset dictionary of each block so that compression across block boundaries is nearly as good as for a single stream.
+PARALLEL_GZIP_BLOCK_SIZE = 1024 * 1024
+PARALLEL_GZIP_DICT_SIZE = 32 * 1024
+DEFAULT_COMPRESS_LEVEL = 9
+
+# ZIP members deflated by worker threads are held in memory until they are written to the archive, unless their
+# compressed size exceeds DEFLATE_SPOOL_SIZE, in which case they are spilled to a temporary file.
+DEFLATE_SPOOL_SIZE = 16 * 1024 * 1024
+DEFLATE_READ_SIZE = 1024 * 1024
+
+# The range of CPython versions whose (private) ZipFile internals write_deflated_member has been verified against. On
+# any other version or implementation, ZIP members are always compressed serially by ZipFile itself.
+ZIPFILE_INTERNALS_VERSIONS = ((3, 8), (3, 13))
+ZIPFILE_INTERNALS = ("_lock", "_writecheck", "_didModify", "_writing", "_seekable", "_allowZip64", "fp", "start_dir",
+                     "filelist", "NameToInfo")
+
+
+def _compress_block(data, dictionary, level, last):
+    # raw deflate (negative wbits), since the gzip header and trailer are written by ParallelGzipFile
+    args = [level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY]
+    compressor = zlib.compressobj(*args, zdict=dictionary) if dictionary else zlib.compressobj(*args)
+    # A sync flush ends each block on a byte boundary without ending the deflate stream, so that the compressed blocks
+    # can be concatenated. Only the last block finishes the stream.
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipFile(io.RawIOBase):
+    """
+    A write-only file object that compresses the data written to it in parallel, in the manner of pigz. The data is cut
+    into fixed size blocks that are each deflated by a thread pool (zlib releases the GIL while compressing), using the
+    end of the preceding block as a preset dictionary. The compressed blocks are written in order as a single standard
+    gzip member that can be read by gunzip or the gzip module.
+
+    The output only depends on the data, the block size and the compression level, never on the number of threads or
+    the order in which blocks complete, so it is deterministic when mtime is fixed.
+    """
+
+    def __init__(self, fileobj, threads, filename=None, mtime=None, compresslevel=DEFAULT_COMPRESS_LEVEL,
+                 block_size=PARALLEL_GZIP_BLOCK_SIZE):
+        super(ParallelGzipFile, self).__init__()
+        self.fileobj = fileobj
+        self.name = filename or getattr(fileobj, "name", "")
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.dictionary = b""
+        self.crc = 0
+        self.size = 0
+        self._write_header(self.name, int(time.time()) if mtime is None else mtime)
+
+    def _write_header(self, filename, mtime):
+        # Same header layout as the gzip module, including the original file name without any .gz extension
+        fname = os.path.basename(filename or "")
+        if isinstance(fname, bytes):
+            fname = fname.decode("latin-1")
+        if fname.endswith(".gz"):
+            fname = fname[:-3]
+        fname = fname.encode("latin-1", "replace")
+        xfl = b"\002" if self.compresslevel == 9 else b"\004" if self.compresslevel == 1 else b"\000"
+        self.fileobj.write(b"\037\213\010" + (b"\010" if fname else b"\000") + struct.pack("<L", mtime & 0xffffffff) +
+                           xfl + b"\377" + (fname + b"\000" if fname else b""))
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.size
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = memoryview(data).cast("B")
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) > self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]), last=False)
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block, last):
+        self.pending.append(self.executor.submit(_compress_block, block, self.dictionary, self.compresslevel, last))
+        self.dictionary = block[-PARALLEL_GZIP_DICT_SIZE:]
+        # bound the memory held by queued and compressed blocks to a few blocks per thread
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self.buffer), last=True)
+            self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.write(struct.pack("<LL", self.crc & 0xffffffff, self.size & 0xffffffff))
+        finally:
+            self.executor.shutdown()
+            super(ParallelGzipFile, self).close()
+
+
+def import_zstandard():
+    # locate library
+    global ZSTD
+    if ZSTD is None:
+        try:
+            ZSTD = import_module("zstandard")
+        except ImportError as e:
+            raise RuntimeError(
+                "Unable to find required module. Ensure that the Python package \"zstandard\" is installed.", e)
+    return ZSTD
+
+
+def is_zstd_file(path):
+    with io.open(path, "rb") as f:
+        return f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC
+
+
+class ZstdTarFile(tarfile.TarFile):
+    """
+    A TarFile that adds the "zst" compression type to tarfile.open, using the optional zstandard package, e.g.
+    ZstdTarFile.open(name, "w:zst", level=3, threads=4). Compression can use multiple threads. Since a Zstandard stream
+    can only be read forward, an archive opened for reading only supports sequential access: either iterate over its
+    members or call extractall(), but not both on the same ZstdTarFile.
+    """
+    OPEN_METH = dict(tarfile.TarFile.OPEN_METH, zst="zstopen")
+
+    @classmethod
+    def zstopen(cls, name, mode="r", fileobj=None, level=DEFAULT_ZSTD_LEVEL, threads=1, **kwargs):
+        if mode not in ("r", "w", "x"):
+            raise ValueError("mode must be 'r', 'w' or 'x'")
+        zstd = import_zstandard()
+        if fileobj is None:
+            fileobj = io.open(name, "rb" if mode == "r" else mode + "b")
+        if mode == "r":
+            stream = zstd.ZstdDecompressor().stream_reader(fileobj, closefd=True)
+        else:
+            # Zstandard output does not depend on the number of worker threads, as long as there is at least one.
+            # threads=0 selects the single threaded (in-line) compressor, which produces a different stream, so at
+            # least one worker thread is always used so that idempotent archives do not depend on the thread count
+            compressor = zstd.ZstdCompressor(level=DEFAULT_ZSTD_LEVEL if level is None else level,
+                                             threads=max(1, threads or 1), write_checksum=True)
+            stream = compressor.stream_writer(fileobj, closefd=True)
+        try:
+            t = cls.taropen(name, mode, stream, **kwargs)
+        except (zstd.ZstdError, EOFError) as e:
+            stream.close()
+            if mode == "r":
+                raise tarfile.ReadError("not a zstd file") from e
+            raise
+        except Exception:
+            stream.close()
+            raise
+        t._extfileobj = False
+        return t
+
+
+class ZipCompressionPolicy(object):
+    """
+    Decides whether a file should be deflated or stored uncompressed in a ZIP archive. Files that are already
+    compressed gain little or nothing from being deflated again, so they are stored if their extension is in
+    extensions, their mime type (as guessed by guess_mime_type) matches one of the mime_types patterns, or their mime
+    encoding is a compression format. Otherwise, if probe_bytes is set, the start of the file is compressed at the
+    fastest level as a trial, and the file is stored if that does not reduce it to less than probe_ratio of its size.
+    """
+    COMPRESSED_ENCODINGS = ("gzip", "bzip2", "xz", "zstd", "br", "compress")
+    # files smaller than this are cheap to deflate, and too small for the trial compression to be representative
+    PROBE_MIN_BYTES = 4096
+
+    def __init__(self, extensions=None, mime_types=None, probe_bytes=0, probe_ratio=0.95):
+        self.extensions = set(ext.lower().lstrip(".") for ext in extensions or [])
+        self.mime_types = [mime_type.lower() for mime_type in mime_types or []]
+        self.probe_bytes = probe_bytes or 0
+        self.probe_ratio = probe_ratio
+
+    def is_compressed(self, path):
+        name = os.path.basename(path).lower()
+        if "." in name and name.rsplit(".", 1)[1] in self.extensions:
+            return True
+        for part in guess_mime_type(path).lower().split("+"):
+            if part in self.COMPRESSED_ENCODINGS or \
+                    any(fnmatch.fnmatchcase(part, pattern) for pattern in self.mime_types):
+                return True
+        return self._probe(path)
+
+    def _probe(self, path):
+        if self.probe_bytes < self.PROBE_MIN_BYTES:
+            return False
+        with io.open(path, "rb") as f:
+            sample = f.read(self.probe_bytes)
+        if len(sample) < self.PROBE_MIN_BYTES:
+            return False
+        return len(zlib.compress(sample, 1)) >= len(sample) * self.probe_ratio
+
+    def compress_type(self, path):
+        return ZIP_STORED if self.is_compressed(path) else ZIP_DEFLATED
+
+
+def get_zip_compression_policy(bag_config):
+    """
+    Returns a ZipCompressionPolicy configured from the "bag_archive_zip_store" object of the given bag_config, or None
+    if storing already compressed files is not enabled.
+    """
+    store_config = (bag_config or {}).get(BAG_ARCHIVE_ZIP_STORE_TAG, DEFAULT_ZIP_STORE_CONFIG) or {}
+    if not stob(store_config.get(BAG_ARCHIVE_ZIP_STORE_ENABLED_TAG, False)):
+        return None
+    return ZipCompressionPolicy(
+        extensions=store_config.get(BAG_ARCHIVE_ZIP_STORE_EXTENSIONS_TAG,
+                                    DEFAULT_ZIP_STORE_CONFIG[BAG_ARCHIVE_ZIP_STORE_EXTENSIONS_TAG]),
+        mime_types=store_config.get(BAG_ARCHIVE_ZIP_STORE_MIME_TYPES_TAG,
+                                    DEFAULT_ZIP_STORE_CONFIG[BAG_ARCHIVE_ZIP_STORE_MIME_TYPES_TAG]),
+        probe_bytes=store_config.get(BAG_ARCHIVE_ZIP_STORE_PROBE_BYTES_TAG,
+                                     DEFAULT_ZIP_STORE_CONFIG[BAG_ARCHIVE_ZIP_STORE_PROBE_BYTES_TAG]),
+        probe_ratio=store_config.get(BAG_ARCHIVE_ZIP_STORE_PROBE_RATIO_TAG,
+                                     DEFAULT_ZIP_STORE_CONFIG[BAG_ARCHIVE_ZIP_STORE_PROBE_RATIO_TAG]))
+
+
+def deflate_file(path, level=zlib.Z_DEFAULT_COMPRESSION, spool_size=DEFLATE_SPOOL_SIZE):
+    """
+    Compresses a file into a raw deflate stream, as ZipFile does for a ZIP_DEFLATED member. Returns the CRC and size
+    of the file and a SpooledTemporaryFile containing the compressed data.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    crc = size = 0
+    try:
+        with io.open(path, "rb") as f:
+            while True:
+                chunk = f.read(DEFLATE_READ_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                spool.write(compressor.compress(chunk))
+        spool.write(compressor.flush())
+    except Exception:
+        spool.close()
+        raise
+    return crc, size, spool
+
+
+def deflate_files(paths, threads, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Deflates each of paths with deflate_file, concurrently in a pool of threads, and yields the results in the order of
+    paths. At most a few files per thread are compressed ahead of the file that is being consumed. The consumer is
+    responsible for closing each yielded spool file; the spool files of any results that were not yet yielded when the
+    generator is closed are closed by the generator.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, threads))
+    pending = deque()
+    try:
+        for path in paths:
+            pending.append(executor.submit(deflate_file, path, level))
+            if len(pending) > 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                future.result()[2].close()
+
+
+def can_write_deflated_members(zip_file):
+    """
+    Returns True if write_deflated_member can be used with the given ZipFile. It relies on private ZipFile internals,
+    so it is only used on the CPython versions it has been verified against, and only for a seekable archive file.
+    """
+    return (platform.python_implementation() == "CPython" and
+            ZIPFILE_INTERNALS_VERSIONS[0] <= sys.version_info[:2] <= ZIPFILE_INTERNALS_VERSIONS[1] and
+            all(hasattr(zip_file, name) for name in ZIPFILE_INTERNALS) and
+            hasattr(ZipInfo, "FileHeader") and zip_file._seekable)
+
+
+def write_deflated_member(zip_file, zinfo, data, crc, file_size, force_zip64=False):
+    """
+    Writes a member whose data has already been compressed by deflate_file to a ZipFile that is open for writing to a
+    seekable file. This mirrors ZipFile.open(zinfo, "w", force_zip64=force_zip64) followed by writing the file and
+    closing the member, including the ZIP64 decision and size checks, so the archive is identical to one whose members
+    were all compressed by ZipFile itself. Only use this where can_write_deflated_members returns True.
+    """
+    data.seek(0, io.SEEK_END)
+    compress_size = data.tell()
+    data.seek(0)
+    with zip_file._lock:
+        # ZipFile._open_to_write
+        if zip_file._writing:
+            raise ValueError("Can't write to the ZIP file while there is another write handle open on it. "
+                             "Close the first handle before opening another.")
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.flag_bits = 0x00
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+        # the ZIP64 decision is made before the sizes are known, exactly as in ZipFile._open_to_write
+        # (a ZipInfo has no file_size until one is set on Python 3.8)
+        zip64 = force_zip64 or (getattr(zinfo, "file_size", 0) * 1.05 > ZIP64_LIMIT)
+        if zip64 and not zip_file._allowZip64:
+            raise LargeZipFile("Filesize would require ZIP64 extensions")
+        # _ZipWriteFile.close
+        if not zip64:
+            if file_size > ZIP64_LIMIT:
+                raise RuntimeError("File size too large, try using force_zip64")
+            if compress_size > ZIP64_LIMIT:
+                raise RuntimeError("Compressed size too large, try using force_zip64")
+        zinfo.CRC = crc
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+        zip_file.fp.seek(zip_file.start_dir)
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(zinfo)
+        zip_file._didModify = True
+        zip_file.fp.write(zinfo.FileHeader(zip64))
+        shutil.copyfileobj(data, zip_file.fp)
+        zip_file.start_dir = zip_file.fp.tell()
+        zip_file.filelist.append(zinfo)
+        zip_file.NameToInfo[zinfo.filename] = zinfo
@@ -18,7 +18,7 @@ import os
 import sys
 import logging
 import traceback
-from bdbag.bdbagit import STANDARD_BAG_INFO_HEADERS
+from bdbag.bdbagit import STANDARD_BAG_INFO_HEADERS, DEFAULT_SAMPLE_COUNT, ValidationSample
 from bdbag import bdbag_api as bdb, inspect_path, get_typed_exception, FILTER_DOCSTRING, VERSION, BAGIT_VERSION
 from bdbag.bdbag_config import bootstrap_config, DEFAULT_CONFIG_FILE, DEFAULT_CONFIG_FILE_ENVAR
 from bdbag.fetch import fetcher
@@ -102,9 +102,18 @@ def parse_cli():
     choices = ['zip', 'tar', 'tgz', 'bz2']
     if sys.version_info >= (3, 3):
         choices.append("xz")
+    choices.append("zst")
     standard_args.add_argument(
         archiver_arg, choices=choices, help="Archive a bag using the specified format.")
 
+    compression_threads_arg = "--compression-threads"
+    standard_args.add_argument(
+        compression_threads_arg, metavar="<count>", type=int,
+        help="The number of threads used to compress a \"tgz\", \"zst\" or \"zip\" bag archive. With more than one "
+             "thread, a \"tgz\" or \"zst\" archive is compressed in independent blocks in parallel, and the members "
+             "of a \"zip\" archive are compressed concurrently. Overrides the \"bag_archive_threads\" configuration "
+             "parameter, which defaults to 1.")
+
     idempotent_arg = "--idempotent"
     standard_args.add_argument(
         idempotent_arg, action="store_true",
@@ -125,6 +134,13 @@ def parse_cli():
                  "regenerated, with payload manifests and fetch.txt (if any) left as is. This argument should be used "
                  "when only bag metadata has changed." % update_arg))
 
+    incremental_arg = "--incremental"
+    standard_args.add_argument(
+        incremental_arg, action='store_true',
+        help=str("If \'incremental\' is specified in conjunction with %s, only payload files that have been added, "
+                 "modified, or replaced since the payload manifests were last generated will have their checksums "
+                 "calculated. Existing manifest entries are reused for all other payload files." % update_arg))
+
     prune_manifests_arg = "--prune-manifests"
     standard_args.add_argument(
         prune_manifests_arg, action='store_true',
@@ -161,13 +177,51 @@ def parse_cli():
 
     validate_arg = "--validate"
     standard_args.add_argument(
-        validate_arg, choices=['fast', 'full', 'structure', 'completeness'],
+        validate_arg, choices=['fast', 'full', 'sample', 'structure', 'completeness'],
         help="Validate a bag directory or bag archive. If \"fast\" is specified, Payload-Oxum (if present) will be "
              "used to check that the payload files are present and accounted for. If \"full\" is specified, "
              "all checksums will be regenerated and compared to the corresponding entries in the manifest. " 
+             "If \"sample\" is specified, checksums will be regenerated for a random subset of the payload files, as "
+             "selected by the %s, %s, %s and %s arguments. "
              "If \"structure\" is specified, the bag will be checked for structural validity only. If \"completeness\" "
              "is specified, the bag will be checked for both structural validity and completeness (presence) of files "
-             "listed in all manifests.")
+             "listed in all manifests." % ("--sample-size", "--sample-bytes", "--sample-seed", "--sample-recent"))
+
+    sample_size_arg = "--sample-size"
+    standard_args.add_argument(
+        sample_size_arg, metavar="<count>", type=int,
+        help="The maximum number of payload files checked by \"sample\" validation. Defaults to %d if %s is not "
+             "specified." % (DEFAULT_SAMPLE_COUNT, "--sample-bytes"))
+
+    sample_bytes_arg = "--sample-bytes"
+    standard_args.add_argument(
+        sample_bytes_arg, metavar="<bytes>", type=int,
+        help="The maximum total size in bytes of the payload files checked by \"sample\" validation.")
+
+    sample_seed_arg = "--sample-seed"
+    standard_args.add_argument(
+        sample_seed_arg, metavar="<seed>", type=int,
+        help="The random seed used to select the payload files checked by \"sample\" validation. The same seed "
+             "selects the same files. If not specified, a random seed is used and logged.")
+
+    sample_recent_arg = "--sample-recent"
+    standard_args.add_argument(
+        sample_recent_arg, action="store_true",
+        help="Weight the selection of payload files checked by \"sample\" validation towards recently modified files.")
+
+    fail_fast_arg = "--fail-fast"
+    standard_args.add_argument(
+        fail_fast_arg, action="store_true",
+        help="Stop \"full\" or \"sample\" validation at the first checksum mismatch, instead of recalculating the "
+             "checksums of all remaining files in order to report every mismatch.")
+
+    validate_filter_arg = "--validate-filter"
+    standard_args.add_argument(
+        validate_filter_arg, metavar="<column><operator><value>",
+        help="Restrict \"full\" validation to the payload files matching a simple expression of the form "
+             "<column><operator><value>, where: <column> is the name of a column in the bag's fetch.txt (url, length, "
+             "or filename) to be filtered on, <operator> is one of the following tokens; %s, and <value> is a string "
+             "pattern or integer to be filtered against. Tag files are always validated." % FILTER_DOCSTRING)
 
     validate_profile_arg = "--validate-profile"
     standard_args.add_argument(
@@ -249,6 +303,11 @@ def parse_cli():
         sys.stderr.write("Error: A bag archive can only be created on directories.\n\n")
         sys.exit(2)
 
+    if args.compression_threads is not None and args.archiver not in ("tgz", "zst", "zip"):
+        sys.stderr.write("Error: The %s argument can only be used with the %s argument set to \"tgz\", \"zst\" "
+                         "or \"zip\".\n\n" % (compression_threads_arg, archiver_arg))
+        sys.exit(2)
+
     if args.checksum and not is_dir:
         sys.stderr.write("Error: A checksum manifest can only be added to a bag directory.\n\n")
         sys.exit(2)
@@ -266,6 +325,23 @@ def parse_cli():
                          (fetch_filter_arg, fetch_arg))
         sys.exit(2)
 
+    if args.fail_fast and args.validate not in ("full", "sample"):
+        sys.stderr.write("Error: The %s argument can only be used with the %s argument set to \"full\" or "
+                         "\"sample\".\n\n" % (fail_fast_arg, validate_arg))
+        sys.exit(2)
+
+    if args.validate_filter and args.validate not in ("full", "sample"):
+        sys.stderr.write("Error: The %s argument can only be used with the %s argument set to \"full\" or "
+                         "\"sample\".\n\n" % (validate_filter_arg, validate_arg))
+        sys.exit(2)
+
+    for arg, value in ((sample_size_arg, args.sample_size), (sample_bytes_arg, args.sample_bytes),
+                       (sample_seed_arg, args.sample_seed), (sample_recent_arg, args.sample_recent)):
+        if value not in (None, False) and args.validate != "sample":
+            sys.stderr.write("Error: The %s argument can only be used with the %s argument set to \"sample\".\n\n" %
+                             (arg, validate_arg))
+            sys.exit(2)
+
     if args.resolve_fetch and not is_dir:
         sys.stderr.write("Error: Resolving remote files using %s can only target bag directories.\n\n" %
                          fetch_arg)
@@ -312,6 +388,16 @@ def parse_cli():
                          (skip_manifests_arg, update_arg))
         sys.exit(2)
 
+    if args.incremental and not args.update:
+        sys.stderr.write("Error: Specifying %s requires the %s argument.\n\n" %
+                         (incremental_arg, update_arg))
+        sys.exit(2)
+
+    if args.incremental and args.skip_manifests:
+        sys.stderr.write("Error: The %s argument is not compatible with the %s argument.\n\n" %
+                         (incremental_arg, skip_manifests_arg))
+        sys.exit(2)
+
     if BAG_METADATA and not args.update and is_bag:
         sys.stderr.write("Error: Adding or modifying metadata %s for an existing bag requires the %s argument "
                          "in order to apply any changes.\n\n" % (BAG_METADATA, update_arg))
@@ -380,7 +466,8 @@ def main():
                              config_file=args.config_file,
                              ro_metadata_file=args.ro_metadata_file,
                              idempotent=args.idempotent,
-                             strict=args.strict)
+                             strict=args.strict,
+                             incremental=args.incremental)
 
         # otherwise just extract the bag if it is an archive and no other conflicting options specified
         elif not (args.validate or args.validate_profile or args.resolve_fetch):
@@ -416,10 +503,18 @@ def main():
             else:
                 bdb.validate_bag(temp_path if temp_path else path,
                                  fast=True if args.validate == 'fast' else False,
-                                 config_file=args.config_file)
+                                 config_file=args.config_file,
+                                 fail_fast=args.fail_fast,
+                                 filter_expr=args.validate_filter,
+                                 sample=ValidationSample(count=args.sample_size,
+                                                         bytes=args.sample_bytes,
+                                                         seed=args.sample_seed,
+                                                         weight_recent=args.sample_recent)
+                                 if args.validate == 'sample' else None)
 
         if args.archiver:
-            archive = bdb.archive_bag(path, args.archiver, config_file=args.config_file, idempotent=args.idempotent)
+            archive = bdb.archive_bag(path, args.archiver, config_file=args.config_file, idempotent=args.idempotent,
+                                      threads=args.compression_threads)
 
         if archive is None and is_file:
             archive = path
@@ -32,14 +32,65 @@ BAG_CONFIG_TAG = "bag_config"
 BAG_SPEC_VERSION_TAG = "bagit_spec_version"
 BAG_ALGORITHMS_TAG = "bag_algorithms"
 BAG_PROCESSES_TAG = "bag_processes"
+BAG_EXECUTOR_TAG = "bag_executor"
 BAG_METADATA_TAG = "bag_metadata"
 BAG_ARCHIVE_IDEMPOTENT = "bag_archive_idempotent"
+BAG_ARCHIVE_THREADS_TAG = "bag_archive_threads"
+BAG_ARCHIVE_ZSTD_LEVEL_TAG = "bag_archive_zstd_level"
+BAG_ARCHIVE_ZIP_STORE_TAG = "bag_archive_zip_store"
+BAG_ARCHIVE_ZIP_STORE_ENABLED_TAG = "enabled"
+BAG_ARCHIVE_ZIP_STORE_EXTENSIONS_TAG = "extensions"
+BAG_ARCHIVE_ZIP_STORE_MIME_TYPES_TAG = "mime_types"
+BAG_ARCHIVE_ZIP_STORE_PROBE_BYTES_TAG = "probe_bytes"
+BAG_ARCHIVE_ZIP_STORE_PROBE_RATIO_TAG = "probe_ratio"
+BAG_COMPACT_MANIFESTS_TAG = "bag_compact_manifests"
+BAG_FIXITY_CACHE_TAG = "bag_fixity_cache"
+BAG_FIXITY_CACHE_ENABLED_TAG = "enabled"
+BAG_FIXITY_CACHE_PATH_TAG = "path"
+BAG_FIXITY_CACHE_MAX_ENTRIES_TAG = "max_entries"
+BAG_FIXITY_CACHE_MAX_AGE_DAYS_TAG = "max_age_days"
+BAG_FIXITY_CACHE_TRUST_ON_VALIDATE_TAG = "trust_on_validate"
+BAG_VALIDATION_CHECKPOINT_TAG = "bag_validation_checkpoint"
+BAG_VALIDATION_CHECKPOINT_ENABLED_TAG = "enabled"
+BAG_VALIDATION_CHECKPOINT_STATE_DIR_TAG = "state_dir"
+BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG = "interval_entries"
+BAG_VALIDATION_CHECKPOINT_INTERVAL_SECONDS_TAG = "interval_seconds"
 CONFIG_VERSION_TAG = "bdbag_config_version"
 ENABLE_UNFILTERED_TAR_EXTRACTION_TAG = "enable_unfiltered_tar_extraction"
 DEFAULT_BAG_SPEC_VERSION = "0.97"
+DEFAULT_BAG_EXECUTOR = "processes"
 DEFAULT_CONFIG_FILE_ENVAR = "BDBAG_CONFIG_FILE"
 DEFAULT_CONFIG_FILE = os.path.join(DEFAULT_CONFIG_PATH, 'bdbag.json')
 DEFAULT_BAG_ALGORITHMS = ['md5', 'sha256']
+DEFAULT_FIXITY_CACHE_FILE = os.path.join(DEFAULT_CONFIG_PATH, 'fixity-cache.db')
+DEFAULT_FIXITY_CACHE_CONFIG = {
+    BAG_FIXITY_CACHE_ENABLED_TAG: False,
+    BAG_FIXITY_CACHE_PATH_TAG: DEFAULT_FIXITY_CACHE_FILE,
+    BAG_FIXITY_CACHE_MAX_ENTRIES_TAG: 1000000,
+    BAG_FIXITY_CACHE_MAX_AGE_DAYS_TAG: 90,
+    BAG_FIXITY_CACHE_TRUST_ON_VALIDATE_TAG: False
+}
+DEFAULT_ZIP_STORE_CONFIG = {
+    BAG_ARCHIVE_ZIP_STORE_ENABLED_TAG: False,
+    BAG_ARCHIVE_ZIP_STORE_EXTENSIONS_TAG: [
+        "7z", "avif", "bam", "bcf", "bgz", "bz2", "cram", "docx", "flac", "gif", "gz", "heic", "jar", "jpeg", "jpg",
+        "jp2", "lz4", "m4a", "mkv", "mov", "mp3", "mp4", "npz", "odt", "ogg", "parquet", "png", "pptx", "rar", "sra",
+        "tbi", "tgz", "webm", "webp", "xlsx", "xz", "zip", "zst"
+    ],
+    BAG_ARCHIVE_ZIP_STORE_MIME_TYPES_TAG: [
+        "application/gzip", "application/zip", "application/zstd", "application/x-7z-compressed",
+        "application/x-bzip2", "application/x-xz", "audio/*", "image/gif", "image/jpeg", "image/png", "image/webp",
+        "video/*"
+    ],
+    BAG_ARCHIVE_ZIP_STORE_PROBE_BYTES_TAG: 65536,
+    BAG_ARCHIVE_ZIP_STORE_PROBE_RATIO_TAG: 0.95
+}
+DEFAULT_VALIDATION_CHECKPOINT_CONFIG = {
+    BAG_VALIDATION_CHECKPOINT_ENABLED_TAG: False,
+    BAG_VALIDATION_CHECKPOINT_STATE_DIR_TAG: None,
+    BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG: 1000,
+    BAG_VALIDATION_CHECKPOINT_INTERVAL_SECONDS_TAG: 60
+}
 
 COOKIE_JAR_TAG = "http_cookies"
 COOKIE_JAR_SEARCH_TAG = "scan_for_cookie_files"
@@ -58,6 +109,24 @@ DEFAULT_COOKIE_JAR_SEARCH_CONFIG = {
 
 FETCH_CONFIG_TAG = "fetch_config"
 FETCH_HTTP_REDIRECT_STATUS_CODES_TAG = "redirect_status_codes"
+FETCH_CONCURRENCY_TAG = "concurrency"
+FETCH_MAX_WORKERS_TAG = "max_workers"
+FETCH_MAX_WORKERS_PER_HOST_TAG = "max_workers_per_host"
+FETCH_MAX_WORKERS_PER_SCHEME_TAG = "max_workers_per_scheme"
+DEFAULT_FETCH_CONCURRENCY_CONFIG = {
+    FETCH_MAX_WORKERS_TAG: 1,
+    FETCH_MAX_WORKERS_PER_HOST_TAG: 4,
+    FETCH_MAX_WORKERS_PER_SCHEME_TAG: {}
+}
+FETCH_VERIFICATION_TAG = "verification"
+FETCH_VERIFY_ON_ARRIVAL_TAG = "verify_on_arrival"
+FETCH_MAX_REFETCH_ATTEMPTS_TAG = "max_refetch_attempts"
+FETCH_REFETCH_ALTERNATE_URLS_TAG = "refetch_from_alternate_urls"
+DEFAULT_FETCH_VERIFICATION_CONFIG = {
+    FETCH_VERIFY_ON_ARRIVAL_TAG: True,
+    FETCH_MAX_REFETCH_ATTEMPTS_TAG: 2,
+    FETCH_REFETCH_ALTERNATE_URLS_TAG: True
+}
 DEFAULT_FETCH_HTTP_REDIRECT_STATUS_CODES = [301, 302, 303, 307, 308]
 DEFAULT_FETCH_HTTP_SESSION_CONFIG = {
     "retry_connect": 2,
@@ -66,10 +135,16 @@ DEFAULT_FETCH_HTTP_SESSION_CONFIG = {
     "retry_status_forcelist": [500, 502, 503, 504]
 }
 DEFAULT_FETCH_CONFIG = {
+    FETCH_CONCURRENCY_TAG: DEFAULT_FETCH_CONCURRENCY_CONFIG,
+    FETCH_VERIFICATION_TAG: DEFAULT_FETCH_VERIFICATION_CONFIG,
     "http": {
         "session_config": DEFAULT_FETCH_HTTP_SESSION_CONFIG,
         "allow_redirects": True,
         "redirect_status_codes": DEFAULT_FETCH_HTTP_REDIRECT_STATUS_CODES,
+        "resume_partial_downloads": True,
+        "max_resume_attempts": 3,
+        "segment_connections": 1,
+        "segment_size": 100 * Megabyte,
         COOKIE_JAR_TAG: DEFAULT_COOKIE_JAR_SEARCH_CONFIG
 
     },
@@ -78,13 +153,21 @@ DEFAULT_FETCH_CONFIG = {
         "allow_redirects": True,
         "bypass_ssl_cert_verification": False,
         "redirect_status_codes": DEFAULT_FETCH_HTTP_REDIRECT_STATUS_CODES,
+        "resume_partial_downloads": True,
+        "max_resume_attempts": 3,
+        "segment_connections": 1,
+        "segment_size": 100 * Megabyte,
         COOKIE_JAR_TAG: DEFAULT_COOKIE_JAR_SEARCH_CONFIG
 
     },
     "s3": {
         "read_chunk_size": 10 * Megabyte,
         "read_timeout_seconds": 60,
-        "max_read_retries": 3
+        "max_read_retries": 3,
+        "credential_refresh_margin_seconds": 300,
+        "max_concurrency": 1,
+        "multipart_threshold": 100 * Megabyte,
+        "multipart_chunksize": 100 * Megabyte
     },
     "gs": {
         "default_project_id": None
@@ -142,6 +225,13 @@ DEFAULT_CONFIG = {
             BAG_SPEC_VERSION_TAG: DEFAULT_BAG_SPEC_VERSION,
             BAG_ALGORITHMS_TAG: DEFAULT_BAG_ALGORITHMS,
             BAG_PROCESSES_TAG: 1,
+            BAG_EXECUTOR_TAG: DEFAULT_BAG_EXECUTOR,
+            BAG_COMPACT_MANIFESTS_TAG: False,
+            BAG_ARCHIVE_THREADS_TAG: 1,
+            BAG_ARCHIVE_ZSTD_LEVEL_TAG: 3,
+            BAG_ARCHIVE_ZIP_STORE_TAG: DEFAULT_ZIP_STORE_CONFIG,
+            BAG_FIXITY_CACHE_TAG: DEFAULT_FIXITY_CACHE_CONFIG,
+            BAG_VALIDATION_CHECKPOINT_TAG: DEFAULT_VALIDATION_CHECKPOINT_CONFIG,
             BAG_METADATA_TAG:
                 {
                     BAG_PROFILE_TAG: BDBAG_PROFILE_ID
@@ -0,0 +1,301 @@
+#
+# Copyright 2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import time
+import json
+import errno
+import sqlite3
+import hashlib
+import logging
+from bdbag import stob, get_typed_exception
+from bdbag.bdbag_config import BAG_FIXITY_CACHE_TAG, BAG_FIXITY_CACHE_ENABLED_TAG, BAG_FIXITY_CACHE_PATH_TAG, \
+    BAG_FIXITY_CACHE_MAX_ENTRIES_TAG, BAG_FIXITY_CACHE_MAX_AGE_DAYS_TAG, BAG_FIXITY_CACHE_TRUST_ON_VALIDATE_TAG, \
+    DEFAULT_FIXITY_CACHE_CONFIG, DEFAULT_FIXITY_CACHE_FILE, BAG_VALIDATION_CHECKPOINT_TAG, \
+    BAG_VALIDATION_CHECKPOINT_ENABLED_TAG, BAG_VALIDATION_CHECKPOINT_STATE_DIR_TAG, \
+    BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG, BAG_VALIDATION_CHECKPOINT_INTERVAL_SECONDS_TAG, \
+    DEFAULT_VALIDATION_CHECKPOINT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Files modified more recently than this are not cached: a subsequent write landing within the filesystem's timestamp
+# granularity could otherwise change the file contents without changing the recorded modification time.
+RACY_MTIME_WINDOW_NS = 2 * 10 ** 9
+
+
+class FixityCache(object):
+    """
+    A persistent, SQLite backed cache of file digests, keyed by (device, inode, size, mtime_ns, algorithm). A file
+    whose size or modification time has changed since its digests were recorded simply misses the cache.
+    """
+
+    def __init__(self,
+                 path=DEFAULT_FIXITY_CACHE_FILE,
+                 max_entries=DEFAULT_FIXITY_CACHE_CONFIG[BAG_FIXITY_CACHE_MAX_ENTRIES_TAG],
+                 max_age_days=DEFAULT_FIXITY_CACHE_CONFIG[BAG_FIXITY_CACHE_MAX_AGE_DAYS_TAG]):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+
+        cache_dir = os.path.dirname(self.path)
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir, mode=0o750)
+            except OSError as error:  # pragma: no cover
+                if error.errno != errno.EEXIST:
+                    raise
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fixity ("
+            "dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "alg TEXT NOT NULL, digest TEXT NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (dev, ino, size, mtime_ns, alg))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS fixity_last_used ON fixity (last_used)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def stat(path):
+        """
+        Returns the cache key for the file at the given path, or None if the file cannot be stat'ed.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, key, algorithms):
+        """
+        Returns a dict of hex digests for all of the requested algorithms, or None unless every one of them is cached.
+        """
+        if key is None:
+            self.misses += 1
+            return None
+        rows = self.connection.execute(
+            "SELECT alg, digest FROM fixity WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", key).fetchall()
+        digests = dict(rows)
+        if not algorithms or not all(alg.lower() in digests for alg in algorithms):
+            self.misses += 1
+            return None
+        self.connection.execute(
+            "UPDATE fixity SET last_used=? WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", (time.time(),) + key)
+        self.hits += 1
+        return dict((alg, digests[alg.lower()]) for alg in algorithms)
+
+    def put(self, key, digests):
+        """
+        Records the hex digests computed for the file identified by key. Returns False if the file was modified too
+        recently for its modification time to be trusted, in which case nothing is recorded.
+        """
+        if key is None or time.time_ns() - key[3] < RACY_MTIME_WINDOW_NS:
+            return False
+        dev, ino, size, mtime_ns = key
+        now = time.time()
+        # any digests recorded for a previous version of the same file are now stale
+        self.connection.execute(
+            "DELETE FROM fixity WHERE dev=? AND ino=? AND (size!=? OR mtime_ns!=?)", (dev, ino, size, mtime_ns))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO fixity (dev, ino, size, mtime_ns, alg, digest, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(dev, ino, size, mtime_ns, alg.lower(), digest.lower(), now) for alg, digest in digests.items()])
+        return True
+
+    def prune(self):
+        if self.max_age_days:
+            self.connection.execute("DELETE FROM fixity WHERE last_used < ?",
+                                    (time.time() - float(self.max_age_days) * 86400,))
+        if self.max_entries:
+            self.connection.execute(
+                "DELETE FROM fixity WHERE rowid NOT IN "
+                "(SELECT rowid FROM fixity ORDER BY last_used DESC LIMIT ?)", (int(self.max_entries),))
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.prune()
+            self.connection.commit()
+        finally:
+            self.connection.close()
+            self.connection = None
+        logger.debug("Fixity cache %s: %d hits, %d misses" % (self.path, self.hits, self.misses))
+
+
+def get_fixity_cache(bag_config, validation=False):
+    """
+    Returns a FixityCache configured from the "bag_fixity_cache" object of the given bag_config, or None if the cache
+    is not enabled. When validation is True, the cache is only returned if "trust_on_validate" is also enabled, since
+    trusting cached digests during validation means unchanged files are not re-read and silent corruption of their
+    contents will not be detected.
+    """
+    cache_config = (bag_config or {}).get(BAG_FIXITY_CACHE_TAG) or {}
+    if not stob(cache_config.get(BAG_FIXITY_CACHE_ENABLED_TAG, False)):
+        return None
+    if validation and not stob(cache_config.get(BAG_FIXITY_CACHE_TRUST_ON_VALIDATE_TAG, False)):
+        return None
+    path = cache_config.get(BAG_FIXITY_CACHE_PATH_TAG) or DEFAULT_FIXITY_CACHE_FILE
+    try:
+        return FixityCache(path,
+                           max_entries=cache_config.get(BAG_FIXITY_CACHE_MAX_ENTRIES_TAG,
+                                                        DEFAULT_FIXITY_CACHE_CONFIG[BAG_FIXITY_CACHE_MAX_ENTRIES_TAG]),
+                           max_age_days=cache_config.get(BAG_FIXITY_CACHE_MAX_AGE_DAYS_TAG,
+                                                         DEFAULT_FIXITY_CACHE_CONFIG[
+                                                             BAG_FIXITY_CACHE_MAX_AGE_DAYS_TAG]))
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Unable to open fixity cache [%s], continuing without it: %s" % (path, get_typed_exception(e)))
+        return None
+
+
+class ValidationCheckpoint(object):
+    """
+    An append-only journal (JSON lines) of the payload files verified by a full validation of a bag, so that a
+    validation which is interrupted can be resumed without re-hashing the files it had already verified. Each record
+    holds the file's path, its stat signature (device, inode, size, mtime_ns) and the digests that were calculated.
+    Records are buffered, and appended to the journal every interval_entries records or interval_seconds seconds,
+    whichever comes first. A file whose stat signature has changed since it was recorded is verified again.
+    """
+
+    def __init__(self,
+                 path,
+                 interval_entries=DEFAULT_VALIDATION_CHECKPOINT_CONFIG[BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG],
+                 interval_seconds=DEFAULT_VALIDATION_CHECKPOINT_CONFIG[BAG_VALIDATION_CHECKPOINT_INTERVAL_SECONDS_TAG]):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.interval_entries = interval_entries
+        self.interval_seconds = interval_seconds
+        self.records = dict()
+        self.pending = list()
+        self.last_flush = time.monotonic()
+
+        if os.path.isfile(self.path):
+            with open(self.path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                        self.records[record["path"]] = record
+                    except (ValueError, KeyError, TypeError):
+                        # a partially written last line is expected if the process was killed while appending to it
+                        continue
+            logger.info("Resuming validation from checkpoint journal %s with %d verified files" %
+                        (self.path, len(self.records)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def get_journal_path(bag_path, state_dir=None):
+        """
+        Returns the path of the checkpoint journal for the bag at bag_path. The journal is placed next to the bag
+        directory unless a state_dir is given, in which case its name includes a hash of the bag's absolute path.
+        """
+        bag_path = os.path.abspath(bag_path)
+        name = os.path.basename(bag_path.rstrip(os.sep))
+        if not state_dir:
+            return os.path.join(os.path.dirname(bag_path), ".%s.validation-checkpoint.jsonl" % name)
+        return os.path.join(os.path.abspath(os.path.expanduser(state_dir)), "%s-%s.validation-checkpoint.jsonl" %
+                            (name, hashlib.sha1(bag_path.encode("utf-8")).hexdigest()[:16]))
+
+    def get(self, rel_path, key, algorithms):
+        """
+        Returns the recorded digests of the file at rel_path for all of the requested algorithms, or None unless the
+        file was recorded with the same stat signature and digests for every one of them.
+        """
+        record = self.records.get(rel_path)
+        if not record or key is None or tuple(record.get("stat", ())) != tuple(key):
+            return None
+        digests = record.get("digests", {})
+        if not algorithms or not all(alg in digests for alg in algorithms):
+            return None
+        return dict((alg, digests[alg]) for alg in algorithms)
+
+    def put(self, rel_path, key, digests):
+        """
+        Records the digests verified for the file at rel_path, and appends the pending records to the journal if the
+        checkpoint interval has elapsed.
+        """
+        if key is None:
+            return
+        record = {"path": rel_path, "stat": list(key), "size": key[2], "mtime_ns": key[3],
+                  "digests": dict(digests), "result": "ok"}
+        self.records[rel_path] = record
+        self.pending.append(record)
+        if len(self.pending) >= self.interval_entries or \
+                time.monotonic() - self.last_flush >= self.interval_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        journal_dir = os.path.dirname(self.path)
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as journal:
+            journal.writelines(json.dumps(record) + "\n" for record in self.pending)
+            journal.flush()
+            os.fsync(journal.fileno())
+        logger.debug("Appended %d records to validation checkpoint journal %s" % (len(self.pending), self.path))
+        self.pending = list()
+
+    def remove(self):
+        """
+        Discards the journal once validation has completed, so that the next validation verifies every file again.
+        """
+        self.pending = list()
+        self.records = dict()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        try:
+            self.flush()
+        except OSError as e:
+            logger.warning("Unable to write validation checkpoint journal [%s]: %s" %
+                           (self.path, get_typed_exception(e)))
+
+
+def get_validation_checkpoint(bag_config, bag_path):
+    """
+    Returns a ValidationCheckpoint for the bag at bag_path, configured from the "bag_validation_checkpoint" object of
+    the given bag_config, or None if checkpointing is not enabled.
+    """
+    checkpoint_config = (bag_config or {}).get(BAG_VALIDATION_CHECKPOINT_TAG) or {}
+    if not stob(checkpoint_config.get(BAG_VALIDATION_CHECKPOINT_ENABLED_TAG, False)):
+        return None
+    path = ValidationCheckpoint.get_journal_path(bag_path,
+                                                 checkpoint_config.get(BAG_VALIDATION_CHECKPOINT_STATE_DIR_TAG))
+    try:
+        return ValidationCheckpoint(
+            path,
+            interval_entries=checkpoint_config.get(
+                BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG,
+                DEFAULT_VALIDATION_CHECKPOINT_CONFIG[BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG]),
+            interval_seconds=checkpoint_config.get(
+                BAG_VALIDATION_CHECKPOINT_INTERVAL_SECONDS_TAG,
+                DEFAULT_VALIDATION_CHECKPOINT_CONFIG[BAG_VALIDATION_CHECKPOINT_INTERVAL_SECONDS_TAG]))
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning("Unable to read validation checkpoint journal [%s], continuing without it: %s" %
+                       (path, get_typed_exception(e)))
+        return None
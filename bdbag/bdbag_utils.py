@@ -27,15 +27,27 @@ from collections import namedtuple
 from csv import DictReader, Sniffer
 from bdbag import bdbag_api as bdb, parse_content_disposition, urlsplit, filter_dict, FILTER_DOCSTRING
 from bdbag import get_typed_exception as gte
+from bdbag import bdbag_fixity as bdbfx
 from bdbag.fetch.transports.fetch_http import HTTPFetchTransport
 from bdbag.fetch.auth.keychain import read_keychain, DEFAULT_KEYCHAIN_FILE
 from bdbag.bdbag_config import DEFAULT_CONFIG_FILE, DEFAULT_CONFIG_FILE_ENVAR, DEFAULT_FETCH_CONFIG, FETCH_CONFIG_TAG, \
-    read_config
+    BAG_CONFIG_TAG, read_config
 
 logger = logging.getLogger(__name__)
 
 
 def create_rfm_from_filesystem(args):
+    config = read_config(config_file=getattr(args, "config_file", None) or DEFAULT_CONFIG_FILE,
+                         create_default=False)
+    fixity_cache = bdbfx.get_fixity_cache(config.get(BAG_CONFIG_TAG))
+    try:
+        _create_rfm_from_filesystem(args, fixity_cache)
+    finally:
+        if fixity_cache:
+            fixity_cache.close()
+
+
+def _create_rfm_from_filesystem(args, fixity_cache=None):
     with io.open(args.output_file, 'w', encoding='utf-8') as rfm_file:
         rfm = list()
         if not os.path.isdir(args.input_path):
@@ -61,7 +73,7 @@ def create_rfm_from_filesystem(args):
                 rfm_entry["length"] = os.path.getsize(input_file)
                 if args.checksum and 'all' in args.checksum:
                     args.checksum = frozenset(['md5', 'sha1', 'sha256', 'sha512'])
-                rfm_entry.update(compute_file_hashes(input_file, args.checksum))
+                rfm_entry.update(compute_file_hashes(input_file, args.checksum, fixity_cache))
 
                 if not filter_dict(args.filter, rfm_entry):
                     continue
@@ -292,23 +304,40 @@ def compute_hashes(obj, hashes=frozenset(['md5'])):
     return hashes
 
 
-def compute_file_hashes(file_path, hashes=frozenset(['md5'])):
+def compute_file_hashes(file_path, hashes=frozenset(['md5']), fixity_cache=None):
     """
        Digests data read from file denoted by file_path.
+       If a fixity_cache is given, digests of a file unchanged since it was last hashed are taken from the cache.
     """
     if not os.path.exists(file_path):
         logger.warning("%s does not exist" % file_path)
         return
-    else:
-        logger.debug("Computing [%s] hashes for file [%s]" % (','.join(hashes), file_path))
 
+    cache_key = None
+    if fixity_cache:
+        cache_key = fixity_cache.stat(file_path)
+        digests = fixity_cache.get(cache_key, [alg.lower() for alg in hashes])
+        if digests:
+            logger.debug("Using cached [%s] hashes for file [%s]" % (','.join(hashes), file_path))
+            result = dict()
+            for alg, digest in digests.items():
+                result[alg] = digest
+                result[alg + "_base64"] = encode_hex_to_base64(digest)
+            return result
+
+    logger.debug("Computing [%s] hashes for file [%s]" % (','.join(hashes), file_path))
     try:
         with open(file_path, 'rb') as fd:
-            return compute_hashes(fd, hashes)
+            result = compute_hashes(fd, hashes)
     except (IOError, OSError) as e:
         logger.warning("Error while calculating digest(s) for file %s: %s" % (file_path, str(e)))
         raise
 
+    if fixity_cache and fixity_cache.stat(file_path) == cache_key:
+        fixity_cache.put(cache_key, dict((alg, result[alg]) for alg in result if not alg.endswith("_base64")))
+
+    return result
+
 
 def decode_base64_to_hex(base64str):
     result = binascii.hexlify(base64.standard_b64decode(base64str))
@@ -389,6 +418,13 @@ def create_crfm_fs_subparser(subparsers):
              "is specified, the %s argument will be used as-is. The default setting is \"append-path\"" %
              (base_url_arg, base_url_arg))
 
+    parser_crfm_fs.add_argument(
+        '--config-file', default=DEFAULT_CONFIG_FILE, metavar='<file>',
+        help="Optional path to a configuration file. If this argument is not specified, the configuration file "
+             "will be set to the value of the environment variable %s (if present) or otherwise default to: %s. "
+             "If the fixity cache is enabled in the configuration file, digests of files unchanged since they were "
+             "last hashed are taken from the cache." % (DEFAULT_CONFIG_FILE_ENVAR, DEFAULT_CONFIG_FILE))
+
     streaming_json_arg = "--streaming-json"
     parser_crfm_fs.add_argument(
         streaming_json_arg, action='store_true', default=False,
@@ -15,17 +15,61 @@
 #
 import time
 import json
-from collections import OrderedDict
+import math
+import stat
+import heapq
+import itertools
+import random
+import tempfile
+import multiprocessing.pool
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 import bagit
 from bagit import *
 from bagit import (_, _can_read, _can_bag, _make_tagmanifest_file, _encode_filename, _decode_filename, _calc_hashes,
                    _walk)
-from bdbag import escape_uri, urlunquote, VERSION, BAGIT_VERSION, PROJECT_URL
+from bdbag import escape_uri, urlunquote, filter_dict, VERSION, BAGIT_VERSION, PROJECT_URL
+from bdbag.bdbag_fixity import FixityCache
+from bdbag.fetch import PARTIAL_FILE_SUFFIX, PARTIAL_STATE_SUFFIX
 
 LOGGER = logging.getLogger(__name__)
 
 SUPPORTED_BAGIT_SPECS = ["0.97", "1.0"]
 
+# Safety margin applied when comparing file timestamps against the time payload manifests were generated, to allow for
+# coarse filesystem timestamp granularity.
+MANIFEST_MTIME_MARGIN_NS = 2 * 10 ** 9
+
+# The executors that can be used to calculate file fixities concurrently. Threads avoid the cost of starting worker
+# processes and pickling results, and hashlib releases the GIL while hashing, so they are often the better choice for
+# bags with many small files. Processes are the default for compatibility.
+SERIAL_EXECUTOR = "serial"
+THREADS_EXECUTOR = "threads"
+PROCESSES_EXECUTOR = "processes"
+SUPPORTED_EXECUTORS = [SERIAL_EXECUTOR, THREADS_EXECUTOR, PROCESSES_EXECUTOR]
+DEFAULT_EXECUTOR = PROCESSES_EXECUTOR
+
+# When checksums are calculated concurrently, files smaller than HASHING_BATCH_BYTES are grouped into batches of up to
+# HASHING_BATCH_BYTES total size and HASHING_BATCH_MAX_FILES files, each dispatched to a worker as a single task.
+HASHING_BATCH_BYTES = 4 * 1024 * 1024
+HASHING_BATCH_MAX_FILES = 256
+HASHING_TASKS_PER_WORKER = 4
+
+# Payload manifests are written as checksums are calculated rather than after all of them have been collected. When
+# sorted, at most MANIFEST_SORT_BUFFER_LINES lines per manifest are held in memory; larger manifests are sorted in runs
+# that are spilled to temporary files and then merged.
+MANIFEST_SORT_BUFFER_LINES = 100000
+
+# Sample validation hashes a random subset of the payload files, selected by file count and/or a byte budget. The
+# selection is reproducible for a given seed, and can be weighted so that the most recently modified files are up to
+# SAMPLE_RECENT_WEIGHT times as likely to be selected as the least recently modified. The default sample size of 300
+# files is enough to bound the fraction of corrupt files to about 1% with SAMPLE_CONFIDENCE if no mismatch is found.
+ValidationSample = namedtuple("ValidationSample", ["count", "bytes", "seed", "weight_recent"],
+                              defaults=[None, None, None, False])
+DEFAULT_SAMPLE_COUNT = 300
+SAMPLE_RECENT_WEIGHT = 4.0
+SAMPLE_CONFIDENCE = 0.95
+
 
 def parse_version(version):
     try:
@@ -36,22 +80,135 @@ def parse_version(version):
         )
 
 
+def check_executor(executor):
+    if executor not in SUPPORTED_EXECUTORS:
+        raise RuntimeError(_("Unsupported executor: %(executor)s. Supported executors are: %(supported)s") %
+                           {"executor": executor, "supported": ", ".join(SUPPORTED_EXECUTORS)})
+
+
+def make_worker_pool(processes, executor=DEFAULT_EXECUTOR, initializer=None):
+    """
+    Returns a worker pool of the given executor type, or None if work should be performed serially in the calling
+    thread. A processes value of 0 or None uses as many workers as there are CPUs.
+    """
+    check_executor(executor)
+    if executor == SERIAL_EXECUTOR or processes == 1:
+        return None
+    if executor == THREADS_EXECUTOR:
+        return multiprocessing.pool.ThreadPool(processes if processes else None)
+    return multiprocessing.Pool(processes if processes else None, initializer=initializer)
+
+
+def _calc_batch(batch, func):
+    return [(index, func(arg)) for index, arg in batch]
+
+
+def schedule_tasks(sizes, workers=None):
+    """
+    Groups the indexes of a list of files with the given sizes into tasks for a worker pool, ordered largest first so
+    that the largest files are never left to be processed by a single worker after all the others have finished. Files
+    smaller than HASHING_BATCH_BYTES are packed into batches so that the cost of dispatching each task to a worker is
+    shared by several files, while leaving at least HASHING_TASKS_PER_WORKER tasks for each worker.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i], i))
+    workers = workers if workers else (os.cpu_count() or 1)
+    small = sum(1 for size in sizes if size < HASHING_BATCH_BYTES)
+    max_batch_files = max(1, min(HASHING_BATCH_MAX_FILES, small // (workers * HASHING_TASKS_PER_WORKER)))
+
+    tasks = list()
+    batch = list()
+    batch_bytes = 0
+    for index in order:
+        if sizes[index] >= HASHING_BATCH_BYTES:
+            tasks.append([index])
+            continue
+        batch.append(index)
+        batch_bytes += sizes[index]
+        if batch_bytes >= HASHING_BATCH_BYTES or len(batch) >= max_batch_files:
+            tasks.append(batch)
+            batch = list()
+            batch_bytes = 0
+    if batch:
+        tasks.append(batch)
+
+    return tasks
+
+
+def imap_largest_first(pool, func, args, sizes, workers=None):
+    """
+    Applies func to each of args using the given worker pool, scheduled by schedule_tasks. Yields (index, result)
+    tuples as each task completes, where index is the position of the argument in args.
+    """
+    tasks = [[(index, args[index]) for index in task] for task in schedule_tasks(sizes, workers)]
+    for results in pool.imap_unordered(partial(_calc_batch, func=func), tasks):
+        for result in results:
+            yield result
+
+
+def map_largest_first(pool, func, args, sizes, workers=None):
+    """
+    Like pool.map(func, args), but scheduled largest first by schedule_tasks. The results are returned in the order
+    of args.
+    """
+    results = [None] * len(args)
+    for index, result in imap_largest_first(pool, func, args, sizes, workers):
+        results[index] = result
+    return results
+
+
+def sample_confidence_bound(population, sample_size, confidence=SAMPLE_CONFIDENCE):
+    """
+    Returns the largest number of corrupt files that a population of files could contain, such that a uniform random
+    sample of sample_size files (drawn without replacement) would still contain none of them with a probability of at
+    least 1 - confidence. In other words, if no corrupt file is found in the sample, the population contains at most
+    this many corrupt files with the given confidence.
+    """
+    if sample_size >= population:
+        return 0
+    if sample_size <= 0:
+        return population
+
+    def log_p_none(corrupt):
+        # log of the hypergeometric probability C(population - corrupt, sample_size) / C(population, sample_size)
+        if population - corrupt < sample_size:
+            return -math.inf
+        return (math.lgamma(population - corrupt + 1) - math.lgamma(population - corrupt - sample_size + 1) -
+                math.lgamma(population + 1) + math.lgamma(population - sample_size + 1))
+
+    threshold = math.log(1 - confidence)
+    low, high = 0, population
+    while low < high:
+        mid = (low + high + 1) // 2
+        if log_p_none(mid) >= threshold:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
 def make_bag(bag_dir,
              bag_info=None,
              processes=1,
              checksums=None,
              encoding='utf-8',
              remote_entries=None,
-             spec_version="0.97"):
+             spec_version="0.97",
+             fixity_cache=None,
+             executor=DEFAULT_EXECUTOR):
     """
     Convert a given directory into a bag. You can pass in arbitrary
     key/value pairs to put into the bag-info.txt metadata file as
     the bag_info dictionary.
+
+    If a fixity_cache is given, digests of payload files that are unchanged since they were last hashed are taken
+    from the cache rather than recalculated. The executor parameter selects whether checksums are calculated
+    serially, or concurrently using a pool of threads or processes.
     """
 
     if spec_version not in SUPPORTED_BAGIT_SPECS:
         raise RuntimeError(_("Unsupported BagIt specfication version: %s" % spec_version))
     bag_version = parse_version(spec_version)
+    check_executor(executor)
 
     if checksums is None:
         checksums = DEFAULT_CHECKSUMS
@@ -74,16 +231,17 @@ def make_bag(bag_dir,
     try:
         # TODO: These two checks are currently redundant since an unreadable directory will also
         #       often be unwritable, and this code will require review when we add the option to
-        #       bag to a destination other than the source. It would be nice if we could avoid
-        #       walking the directory tree more than once even if most filesystems will cache it
+        #       bag to a destination other than the source. The directory tree is only walked once,
+        #       and the same inventory is used to generate the manifests once it is moved to data/
 
-        unbaggable = _can_bag(bag_dir)
+        inventory = PayloadInventory(bag_dir)
+        unbaggable = inventory.unbaggable()
 
         if unbaggable:
             LOGGER.error(_("Unable to write to the following directories and files:\n%s"), unbaggable)
             raise BagError(_("Missing permissions to move all files and directories"))
 
-        unreadable_dirs, unreadable_files = _can_read(bag_dir)
+        unreadable_dirs, unreadable_files = inventory.unreadable()
 
         if unreadable_dirs or unreadable_files:
             if unreadable_dirs:
@@ -127,7 +285,8 @@ def make_bag(bag_dir,
             strict = True if bag_version >= (1, 0) else False
             validate_remote_entries(remote_entries, bag_dir)
             total_bytes, total_files = make_manifests(
-                'data', processes, algorithms=checksums, encoding=encoding, remote=remote_entries, strict=strict)
+                'data', processes, algorithms=checksums, encoding=encoding, remote=remote_entries, strict=strict,
+                fixity_cache=fixity_cache, executor=executor, inventory=inventory.relocate('data'))
 
             _make_fetch_file(bag_dir, remote_entries)
 
@@ -158,62 +317,273 @@ def make_bag(bag_dir,
     return BDBag(bag_dir)
 
 
-def make_manifests(data_dir, processes, algorithms=DEFAULT_CHECKSUMS, encoding='utf-8', remote=None, strict=False):
-    LOGGER.info(_('Using %(process_count)d processes to generate manifests: %(algorithms)s'),
-                {'process_count': processes, 'algorithms': ', '.join(algorithms)})
+def manifest_sort_key(filename):
+    """
+    Returns a key that orders manifest filenames the way _walk lists them: depth first, with the files in each
+    directory sorted by name and listed before its sorted subdirectories.
+    """
+    parts = filename.split("/")
+    return [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+
+
+class _ManifestSorter(object):
+    """
+    Sorts (filename, digest) manifest entries by manifest_sort_key in bounded memory. Entries are buffered until
+    buffer_lines have been added, then the buffer is sorted and spilled to a temporary file as a sorted run. The runs
+    and the remaining buffer are merged when the sorter is iterated.
+    """
+    def __init__(self, buffer_lines=MANIFEST_SORT_BUFFER_LINES):
+        self.buffer_lines = max(1, buffer_lines)
+        self.buffer = list()
+        self.runs = list()
+
+    def add(self, filename, digest):
+        self.buffer.append((filename, digest))
+        if len(self.buffer) >= self.buffer_lines:
+            self._spill()
+
+    def _spill(self):
+        run = tempfile.TemporaryFile(mode="w+", encoding="utf-8", errors="surrogatepass", newline="\n")
+        for filename, digest in sorted(self.buffer, key=lambda entry: manifest_sort_key(entry[0])):
+            run.write("%s\0%s\n" % (_encode_filename(filename), digest))
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = list()
+
+    @staticmethod
+    def _read_run(run):
+        for line in run:
+            filename, digest = line.rstrip("\n").split("\0", 1)
+            yield _decode_filename(filename), digest
+
+    def __iter__(self):
+        key = lambda entry: manifest_sort_key(entry[0])
+        self.buffer.sort(key=key)
+        return heapq.merge(*([self._read_run(run) for run in self.runs] + [iter(self.buffer)]), key=key)
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = list()
+        self.buffer = list()
+
+
+class ManifestWriter(object):
+    """
+    Writes the payload manifests in the current directory incrementally, as the checksums for each file are added,
+    and keeps the Payload-Oxum counters as it goes so that the checksums never need to be held in memory. If sort is
+    True, the lines of each manifest are sorted with a bounded memory external merge sort when the writer is closed,
+    otherwise they are written in the order that they were added. Lines added with append are always written after
+    the other lines, in the order that they were added. The manifests are written to temporary files which only replace
+    the existing manifests once all of them have been written successfully, so an existing manifest is left untouched
+    if the writer is aborted.
+    """
+    def __init__(self, encoding="utf-8", sort=True, sort_buffer_lines=MANIFEST_SORT_BUFFER_LINES):
+        self.encoding = encoding
+        self.sort = sort
+        self.sort_buffer_lines = sort_buffer_lines
+        self.manifests = OrderedDict()
+        self.appended = defaultdict(list)
+        self.outputs = OrderedDict()
+        self.num_files = defaultdict(lambda: 0)
+        self.total_bytes = defaultdict(lambda: 0)
+        self.file_total = 0
+        self.byte_total = 0
+
+    @staticmethod
+    def manifest_filename(algorithm):
+        return 'manifest-%s.txt' % algorithm
+
+    @staticmethod
+    def temp_filename(algorithm):
+        return '.%s.tmp' % ManifestWriter.manifest_filename(algorithm)
+
+    def _output(self, algorithm):
+        output = self.outputs.get(algorithm)
+        if output is None:
+            output = open_text_file(self.temp_filename(algorithm), 'w', encoding=self.encoding)
+            self.outputs[algorithm] = output
+        return output
+
+    def _manifest(self, algorithm):
+        manifest = self.manifests.get(algorithm)
+        if manifest is None:
+            manifest = _ManifestSorter(self.sort_buffer_lines) if self.sort else self._output(algorithm)
+            self.manifests[algorithm] = manifest
+        return manifest
+
+    def _count(self, entries):
+        for algorithm, digest, filename, byte_count in entries:
+            self.num_files[algorithm] += 1
+            self.total_bytes[algorithm] += byte_count
+        if entries:
+            self.file_total += 1
+            self.byte_total += entries[0][3]
+
+    def add(self, entries):
+        """
+        Adds the (algorithm, digest, filename, size) checksum entries of a single file.
+        """
+        for algorithm, digest, filename, byte_count in entries:
+            manifest = self._manifest(algorithm)
+            if self.sort:
+                manifest.add(filename, digest)
+            else:
+                manifest.write("%s  %s\n" % (digest, _encode_filename(filename)))
+        self._count(entries)
+
+    def append(self, entries):
+        """
+        Adds the (algorithm, digest, filename, size) checksum entries of a single file, to be written after all of the
+        entries that are added with add.
+        """
+        for algorithm, digest, filename, byte_count in entries:
+            self._manifest(algorithm)
+            if self.sort:
+                self.appended[algorithm].append((filename, digest))
+            else:
+                self._output(algorithm).write("%s  %s\n" % (digest, _encode_filename(filename)))
+        self._count(entries)
+
+    def close(self, mtime_ns=None):
+        """
+        Finishes writing the manifests, optionally stamping each of them with the given modification time.
+        """
+        try:
+            for algorithm, manifest in self.manifests.items():
+                if self.sort:
+                    output = self._output(algorithm)
+                    for filename, digest in itertools.chain(manifest, self.appended[algorithm]):
+                        output.write("%s  %s\n" % (digest, _encode_filename(filename)))
+                    manifest.close()
+            for output in self.outputs.values():
+                output.close()
+            for algorithm in self.outputs.keys():
+                os.replace(self.temp_filename(algorithm), self.manifest_filename(algorithm))
+                if mtime_ns is not None:
+                    os.utime(self.manifest_filename(algorithm), ns=(mtime_ns, mtime_ns))
+        except Exception:
+            self.abort()
+            raise
+        self.manifests.clear()
+        self.outputs.clear()
+
+    def abort(self):
+        """
+        Discards the manifests being written, leaving any existing manifests in place.
+        """
+        for manifest in self.manifests.values():
+            manifest.close()
+        for algorithm, output in self.outputs.items():
+            output.close()
+            if os.path.isfile(self.temp_filename(algorithm)):
+                os.remove(self.temp_filename(algorithm))
+        self.manifests.clear()
+        self.appended.clear()
+        self.outputs.clear()
+
+
+def make_manifests(data_dir, processes, algorithms=DEFAULT_CHECKSUMS, encoding='utf-8', remote=None, strict=False,
+                   fixity_cache=None, existing=None, executor=DEFAULT_EXECUTOR, inventory=None, sort=True,
+                   sort_buffer_lines=MANIFEST_SORT_BUFFER_LINES):
+    """
+    Generates the payload manifests for the files in data_dir, relative to the current directory. If an inventory
+    (a PayloadInventory of data_dir) is given, it is used to list the files and their sizes instead of walking data_dir.
+    The manifests are streamed to disk by a ManifestWriter as the checksums are calculated. If sort is True (the
+    default) the manifest lines are ordered by manifest_sort_key, otherwise they are written in the order in which the
+    checksums become available. Remote file entries are always written after the local files, sorted by filename.
+    """
+    check_executor(executor)
+    if executor == SERIAL_EXECUTOR:
+        processes = 1
+    LOGGER.info(_('Using %(process_count)d %(executor)s to generate manifests: %(algorithms)s'),
+                {'process_count': processes,
+                 'executor': 'threads' if executor == THREADS_EXECUTOR else 'processes',
+                 'algorithms': ', '.join(algorithms)})
 
     manifest_line_generator = partial(generate_manifest_lines, algorithms=algorithms)
+    start_time_ns = time.time_ns()
 
-    if processes > 1:
-        pool = multiprocessing.Pool(processes=processes)
-        checksums = pool.map(manifest_line_generator, _walk(data_dir))
-        pool.close()
-        pool.join()
+    if inventory is not None:
+        filenames = [entry.path.replace(os.sep, "/") for entry in inventory.files]
+        sizes = dict((filename, entry.size) for filename, entry in zip(filenames, inventory.files))
     else:
-        checksums = [manifest_line_generator(i) for i in _walk(data_dir)]
-
-    # At this point we have a list of tuples which start with the algorithm name:
-    manifest_data = {}
-    for batch in checksums:
-        for entry in batch:
-            manifest_data.setdefault(entry[0], []).append(entry[1:])
-
-    # These will be keyed on the algorithm name so we can perform sanity checks
-    # below to catch failures in the hashing process:
-    num_files = defaultdict(lambda: 0)
-    total_bytes = defaultdict(lambda: 0)
-
-    remote_entries = []
-    if remote:
-        LOGGER.info(_('Generating manifest lines for remote files'))
-        sorted_remote_entries = OrderedDict(sorted(remote.items(), key=lambda t: t[0]))
-        for filename, values in sorted_remote_entries.items():
-            checksums = []
-            remote_size = int(values['length'])
-            for alg in CHECKSUM_ALGOS:
-                if alg in values.keys():
-                    checksums.append(
-                        (alg, values[alg], _denormalize_filename(_decode_filename(filename)), remote_size))
-            remote_entries.append(checksums)
-
-    for batch in remote_entries:
-        for entry in batch:
-            manifest_data.setdefault(entry[0], []).append(entry[1:])
-
-    file_entries = {}
-    for algorithm, values in manifest_data.items():
-        manifest_filename = 'manifest-%s.txt' % algorithm
-
-        with open_text_file(manifest_filename, 'w', encoding=encoding) as manifest:
-            for digest, filename, byte_count in values:
-                manifest.write("%s  %s\n" % (digest, _encode_filename(filename)))
-                num_files[algorithm] += 1
-                total_bytes[algorithm] += byte_count
-                file_entries[filename] = byte_count
+        filenames = [filename for filename in _walk(data_dir) if not is_partial_download(os.path.basename(filename))]
+        sizes = dict()
+
+    def file_size(filename):
+        size = sizes.get(filename)
+        return size if size is not None else os.path.getsize(filename)
+
+    writer = ManifestWriter(encoding=encoding, sort=sort, sort_buffer_lines=sort_buffer_lines)
+    try:
+        # Entries for files whose digests are already known are written immediately, without being collected first
+        uncached = list()
+        reused = cached = 0
+        for filename in filenames:
+            if existing is not None:
+                digests = existing.get(normalize_unicode(os.path.normpath(filename)))
+                if digests and all(alg in digests for alg in algorithms):
+                    writer.add([(alg, digests[alg], _decode_filename(filename), file_size(filename))
+                                for alg in algorithms])
+                    reused += 1
+                    continue
+            if fixity_cache:
+                key = fixity_cache.stat(filename)
+                if key is not None:
+                    sizes.setdefault(filename, key[2])
+                    digests = fixity_cache.get(key, algorithms)
+                    if digests:
+                        writer.add([(alg, digests[alg], _decode_filename(filename), key[2]) for alg in algorithms])
+                        cached += 1
+                        continue
+                uncached.append((filename, key))
+            else:
+                uncached.append((filename, None))
+        if existing is not None:
+            LOGGER.info(_('Reusing existing manifest entries for %(reused)d of %(total)d files'),
+                        {'reused': reused, 'total': len(filenames)})
+        if fixity_cache:
+            LOGGER.info(_('Using cached fixities for %(cached)d of %(total)d files'),
+                        {'cached': cached, 'total': len(filenames)})
+
+        pool = make_worker_pool(processes, executor) if processes > 1 and uncached else None
+        try:
+            if pool:
+                generated = ((uncached[index], batch) for index, batch in
+                             imap_largest_first(pool, manifest_line_generator, [entry[0] for entry in uncached],
+                                                [file_size(entry[0]) for entry in uncached], processes))
+            else:
+                generated = ((entry, manifest_line_generator(entry[0])) for entry in uncached)
+
+            for (filename, key), batch in generated:
+                # only record the digests if the file was not modified while it was being read
+                if fixity_cache and key is not None and fixity_cache.stat(filename) == key:
+                    fixity_cache.put(key, dict((entry[0], entry[1]) for entry in batch))
+                writer.add(batch)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        if remote:
+            LOGGER.info(_('Generating manifest lines for remote files'))
+            for filename, values in sorted(remote.items(), key=lambda t: t[0]):
+                remote_size = int(values['length'])
+                writer.append([(alg, values[alg], _denormalize_filename(_decode_filename(filename)), remote_size)
+                               for alg in CHECKSUM_ALGOS if alg in values.keys()])
+
+        # Stamp the manifests with the time that manifest generation started rather than finished, so that a payload
+        # file modified while the manifests were being generated is never considered unchanged by an incremental
+        # update
+        writer.close(start_time_ns)
+    except BaseException:
+        writer.abort()
+        raise
 
     # We'll use sets of the values for the error checks and eventually return the payload oxum values:
-    byte_value_set = set(total_bytes.values())
-    file_count_set = set(num_files.values())
+    byte_value_set = set(writer.total_bytes.values())
+    file_count_set = set(writer.num_files.values())
 
     # allow a bag with an empty payload
     if not byte_value_set and not file_count_set:
@@ -228,12 +598,7 @@ def make_manifests(data_dir, processes, algorithms=DEFAULT_CHECKSUMS, encoding='
 
         return byte_value_set.pop(), file_count_set.pop()
 
-    byte_total = file_total = 0
-    for file_size in file_entries.values():
-        file_total += 1
-        byte_total += file_size
-
-    return byte_total, file_total
+    return writer.byte_total, writer.file_total
 
 
 def validate_remote_entries(remote_entries, bag_path="."):
@@ -286,6 +651,187 @@ def _make_fetch_file(path, remote_entries):
                               escape_uri(_denormalize_filename(filename), encode_whitespace=False, encode_other=True)))
 
 
+InventoryEntry = namedtuple("InventoryEntry", ["path", "size", "mtime_ns", "mode", "readable", "writable"])
+
+
+def is_partial_download(filename):
+    return filename.endswith(PARTIAL_FILE_SUFFIX) or filename.endswith(PARTIAL_FILE_SUFFIX + PARTIAL_STATE_SUFFIX)
+
+
+class PayloadInventory(object):
+    """
+    The result of a single os.scandir walk of the directory top (relative to base_dir), recording the path (relative to
+    base_dir), size, modification time, mode, and readability of every file, and the readability and writability of
+    every directory. An inventory is built once and shared by the permission checks, manifest generation, and the
+    Payload-Oxum and completeness checks, so that each of them does not walk (and stat) a large tree again.
+
+    Files are listed in the same order as bagit._walk: the files of each directory sorted by name, followed by the
+    contents of each of its subdirectories sorted by name. As with os.walk, symbolic links to directories are not
+    followed. The partial files (and their state files) of interrupted HTTP transfers which are kept in the payload
+    directory so that the transfer can be resumed are not part of the payload, and are not listed.
+    """
+
+    def __init__(self, base_dir, top="."):
+        self.base_dir = os.path.abspath(base_dir)
+        self.top = top
+        self.files = list()
+        self.directories = list()
+        self._index = None
+        self.scanned_ns = time.time_ns()
+
+        if hasattr(os, "geteuid"):
+            self._uid = os.geteuid()
+            self._gids = set(os.getgroups()) | {os.getegid()}
+        else:  # pragma: no cover
+            self._uid = self._gids = None
+
+        self.root = self._make_entry(self.top_path, os.path.normpath(top), None, True)
+        if self.root.readable and os.path.isdir(self.top_path):
+            self._scan(self.top_path, os.path.normpath(top) if top != "." else "")
+
+    @property
+    def top_path(self):
+        return self.base_dir if self.top == "." else os.path.join(self.base_dir, self.top)
+
+    def _has_access(self, path, st, owner_bit, group_bit, other_bit, access):
+        # Decide from the permission bits where they grant access to the current user, so that the common case costs
+        # no additional system call, and fall back to os.access (which also honors ACLs and privileges) otherwise.
+        if st is not None and self._uid is not None:
+            if st.st_uid == self._uid:
+                bit = owner_bit
+            elif st.st_gid in self._gids:
+                bit = group_bit
+            else:
+                bit = other_bit
+            if st.st_mode & bit:
+                return True
+        return os.access(path, access)
+
+    def _make_entry(self, full_path, rel_path, dir_entry, is_dir):
+        try:
+            st = dir_entry.stat() if dir_entry is not None else os.stat(full_path)
+        except OSError:
+            st = None
+        if is_dir:
+            # directories are checked exactly as bagit._can_bag and bagit._can_read check them, since (unlike the
+            # permission bits) os.access also accounts for read-only file systems
+            readable = os.access(full_path, os.R_OK)
+            writable = os.access(full_path, os.W_OK)
+        else:
+            # bagit._can_bag does not check the writability of files
+            readable = self._has_access(full_path, st, stat.S_IRUSR, stat.S_IRGRP, stat.S_IROTH, os.R_OK)
+            writable = None
+        return InventoryEntry(rel_path,
+                              st.st_size if st is not None else None,
+                              st.st_mtime_ns if st is not None else None,
+                              st.st_mode if st is not None else None,
+                              readable,
+                              writable)
+
+    def _scan(self, dir_path, rel_dir):
+        files = list()
+        subdirs = list()
+        try:
+            with os.scandir(dir_path) as it:
+                for dir_entry in it:
+                    try:
+                        is_dir = dir_entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        subdirs.append(dir_entry)
+                    elif not is_partial_download(dir_entry.name):
+                        files.append(dir_entry)
+        except OSError:
+            # like os.walk, skip directories that cannot be listed
+            return
+        files.sort(key=lambda e: e.name)
+        subdirs.sort(key=lambda e: e.name)
+        for dir_entry in files:
+            self.files.append(self._make_entry(dir_entry.path, os.path.join(rel_dir, dir_entry.name), dir_entry, False))
+        for dir_entry in subdirs:
+            entry = self._make_entry(dir_entry.path, os.path.join(rel_dir, dir_entry.name), dir_entry, True)
+            self.directories.append(entry)
+            if entry.readable and not dir_entry.is_symlink():
+                self._scan(dir_entry.path, entry.path)
+
+    def get(self, path):
+        """
+        Returns the InventoryEntry of the file at the given path relative to base_dir, or None if it is not present.
+        """
+        if self._index is None:
+            self._index = dict((entry.path, entry) for entry in self.files)
+        return self._index.get(os.path.normpath(path))
+
+    def relocate(self, top):
+        """
+        Returns a copy of this inventory with every path prefixed with top, e.g. after moving the inventoried files
+        into the payload directory of a new bag.
+        """
+        inventory = PayloadInventory.__new__(PayloadInventory)
+        inventory.__dict__.update(self.__dict__)
+        inventory.top = top
+        inventory.files = [entry._replace(path=os.path.join(top, entry.path)) for entry in self.files]
+        inventory.directories = [entry._replace(path=os.path.join(top, entry.path)) for entry in self.directories]
+        inventory._index = None
+        return inventory
+
+    def subset(self, top):
+        """
+        Returns a copy of this inventory restricted to the files and directories under top.
+        """
+        prefix = os.path.normpath(top) + os.sep
+        inventory = PayloadInventory.__new__(PayloadInventory)
+        inventory.__dict__.update(self.__dict__)
+        inventory.top = top
+        inventory.files = [entry for entry in self.files if entry.path.startswith(prefix)]
+        inventory.directories = [entry for entry in self.directories if entry.path.startswith(prefix)]
+        inventory._index = None
+        return inventory
+
+    def total_bytes(self):
+        return sum(entry.size or 0 for entry in self.files)
+
+    def is_current(self):
+        """
+        Returns True if no file or directory has been added, removed, or renamed in the inventoried tree since it was
+        walked, as determined from the modification times of its directories. Directories modified too close to the
+        time of the walk for their modification time to be trusted are treated as changed. Changes to the contents of
+        existing files are not detected.
+        """
+        for entry in [self.root] + self.directories:
+            if entry.mtime_ns is None or entry.mtime_ns >= self.scanned_ns - MANIFEST_MTIME_MARGIN_NS:
+                return False
+            try:
+                if os.stat(os.path.join(self.base_dir, entry.path)).st_mtime_ns != entry.mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def unbaggable(self):
+        """
+        Returns the paths of the directories that cannot be written, equivalent to bagit._can_bag: the top directory
+        and every directory beneath it are checked, but files are not.
+        """
+        if not self.root.readable:
+            return [self.top_path]
+        unbaggable = [self.top_path] if not self.root.writable else []
+        unbaggable.extend(os.path.join(self.base_dir, entry.path) for entry in self.directories if not entry.writable)
+        return unbaggable
+
+    def unreadable(self):
+        """
+        Returns a tuple of the paths of the directories and files that cannot be read, equivalent to bagit._can_read,
+        except that a file whose permission bits grant read access to the current user is not also checked with
+        os.access.
+        """
+        if not self.root.readable:
+            return (self.top_path,), ()
+        return (tuple(os.path.join(self.base_dir, entry.path) for entry in self.directories if not entry.readable),
+                tuple(os.path.join(self.base_dir, entry.path) for entry in self.files if not entry.readable))
+
+
 def _find_tag_files(bag_dir):
     for dir in os.listdir(bag_dir):
         if dir != 'data':
@@ -339,26 +885,342 @@ class UnexpectedRemoteFile(ManifestErrorDetail):
         return _("%s exists in fetch.txt but is not in manifest") % self.path
 
 
+class ManifestRecord(Mapping):
+    """
+    A read-only {algorithm: hex digest} view of the manifest entries of a single file in a CompactManifestStore.
+    """
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, algorithm):
+        digest = self._store._digest(self._row, algorithm)
+        if digest is None:
+            raise KeyError(algorithm)
+        return digest
+
+    def __iter__(self):
+        return (alg for alg in self._store.algorithms if self._store._digest(self._row, alg) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class _ManifestPrefixView(Mapping):
+    """
+    A read-only view of the entries of a CompactManifestStore whose paths start with a given prefix.
+    """
+    __slots__ = ("_store", "_prefix")
+
+    def __init__(self, store, prefix):
+        self._store = store
+        self._prefix = prefix
+
+    def __getitem__(self, path):
+        if not path.startswith(self._prefix):
+            raise KeyError(path)
+        return self._store[path]
+
+    def __iter__(self):
+        return (path for path in self._store if path.startswith(self._prefix))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class _NormalizedManifestNames(Mapping):
+    """
+    A read-only {normalized path: path} view of a CompactManifestStore, in place of the normalized_manifest_names dict.
+    Only the paths that are changed by Unicode normalization are stored.
+    """
+    __slots__ = ("_store",)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, name):
+        path = self._store._renamed.get(name)
+        if path is None:
+            if name not in self._store:
+                raise KeyError(name)
+            path = name
+        return path
+
+    def __iter__(self):
+        return (normalize_unicode(path) for path in self._store)
+
+    def __len__(self):
+        return len(self._store)
+
+
+class CompactManifestStore(Mapping):
+    """
+    A memory efficient, read-only replacement for the {path: {algorithm: hex digest}} dict of manifest entries, for
+    bags with very many files. Each path is interned once in a table of rows, and the digests of each algorithm are
+    kept as raw bytes in a single bytearray with a fixed width slot per row. Digests that cannot be stored as raw bytes
+    (e.g. upper case or malformed hex strings, or unknown algorithms) are kept as strings, so that every digest reads
+    back exactly as it appears in the manifest. Entries are returned as ManifestRecord views.
+    """
+
+    def __init__(self):
+        self.algorithms = list()
+        self._paths = list()
+        self._rows = dict()
+        self._renamed = dict()
+        self._widths = dict()
+        self._digests = dict()
+        # for each algorithm, one byte per row: 0 if the row has no digest, 1 if it is stored as raw bytes, and 2 if
+        # it is stored as a string in _irregular
+        self._present = dict()
+        self._irregular = dict()
+
+    @staticmethod
+    def _digest_size(algorithm):
+        try:
+            return hashlib.new(algorithm).digest_size or None
+        except ValueError:
+            return None
+
+    def _digest(self, row, algorithm):
+        present = self._present.get(algorithm)
+        if not present or not present[row]:
+            return None
+        if present[row] == 2:
+            return self._irregular[(algorithm, row)]
+        width = self._widths[algorithm]
+        return self._digests[algorithm][row * width:(row + 1) * width].hex()
+
+    def add(self, path, algorithm, digest):
+        """
+        Adds the digest of a file, returning the digest previously stored for the path and algorithm, if any.
+        """
+        row = self._rows.get(path)
+        if row is None:
+            row = len(self._paths)
+            path = sys.intern(path)
+            self._paths.append(path)
+            self._rows[path] = row
+            normalized = normalize_unicode(path)
+            if normalized != path:
+                self._renamed[normalized] = path
+            for alg in self.algorithms:
+                self._present[alg].append(0)
+                self._digests[alg].extend(bytes(self._widths[alg] or 0))
+        if algorithm not in self._present:
+            self.algorithms.append(algorithm)
+            self._widths[algorithm] = self._digest_size(algorithm)
+            self._present[algorithm] = bytearray(len(self._paths))
+            self._digests[algorithm] = bytearray((self._widths[algorithm] or 0) * len(self._paths))
+
+        previous = self._digest(row, algorithm)
+        self._irregular.pop((algorithm, row), None)
+        width = self._widths[algorithm]
+        raw = None
+        if width and len(digest) == 2 * width:
+            try:
+                raw = bytes.fromhex(digest)
+            except ValueError:
+                pass
+        if raw is not None and len(raw) == width and raw.hex() == digest:
+            self._digests[algorithm][row * width:(row + 1) * width] = raw
+            self._present[algorithm][row] = 1
+        else:
+            self._irregular[(algorithm, row)] = digest
+            self._present[algorithm][row] = 2
+        return previous
+
+    def view(self, prefix):
+        """
+        Returns a read-only view of the entries whose paths start with prefix.
+        """
+        return _ManifestPrefixView(self, prefix)
+
+    @property
+    def normalized_names(self):
+        return _NormalizedManifestNames(self)
+
+    def __getitem__(self, path):
+        return ManifestRecord(self, self._rows[path])
+
+    def __contains__(self, path):
+        return path in self._rows
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+
 class BDBag(Bag):
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, compact_manifests=False):
+        self.compact_manifests = compact_manifests
+        self._payload_inventory = None
+        self._fetch_cache = None
+        self._name_indexes = dict()
         Bag.__init__(self, path)
         self.remote_entries = dict()
+        self.sample_report = None
+
+    def payload_inventory(self, refresh=False):
+        """
+        Returns the PayloadInventory of the bag's data directory, walking it on first use (or if refresh is True), and
+        reusing it for subsequent completeness, Payload-Oxum and size checks.
+        """
+        if refresh or self._payload_inventory is None:
+            self._payload_inventory = PayloadInventory(self.path, "data")
+        return self._payload_inventory
+
+    def current_payload_inventory(self):
+        """
+        Like payload_inventory, but walks the data directory again if files were added, removed, or renamed since it
+        was last walked.
+        """
+        if self._payload_inventory is not None and not self._payload_inventory.is_current():
+            self._payload_inventory = None
+        return self.payload_inventory()
+
+    def payload_files(self):
+        """Returns a list of filenames which are present on the local filesystem"""
+        for entry in self.payload_inventory().files:
+            self.normalized_filesystem_names[normalize_unicode(entry.path)] = entry.path
+            yield entry.path
+
+    def payload_entries(self):
+        if not self.compact_manifests:
+            return Bag.payload_entries(self)
+        return self.entries.view("data" + os.sep)
+
+    def _load_manifests(self):
+        """
+        Loads the manifests as in Bag._load_manifests, but into a CompactManifestStore if compact_manifests is set.
+        """
+        if not self.compact_manifests:
+            return Bag._load_manifests(self)
+
+        self.entries = CompactManifestStore()
+        self.normalized_manifest_names = self.entries.normalized_names
+        manifests = list(self.manifest_files())
+        if self.version_info >= (0, 97):
+            # v0.97+ requires that optional tagfiles are verified.
+            manifests += list(self.tagmanifest_files())
+
+        for manifest_filename in manifests:
+            search = "tagmanifest-" if manifest_filename.find("tagmanifest-") != -1 else "manifest-"
+            alg = os.path.basename(manifest_filename).replace(search, "").replace(".txt", "")
+            if alg not in self.algorithms:
+                self.algorithms.append(alg)
+
+            with open_text_file(manifest_filename, "r", encoding=self.encoding) as manifest_file:
+                if manifest_file.encoding.startswith("UTF"):
+                    if manifest_file.read(1) == UNICODE_BYTE_ORDER_MARK:
+                        if manifest_file.encoding == "UTF-8":
+                            LOGGER.warning(_("%s is encoded using UTF-8 but contains an unnecessary byte-order mark, "
+                                             "which is not in compliance with the BagIt RFC"), manifest_file.name)
+                    else:
+                        manifest_file.seek(0)
+
+                for line in manifest_file:
+                    line = line.strip()
+                    if line == "" or line.startswith("#"):
+                        continue
+
+                    entry = line.split(None, 1)
+                    if len(entry) != 2:
+                        LOGGER.error(_("%(bag)s: Invalid %(algorithm)s manifest entry: %(line)s"),
+                                     {"bag": self, "algorithm": alg, "line": line})
+                        continue
+
+                    entry_hash = entry[0]
+                    entry_path = _decode_filename(os.path.normpath(entry[1].lstrip("*")))
+                    if self._path_is_dangerous(entry_path):
+                        raise BagError(_('Path "%(payload_file)s" in manifest "%(manifest_file)s" is unsafe') %
+                                       {"payload_file": entry_path, "manifest_file": manifest_file.name})
+
+                    previous = self.entries.add(entry_path, alg, entry_hash)
+                    if previous is not None:
+                        warning_ctx = {"bag": self, "algorithm": alg, "filename": entry_path}
+                        if previous == entry_hash:
+                            msg = _("%(bag)s: %(algorithm)s manifest lists %(filename)s multiple times with the "
+                                    "same value")
+                            if self.version_info >= (1,):
+                                raise BagError(msg % warning_ctx)
+                            else:
+                                LOGGER.warning(msg, warning_ctx)
+                        else:
+                            raise BagError(_("%(bag)s: %(algorithm)s manifest lists %(filename)s multiple times with "
+                                             "conflicting values") % warning_ctx)
+
+    def fetch_entries(self):
+        """
+        Iterates over the (url, size, filename) entries of fetch.txt. The parsed entries are memoized, and fetch.txt is
+        only read and checked again once it has been modified.
+        """
+        signature = FixityCache.stat(os.path.join(self.path, "fetch.txt"))
+        if signature is None:
+            self._fetch_cache = None
+            return iter(())
+        if self._fetch_cache is None or self._fetch_cache[0] != signature:
+            self._fetch_cache = (signature, list(Bag.fetch_entries(self)))
+        return iter(self._fetch_cache[1])
 
     def files_to_be_fetched(self, normalize=True):
-        for f, size, path in self.fetch_entries():
-            path = urlunquote(path)
-            if normalize:
-                yield os.path.normpath(path)
-            else:
-                yield path
+        return iter(self._memoize_names(
+            "fetch" if normalize else "fetch-raw", self._fetch_entries_token(),
+            lambda: [os.path.normpath(urlunquote(path)) if normalize else urlunquote(path)
+                     for f, size, path in self.fetch_entries()]))
+
+    def _fetch_entries_token(self):
+        # make sure the memoized fetch.txt entries are current before they are used to validate an index
+        self.fetch_entries()
+        return self._fetch_cache
+
+    def _memoize_names(self, kind, token, build):
+        """
+        Returns the names built by build(), memoized under kind until token (the object the names were derived from)
+        is replaced.
+        """
+        cached = self._name_indexes.get(kind)
+        if cached is None or cached[0] is not token:
+            cached = (token, build())
+            self._name_indexes[kind] = cached
+        return cached[1]
+
+    def manifest_name_index(self):
+        """
+        Returns the set of Unicode-normalized payload file names listed in the manifests, memoized until the manifests
+        are reloaded.
+        """
+        return self._memoize_names("manifest", self.entries, lambda: frozenset(
+            normalize_unicode(i) for i in self.entries.keys() if i.startswith("data" + os.sep)))
+
+    def fetch_name_index(self):
+        """
+        Returns the set of Unicode-normalized file names listed in fetch.txt, memoized until fetch.txt is modified.
+        """
+        return self._memoize_names("fetch-index", self._fetch_entries_token(), lambda: frozenset(
+            normalize_unicode(i) for i in self.files_to_be_fetched()))
+
+    def filesystem_name_index(self):
+        """
+        Returns the set of Unicode-normalized payload file names present on the filesystem, memoized until the payload
+        inventory is refreshed.
+        """
+        return self._memoize_names("filesystem", self.payload_inventory(), lambda: frozenset(
+            normalize_unicode(i) for i in self.payload_files()))
 
     def compare_manifests_with_fs_and_fetch(self):
         # We compare the filenames after Unicode normalization so we can
         # reliably detect normalization changes after bag creation:
-        files_on_fs = set(normalize_unicode(i) for i in self.payload_files())
-        files_in_manifest = set(normalize_unicode(i) for i in self.payload_entries().keys())
-        files_in_fetch = set(normalize_unicode(i) for i in self.files_to_be_fetched())
+        files_on_fs = self.filesystem_name_index()
+        files_in_manifest = self.manifest_name_index()
+        files_in_fetch = self.fetch_name_index()
 
         if self.version_info >= (0, 97):
             files_in_manifest = files_in_manifest | set(self.missing_optional_tagfiles())
@@ -393,7 +1255,34 @@ class BDBag(Bag):
             self.algorithms.append(alg)
         make_remote_file_entry(self.remote_entries, filename, url, length, alg, digest)
 
-    def save(self, processes=1, manifests=False):
+    def unchanged_payload_entries(self):
+        """
+        Returns the existing manifest entries for payload files that have not been modified or replaced since the
+        payload manifests were last generated, keyed by Unicode-normalized path.
+        """
+        unchanged = dict()
+        manifest_times = list()
+        for alg in self.algorithms:
+            manifest_file = os.path.join(self.path, "manifest-%s.txt" % alg)
+            if not os.path.isfile(manifest_file):
+                return unchanged
+            manifest_times.append(os.stat(manifest_file).st_mtime_ns)
+        if not manifest_times:
+            return unchanged
+        watermark = min(manifest_times) - MANIFEST_MTIME_MARGIN_NS
+
+        for rel_path, hashes in self.payload_entries().items():
+            try:
+                st = os.stat(os.path.join(self.path, rel_path))
+            except OSError:
+                continue
+            # the inode change time also catches files replaced by a copy that preserved an older modification time
+            if max(st.st_mtime_ns, st.st_ctime_ns) < watermark:
+                unchanged[normalize_unicode(rel_path)] = hashes
+
+        return unchanged
+
+    def save(self, processes=1, manifests=False, fixity_cache=None, incremental=False, executor=DEFAULT_EXECUTOR):
         """
         save will persist any changes that have been made to the bag
         metadata (self.info).
@@ -405,7 +1294,14 @@ class BDBag(Bag):
         a corrupted bag.
 
         If you want to control the number of processes that are used when
-        recalculating checksums use the processes parameter.
+        recalculating checksums use the processes parameter, and the executor
+        parameter to select whether a pool of threads or processes is used. If
+        a fixity_cache is given, the checksums of files unchanged since they
+        were last hashed are taken from the cache.
+
+        If incremental is True, only payload files that were added, modified, or
+        replaced since the payload manifests were last generated are hashed, and
+        the existing manifest entries are reused for all other files.
         """
         # Error checking
         if not self.path:
@@ -414,13 +1310,14 @@ class BDBag(Bag):
         if not os.access(self.path, os.R_OK | os.W_OK | os.X_OK):
             raise BagError(_('Cannot save bag to non-existent or inaccessible directory %s') % self.path)
 
-        unbaggable = _can_bag(self.path)
+        inventory = PayloadInventory(self.path)
+        unbaggable = inventory.unbaggable()
         if unbaggable:
             LOGGER.error(_("Missing write permissions for the following directories and files:\n%s"),
                          unbaggable)
             raise BagError(_("Missing permissions to move all files and directories"))
 
-        unreadable_dirs, unreadable_files = _can_read(self.path)
+        unreadable_dirs, unreadable_files = inventory.unreadable()
         if unreadable_dirs or unreadable_files:
             if unreadable_dirs:
                 LOGGER.error(_("The following directories do not have read permissions:\n%s"),
@@ -440,14 +1337,21 @@ class BDBag(Bag):
                 strict = True if self.version_info >= (1, 0) else False
                 self._sync_remote_entries_with_existing_fetch()
                 validate_remote_entries(self.remote_entries, self.path)
+                existing = self.unchanged_payload_entries() if incremental else None
+                self._payload_inventory = inventory.subset('data')
                 total_bytes, total_files = make_manifests('data', processes,
                                                           algorithms=self.algorithms,
                                                           encoding=self.encoding,
                                                           remote=self.remote_entries,
-                                                          strict=strict)
+                                                          strict=strict,
+                                                          fixity_cache=fixity_cache,
+                                                          existing=existing,
+                                                          executor=executor,
+                                                          inventory=self._payload_inventory)
 
                 # Update fetch.txt
                 _make_fetch_file(self.path, self.remote_entries)
+                self._fetch_cache = None
 
                 # Update Payload-Oxum
                 LOGGER.info(_('Updating Payload-Oxum in %s'), self.tag_file_name)
@@ -468,14 +1372,46 @@ class BDBag(Bag):
 
         finally:
             os.chdir(old_dir)
+            # the payload may change after the bag is saved, so walk it again the next time it is needed
+            self._payload_inventory = None
 
-    def validate(self, processes=1, fast=False, completeness_only=False, callback=None):
+    def validate(self, processes=1, fast=False, completeness_only=False, callback=None, fixity_cache=None,
+                 executor=DEFAULT_EXECUTOR, fail_fast=False, verified=None, filter_expr=None, sample=None,
+                 checkpoint=None):
         """Checks the structure and contents are valid.
 
         If you supply the parameter fast=True the Payload-Oxum (if present) will
         be used to check that the payload files are present and accounted for,
         instead of re-calculating fixities and comparing them against the
         manifest. By default validate() will re-calculate fixities (fast=False).
+
+        If a fixity_cache is given, the cached fixities of files unchanged since
+        they were last hashed are trusted instead of being re-calculated. The
+        executor parameter selects whether fixities are re-calculated serially,
+        or using a pool of threads or processes.
+
+        If fail_fast is True, validation stops at the first checksum mismatch,
+        and any outstanding fixity calculations are cancelled.
+
+        The verified parameter is an optional dict of files that were verified
+        as they were fetched, as populated by bdbag.fetch.fetcher.fetch_entry.
+        The fixities of those files are not re-calculated unless the file has
+        changed since it was verified.
+
+        If a filter_expr is given, completeness and fixities are checked only
+        for the payload files matching the expression, as evaluated by
+        bdbag.filter_dict against the same url, length and filename fields as
+        the entries of fetch.txt. Tag files are always validated.
+
+        If a ValidationSample is given as the sample parameter, fixities are
+        re-calculated only for a random subset of the payload files, and the
+        confidence bound on the number of corrupt files is logged.
+
+        If a checkpoint (a bdbag.bdbag_fixity.ValidationCheckpoint) is given,
+        files are recorded in its journal as they are verified, and files
+        already recorded there are not re-hashed unless they have changed. A
+        checkpoint should only be given for a full validation that is neither
+        filtered nor sampled.
         """
 
         self._validate_structure()
@@ -483,7 +1419,12 @@ class BDBag(Bag):
 
         self._validate_fetch()
 
-        self._validate_contents(processes=processes, fast=fast, completeness_only=completeness_only, callback=callback)
+        # walk the payload directory once for the Payload-Oxum, completeness and fixity checks that follow
+        self.payload_inventory(refresh=True)
+
+        self._validate_contents(processes=processes, fast=fast, completeness_only=completeness_only, callback=callback,
+                                fixity_cache=fixity_cache, executor=executor, fail_fast=fail_fast,
+                                verified=verified, filter_expr=filter_expr, sample=sample, checkpoint=checkpoint)
 
         return True
 
@@ -503,23 +1444,59 @@ class BDBag(Bag):
             if not all(parsed_url.scheme):
                 raise BagError(_('Malformed URL in fetch.txt: %s') % url)
 
-    def _validate_contents(self, processes=1, fast=False, completeness_only=False, callback=None):
+    def _validate_contents(self, processes=1, fast=False, completeness_only=False, callback=None,
+                           fixity_cache=None, executor=DEFAULT_EXECUTOR, fail_fast=False, verified=None,
+                           filter_expr=None, sample=None, checkpoint=None):
         if fast and not self.has_oxum():
             raise BagValidationError(_('Fast validation requires bag-info.txt to include Payload-Oxum'))
 
+        if fast and filter_expr:
+            raise BagValidationError(_('Fast validation cannot be restricted by a filter expression'))
+
+        if sample and (fast or completeness_only):
+            raise BagValidationError(_('Sample validation cannot be combined with fast or completeness-only '
+                                       'validation'))
+
         if fast:
             # Perform the fast file count + size check so we can fail early, but only if fast is specified:
             self._validate_oxum()
             return
 
-        self._validate_completeness()
+        matches = self._payload_filter(filter_expr)
+
+        self._validate_completeness(matches)
 
         if completeness_only:
             return
 
-        self._validate_entries(processes, callback)
+        self._validate_entries(processes, callback, fixity_cache, executor, fail_fast, verified, matches, sample,
+                               checkpoint)
 
-    def _validate_completeness(self):
+    def _payload_filter(self, filter_expr=None):
+        """
+        Returns a function that tests whether a file should be validated, or None if no filter_expr is given. Payload
+        files are tested against filter_expr using the url and length of their fetch.txt entry (if any), with the
+        on-disk size used as the length of local files. Tag files always match.
+        """
+        if not filter_expr:
+            return None
+
+        fetched = dict()
+        for url, length, filename in self.fetch_entries():
+            fetched[normalize_unicode(os.path.normpath(urlunquote(filename)))] = (url, length)
+
+        def matches(path):
+            path = os.path.normpath(path)
+            if not path.startswith("data" + os.sep):
+                return True
+            url, length = fetched.get(normalize_unicode(path), (None, None))
+            if length is None:
+                length = self._payload_file_size(self.normalized_filesystem_names.get(path, path))
+            return filter_dict(filter_expr, {"url": url, "length": length, "filename": path.replace(os.sep, "/")})
+
+        return matches
+
+    def _validate_completeness(self, matches=None):
         """
         Verify that the actual file manifests match the files in the data directory
         """
@@ -528,6 +1505,10 @@ class BDBag(Bag):
         # First we'll make sure there's no mismatch between the filesystem
         # and the list of files in the manifest(s)
         only_in_manifests, only_on_fs, only_in_fetch = self.compare_manifests_with_fs_and_fetch()
+        if matches:
+            only_in_manifests = [path for path in only_in_manifests if matches(path)]
+            only_on_fs = [path for path in only_on_fs if matches(path)]
+            only_in_fetch = [path for path in only_in_fetch if matches(path)]
         for path in only_in_manifests:
             e = FileMissing(path)
             LOGGER.warning(str(e))
@@ -544,51 +1525,282 @@ class BDBag(Bag):
         if errors:
             raise BagValidationError(_("Bag validation failed"), errors)
 
-    def _validate_entries(self, processes, callback=None):
+    def _payload_file_size(self, rel_path):
+        entry = self.payload_inventory().get(rel_path)
+        if entry is not None and entry.size is not None:
+            return entry.size
+        try:
+            return os.path.getsize(os.path.join(self.path, rel_path))
+        except OSError:
+            return 0
+
+    def _validate_oxum(self):
+        oxum = self.info.get("Payload-Oxum")
+
+        if oxum is None:
+            return
+
+        # If multiple Payload-Oxum tags (bad idea)
+        # use the first listed in bag-info.txt
+        if isinstance(oxum, list):
+            LOGGER.warning(_("bag-info.txt defines multiple Payload-Oxum values!"))
+            oxum = oxum[0]
+
+        oxum_byte_count, oxum_file_count = oxum.split(".", 1)
+
+        if not oxum_byte_count.isdigit() or not oxum_file_count.isdigit():
+            raise BagError(_("Malformed Payload-Oxum value: %s") % oxum)
+
+        oxum_byte_count = int(oxum_byte_count)
+        oxum_file_count = int(oxum_file_count)
+        inventory = self.payload_inventory()
+        total_bytes = inventory.total_bytes()
+        total_files = len(inventory.files)
+
+        if oxum_file_count != total_files or oxum_byte_count != total_bytes:
+            raise BagValidationError(
+                _("Payload-Oxum validation failed."
+                  " Expected %(oxum_file_count)d files and %(oxum_byte_count)d bytes"
+                  " but found %(found_file_count)d files and %(found_byte_count)d bytes") % {
+                    "found_file_count": total_files,
+                    "found_byte_count": total_bytes,
+                    "oxum_file_count": oxum_file_count,
+                    "oxum_byte_count": oxum_byte_count,
+                }
+            )
+
+    def _validate_entries(self, processes, callback=None, fixity_cache=None, executor=DEFAULT_EXECUTOR,
+                          fail_fast=False, verified=None, matches=None, sample=None, checkpoint=None):
         """
         Verify that the actual file contents match the recorded hashes stored in the manifest files
         """
         errors = list()
 
+        check_executor(executor)
+        if executor == SERIAL_EXECUTOR:
+            processes = 1
+
         if os.name == 'posix':
             worker_init = posix_multiprocessing_worker_initializer
         else:
             worker_init = None
 
-        args = ((self.path,
+        entries = list(self.entries.items())
+        if matches:
+            entries = [(rel_path, hashes) for rel_path, hashes in entries if matches(rel_path)]
+            if len(entries) < len(self.entries):
+                LOGGER.info(_("Validating %(matched)d of %(total)d manifest entries matching the filter expression"),
+                            {"matched": len(entries), "total": len(self.entries)})
+        if sample:
+            entries = self._sample_entries(entries, sample)
+        total = len(entries)
+        cached_results = list()
+        cache_keys = dict()
+        if verified:
+            unverified = list()
+            for rel_path, hashes in entries:
+                fs_path = os.path.join(self.path, self.normalized_filesystem_names.get(rel_path, rel_path))
+                stat_key, digests = verified.get(rel_path, (None, None))
+                algorithms = [alg for alg in hashes if alg in self.algorithms]
+                if stat_key and stat_key == FixityCache.stat(fs_path) and all(alg in digests for alg in algorithms):
+                    cached_results.append((rel_path, dict((alg, digests[alg]) for alg in algorithms), hashes))
+                else:
+                    unverified.append((rel_path, hashes))
+            LOGGER.info(_("Skipping %(verified)d of %(total)d files already verified during transfer"),
+                        {"verified": len(cached_results), "total": len(entries)})
+            entries = unverified
+        if checkpoint:
+            unchecked = list()
+            resumed = 0
+            for rel_path, hashes in entries:
+                fs_path = os.path.join(self.path, self.normalized_filesystem_names.get(rel_path, rel_path))
+                cache_keys[rel_path] = FixityCache.stat(fs_path)
+                digests = checkpoint.get(rel_path, cache_keys[rel_path],
+                                         [alg for alg in hashes if alg in self.algorithms])
+                if digests:
+                    cached_results.append((rel_path, digests, hashes))
+                    resumed += 1
+                else:
+                    unchecked.append((rel_path, hashes))
+            LOGGER.info(_("Skipping %(resumed)d of %(total)d files already verified before the last checkpoint"),
+                        {"resumed": resumed, "total": len(entries)})
+            entries = unchecked
+        if fixity_cache:
+            uncached = list()
+            trusted = 0
+            for rel_path, hashes in entries:
+                fs_path = os.path.join(self.path, self.normalized_filesystem_names.get(rel_path, rel_path))
+                cache_keys[rel_path] = fixity_cache.stat(fs_path)
+                digests = fixity_cache.get(cache_keys[rel_path], [alg for alg in hashes if alg in self.algorithms])
+                if digests:
+                    cached_results.append((rel_path, digests, hashes))
+                    trusted += 1
+                else:
+                    uncached.append((rel_path, hashes))
+            LOGGER.info(_("Trusting cached fixities for %(cached)d of %(total)d files"),
+                        {"cached": trusted, "total": len(entries)})
+            entries = uncached
+        if fail_fast:
+            for checked, result in enumerate(cached_results, 1):
+                errors = self._checksum_mismatches(*result)
+                if errors:
+                    self._fail_fast(errors, checked, total)
+
+        # _calc_hashes reports results by filesystem name, which can differ from the manifest path (which cache_keys
+        # and the checkpoint are keyed by) by Unicode normalization, so results are mapped back by their index
+        manifest_paths = [rel_path for rel_path, _hashes in entries]
+        args = [(self.path,
                  self.normalized_filesystem_names.get(rel_path, rel_path),
-                 hashes,
-                 self.algorithms) for rel_path, hashes in self.entries.items())
+                 dict(hashes),
+                 self.algorithms) for rel_path, hashes in entries]
 
+        pool = None
         try:
             if processes == 1:
-                count = 0
-                hash_results = []
-                totalHashes = len(self.entries.items())
-                for i in args:
-                    hash_results.append(_calc_hashes(i))
-                    count += 1
-                    if callback:
-                        if not callback(count, totalHashes):
-                            raise BaggingInterruptedError("Bag validation interrupted!")
-
-            else:  # pragma: no cover
-                pool = multiprocessing.Pool(processes if processes else None, initializer=worker_init)
-                hash_results = pool.map(_calc_hashes, args)
-                pool.close()
+                results = enumerate(_calc_hashes(i) for i in args)
+            else:
+                pool = make_worker_pool(processes, executor, initializer=worker_init)
+                results = imap_largest_first(pool, _calc_hashes, args, [self._payload_file_size(arg[1])
+                                                                        for arg in args], processes)
+
+            # Results are collected (and progress reported) in the calling process as they are completed
+            count = len(cached_results)
+            hash_results = [None] * len(args)
+            for index, result in results:
+                hash_results[index] = result
+                count += 1
+                if checkpoint:
+                    fs_path, f_hashes, hashes = result
+                    rel_path = manifest_paths[index]
+                    # only record files that were verified and that were not modified while being read
+                    if self._checksums_match(f_hashes, hashes) and \
+                            FixityCache.stat(os.path.join(self.path, fs_path)) == cache_keys[rel_path]:
+                        checkpoint.put(rel_path, cache_keys[rel_path], f_hashes)
+                if fail_fast:
+                    errors = self._checksum_mismatches(*result)
+                    if errors:
+                        break
+                if callback:
+                    if not callback(count, total):
+                        raise BaggingInterruptedError("Bag validation interrupted!")
+
+            if pool:
+                if errors:
+                    pool.terminate()
+                else:
+                    pool.close()
                 pool.join()
         # Any unhandled exceptions are probably fatal
         except:  # pragma: no cover
+            if pool:
+                pool.terminate()
+                pool.join()
             LOGGER.exception(_("Unable to calculate file hashes for %s"), self)
             raise
 
+        if errors:
+            self._fail_fast(errors, count, total)
+
+        if fixity_cache:
+            for rel_path, (fs_path, f_hashes, hashes) in zip(manifest_paths, hash_results):
+                # only record fixities that were verified and where the file was not modified while being read
+                if self._checksums_match(f_hashes, hashes) and \
+                        fixity_cache.stat(os.path.join(self.path, fs_path)) == cache_keys[rel_path]:
+                    fixity_cache.put(cache_keys[rel_path], f_hashes)
+        hash_results = cached_results + hash_results
+
         for rel_path, f_hashes, hashes in hash_results:
-            for alg, computed_hash in f_hashes.items():
-                stored_hash = hashes[alg]
-                if stored_hash.lower() != computed_hash:
-                    e = ChecksumMismatch(rel_path, alg, stored_hash.lower(), computed_hash)
-                    LOGGER.warning(str(e))
-                    errors.append(e)
+            errors.extend(self._checksum_mismatches(rel_path, f_hashes, hashes))
 
         if errors:
             raise BagValidationError(_("Bag validation failed"), errors)
+
+        if sample:
+            self._log_sample_confidence()
+
+    def _sample_entries(self, entries, sample):
+        """
+        Selects a random subset of the payload entries given as (rel_path, hashes) tuples, up to sample.count files
+        and sample.bytes total size. If neither limit is set, DEFAULT_SAMPLE_COUNT files are selected. Tag file entries
+        are always kept. Files are drawn by weighted random sampling without replacement (Efraimidis-Spirakis keys),
+        weighted towards recently modified files if sample.weight_recent is set, using a random.Random seeded with
+        sample.seed so that the same seed selects the same files.
+        """
+        payload = sorted((entry for entry in entries if entry[0].startswith("data" + os.sep)), key=lambda e: e[0])
+        tags = [entry for entry in entries if not entry[0].startswith("data" + os.sep)]
+        count = sample.count
+        if count is None and sample.bytes is None:
+            count = DEFAULT_SAMPLE_COUNT
+        seed = sample.seed if sample.seed is not None else random.SystemRandom().randrange(2 ** 32)
+        rng = random.Random(seed)
+
+        weights = [1.0] * len(payload)
+        if sample.weight_recent and len(payload) > 1:
+            mtimes = list()
+            for rel_path, _hashes in payload:
+                try:
+                    mtimes.append(os.stat(os.path.join(
+                        self.path, self.normalized_filesystem_names.get(rel_path, rel_path))).st_mtime_ns)
+                except OSError:
+                    mtimes.append(0)
+            # weight linearly by modification time rank, from 1 for the oldest file up to SAMPLE_RECENT_WEIGHT
+            order = sorted(range(len(payload)), key=lambda i: mtimes[i])
+            for rank, index in enumerate(order):
+                weights[index] = 1.0 + (SAMPLE_RECENT_WEIGHT - 1.0) * rank / (len(payload) - 1)
+        keys = [rng.random() ** (1.0 / weight) for weight in weights]
+
+        selected = list()
+        sampled_bytes = 0
+        for index in sorted(range(len(payload)), key=lambda i: -keys[i]):
+            if count is not None and len(selected) >= count:
+                break
+            rel_path = payload[index][0]
+            size = self._payload_file_size(self.normalized_filesystem_names.get(rel_path, rel_path))
+            if sample.bytes is not None and sampled_bytes + size > sample.bytes:
+                # skip files that would exceed the byte budget, but always check at least one file
+                if selected:
+                    continue
+            selected.append(index)
+            sampled_bytes += size
+        selected.sort()
+
+        self.sample_report = {"seed": seed, "sampled": len(selected), "population": len(payload),
+                              "sampled_bytes": sampled_bytes, "weighted": bool(sample.weight_recent)}
+        LOGGER.info(_("Sampling %(sampled)d of %(population)d payload files (%(sampled_bytes)d bytes) for validation "
+                      "using seed %(seed)d"), self.sample_report)
+
+        return tags + [payload[index] for index in selected]
+
+    def _log_sample_confidence(self):
+        report = self.sample_report
+        bound = sample_confidence_bound(report["population"], report["sampled"])
+        report["confidence"] = SAMPLE_CONFIDENCE
+        report["max_corrupt"] = bound
+        report["max_corrupt_percent"] = (100.0 * bound / report["population"]) if report["population"] else 0.0
+        LOGGER.info(_("Sample validation found no checksum mismatches in %(sampled)d of %(population)d payload files. "
+                      "With %(confidence).0f%% confidence, at most %(max_corrupt)d files (%(max_corrupt_percent).2f%%) "
+                      "of the payload are corrupt%(note)s."),
+                    dict(report, confidence=SAMPLE_CONFIDENCE * 100,
+                         note=" (assuming uniform selection; this sample was weighted towards recently modified files)"
+                         if report["weighted"] else ""))
+
+    @staticmethod
+    def _checksums_match(f_hashes, hashes):
+        return all(hashes[alg].lower() == computed_hash for alg, computed_hash in f_hashes.items())
+
+    @staticmethod
+    def _checksum_mismatches(rel_path, f_hashes, hashes):
+        errors = list()
+        for alg, computed_hash in f_hashes.items():
+            stored_hash = hashes[alg]
+            if stored_hash.lower() != computed_hash:
+                e = ChecksumMismatch(rel_path, alg, stored_hash.lower(), computed_hash)
+                LOGGER.warning(str(e))
+                errors.append(e)
+        return errors
+
+    @staticmethod
+    def _fail_fast(errors, checked, total):
+        LOGGER.warning(_("Fail-fast validation stopped at the first checksum mismatch after checking %(checked)d of "
+                         "%(total)d files"), {"checked": checked, "total": total})
+        raise BagValidationError(_("Bag validation failed"), errors)
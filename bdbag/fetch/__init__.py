@@ -14,7 +14,9 @@
 # limitations under the License.
 #
 import os
+import hashlib
 import logging
+import threading
 from bdbag import urlsplit, urlunquote
 
 logger = logging.getLogger(__name__)
@@ -31,6 +33,9 @@ SCHEME_FTP = "ftp"
 SCHEME_SFTP = "sftp"
 SCHEME_TAG = "tag"
 
+PARTIAL_FILE_SUFFIX = ".bdbag-partial"
+PARTIAL_STATE_SUFFIX = ".json"
+
 
 def get_transfer_summary(total_bytes, elapsed_time):
     total_secs = elapsed_time.total_seconds()
@@ -43,6 +48,110 @@ def get_transfer_summary(total_bytes, elapsed_time):
     return summary
 
 
+_write_at_lock = threading.Lock()
+
+
+def write_at(fd, data, offset):
+    """
+    Write data at the given byte offset of an open file descriptor, so that multiple threads can safely fill in
+    different regions of the same (preallocated) file concurrently. Uses os.pwrite where available, otherwise falls
+    back to a serialized seek and write.
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:  # pragma: no cover
+            with _write_at_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+class FixityVerifier(object):
+    """
+    Calculates the digests of a file from the data written while it is being transferred, so that the file can be
+    verified against its bag manifest entries on arrival without being read back from disk.
+
+    Transports call reset() whenever a transfer (re)starts writing from the beginning of the file, or from an offset
+    when resuming a partial file, and update() with each chunk as it is written. A transport that writes the file out
+    of order calls invalidate(), in which case the file can only be verified by reading it back from disk.
+    """
+
+    def __init__(self, hashes):
+        self.expected = dict((alg, digest.lower()) for alg, digest in (hashes or {}).items()
+                             if alg in hashlib.algorithms_available)
+        # the URL that the file was last transferred from, which may differ from the fetch.txt URL of the file if it
+        # is an identifier that was resolved to a transport URL.
+        self.url = None
+        self.reset()
+
+    def reset(self, resume_path=None, offset=0):
+        self.hashers = dict((alg, hashlib.new(alg)) for alg in self.expected)
+        self.length = 0
+        self.valid = True
+        if resume_path and offset:
+            with open(resume_path, "rb") as resume_file:
+                while self.length < offset:
+                    chunk = resume_file.read(min(Megabyte, offset - self.length))
+                    if not chunk:
+                        break
+                    self.update(chunk)
+
+    def invalidate(self):
+        self.valid = False
+
+    def update(self, data):
+        if not self.valid:
+            return
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.length += len(data)
+
+    def digests(self):
+        return dict((alg, hasher.hexdigest()) for alg, hasher in self.hashers.items())
+
+    def verify(self, path, read_back=False):
+        """
+        Returns True if the data transferred to path matched all of the expected digests, False if any digest did not
+        match, or None if the file could not be verified. If the file could not be verified from the transferred data
+        and read_back is True, the file is read back from disk and verified instead.
+        """
+        if not self.expected or not os.path.isfile(path):
+            return None
+        if not self.valid or self.length != os.path.getsize(path):
+            if not read_back:
+                return None
+            self.reset(path, os.path.getsize(path))
+        mismatches = [(alg, digest) for alg, digest in self.digests().items() if digest != self.expected[alg]]
+        for alg, digest in mismatches:
+            logger.warning("File [%s] %s checksum mismatch on arrival. Expected: %s, received: %s" %
+                           (path, alg, self.expected[alg], digest))
+        return not mismatches
+
+
+class FixityWriter(object):
+    """
+    Wraps a writable file object so that data written to it is also passed to a FixityVerifier.
+    """
+
+    def __init__(self, file_obj, fixity):
+        self.file_obj = file_obj
+        self.fixity = fixity
+
+    def write(self, data):
+        self.fixity.update(data)
+        return self.file_obj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file_obj, name)
+
+
+def fixity_writer(file_obj, fixity=None):
+    return FixityWriter(file_obj, fixity) if fixity else file_obj
+
+
 def check_transfer_size_mismatch(path, expected, total):
     if isinstance(expected, int) and isinstance(total, int):
         if expected != total:
@@ -16,10 +16,17 @@
 import os
 import datetime
 import logging
-from collections import namedtuple
-from bdbag import urlsplit, urlunquote, filter_dict
+import threading
+from collections import namedtuple, deque, Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from bdbag import urlsplit, urlunquote, filter_dict, stob
 from bdbag.bdbag_config import read_config, DEFAULT_CONFIG, DEFAULT_CONFIG_FILE, DEFAULT_KEYCHAIN_FILE, \
-    FETCH_CONFIG_TAG, DEFAULT_FETCH_CONFIG, RESOLVER_CONFIG_TAG, DEFAULT_RESOLVER_CONFIG
+    FETCH_CONFIG_TAG, DEFAULT_FETCH_CONFIG, RESOLVER_CONFIG_TAG, DEFAULT_RESOLVER_CONFIG, FETCH_CONCURRENCY_TAG, \
+    FETCH_MAX_WORKERS_TAG, FETCH_MAX_WORKERS_PER_HOST_TAG, FETCH_MAX_WORKERS_PER_SCHEME_TAG, \
+    DEFAULT_FETCH_CONCURRENCY_CONFIG, FETCH_VERIFICATION_TAG, FETCH_VERIFY_ON_ARRIVAL_TAG, \
+    FETCH_MAX_REFETCH_ATTEMPTS_TAG, FETCH_REFETCH_ALTERNATE_URLS_TAG, DEFAULT_FETCH_VERIFICATION_CONFIG
+from bdbag.bdbag_fixity import FixityCache
+from bdbag.fetch import FixityVerifier
 from bdbag.fetch.auth.keychain import read_keychain, DEFAULT_KEYCHAIN_FILE
 from bdbag.fetch.auth.cookies import get_request_cookies
 from bdbag.fetch.resolvers import resolve
@@ -43,34 +50,35 @@ def fetch_bag_files(bag,
 
     keychain = read_keychain(keychain_file)
     config = read_config(config_file)
-    fetchers = kwargs.get("fetchers") or dict()
-    success = True
-    current = 0
+    fetchers = kwargs.pop("fetchers", None) or dict()
     total = 0 if not callback else len(set(bag.files_to_be_fetched()))
     start = datetime.datetime.now()
 
-    for entry in map(FetchEntry._make, bag.fetch_entries()):
-        filename = urlunquote(entry.filename)
-        if filter_expr:
-            if not filter_dict(filter_expr, entry._asdict()):
-                continue
-        output_path = os.path.normpath(os.path.join(bag.path, filename))
-        local_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
-        try:
-            remote_size = int(entry.length)
-        except ValueError:
-            remote_size = None
-        missing = True
-        if local_size is not None:
-            if local_size == remote_size or remote_size is None:
-                missing = False
-
-        if not force and not missing:
-            logger.debug("Not fetching already present file: %s" % output_path)
+    entries = (entry for entry in map(FetchEntry._make, bag.fetch_entries())
+               if not filter_expr or filter_dict(filter_expr, entry._asdict()))
+
+    concurrency = get_fetch_concurrency_config(config)
+    max_workers = concurrency.get(FETCH_MAX_WORKERS_TAG, 1) or 1
+    try:
+        if max_workers > 1:
+            success = fetch_entries_concurrent(bag, entries, config, keychain, fetchers, concurrency, force, callback,
+                                               total, **kwargs)
         else:
-            result_path = fetch_file(entry.url, output_path, config, keychain, fetchers, size=remote_size, **kwargs)
-            if not result_path:
-                success = False
+            success = fetch_entries_serial(bag, entries, config, keychain, fetchers, force, callback, total,
+                                           **kwargs)
+    finally:
+        cleanup_fetchers(fetchers)
+    elapsed = datetime.datetime.now() - start
+    logger.info("Fetch complete. Elapsed time: %s" % elapsed)
+    return success
+
+
+def fetch_entries_serial(bag, entries, config, keychain, fetchers, force, callback, total, **kwargs):
+    success = True
+    current = 0
+    for entry in entries:
+        if not fetch_entry(bag, entry, config, keychain, fetchers, force, **kwargs):
+            success = False
 
         if callback:
             current += 1
@@ -78,12 +86,189 @@ def fetch_bag_files(bag,
                 logger.warning("Fetch cancelled by user...")
                 success = False
                 break
-    elapsed = datetime.datetime.now() - start
-    logger.info("Fetch complete. Elapsed time: %s" % elapsed)
-    cleanup_fetchers(fetchers)
+
     return success
 
 
+def fetch_entries_concurrent(bag, entries, config, keychain, fetchers, concurrency, force, callback, total, **kwargs):
+    """
+    Fetch entries using a pool of worker threads. Entries are queued per (scheme, host) and dispatched round-robin so
+    that the per-host and per-scheme limits in the concurrency configuration are honored without tying up workers.
+    Each worker thread gets its own set of transport instances, so transports do not need to be thread-safe. The
+    transport instances in fetchers (e.g., pre-configured or already authenticated transports given by the caller) are
+    used by the first worker thread, and the other worker threads create their own.
+    """
+    max_workers = concurrency.get(FETCH_MAX_WORKERS_TAG, 1)
+    max_per_host = concurrency.get(FETCH_MAX_WORKERS_PER_HOST_TAG) or max_workers
+    max_per_scheme = concurrency.get(FETCH_MAX_WORKERS_PER_SCHEME_TAG) or {}
+    logger.info("Fetching with %d concurrent workers (max %d per host)." % (max_workers, max_per_host))
+
+    local = threading.local()
+    worker_fetchers = list()
+    worker_fetchers_lock = threading.Lock()
+
+    seed_fetchers = [fetchers]
+
+    def get_worker_fetchers():
+        thread_fetchers = getattr(local, "fetchers", None)
+        if thread_fetchers is None:
+            with worker_fetchers_lock:
+                if seed_fetchers:
+                    # the caller's fetchers are cleaned up by fetch_bag_files
+                    thread_fetchers = local.fetchers = seed_fetchers.pop()
+                else:
+                    thread_fetchers = local.fetchers = dict()
+                    worker_fetchers.append(thread_fetchers)
+        return thread_fetchers
+
+    def worker(entry):
+        return fetch_entry(bag, entry, config, keychain, get_worker_fetchers(), force, **kwargs)
+
+    queues = OrderedDict()
+    for entry in entries:
+        upr = urlsplit(entry.url)
+        queues.setdefault((upr.scheme.lower(), upr.netloc.lower()), deque()).append(entry)
+
+    host_counts = Counter()
+    scheme_counts = Counter()
+    in_flight = dict()
+    success = True
+    cancelled = False
+    current = 0
+
+    def can_start(key):
+        scheme, host = key
+        scheme_limit = max_per_scheme.get(scheme)
+        if scheme_limit and scheme_counts[scheme] >= scheme_limit:
+            return False
+        return host_counts[key] < max_per_host
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            while not cancelled and queues and len(in_flight) < max_workers:
+                submitted = False
+                for key in list(queues.keys()):
+                    if len(in_flight) >= max_workers:
+                        break
+                    if not can_start(key):
+                        continue
+                    queue = queues[key]
+                    future = executor.submit(worker, queue.popleft())
+                    in_flight[future] = key
+                    host_counts[key] += 1
+                    scheme_counts[key[0]] += 1
+                    submitted = True
+                    if not queue:
+                        del queues[key]
+                if not submitted:
+                    break
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                key = in_flight.pop(future)
+                host_counts[key] -= 1
+                scheme_counts[key[0]] -= 1
+                if not future.result():
+                    success = False
+                if callback and not cancelled:
+                    current += 1
+                    if not callback(current, total):
+                        logger.warning("Fetch cancelled by user...")
+                        success = False
+                        cancelled = True
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for thread_fetchers in worker_fetchers:
+            cleanup_fetchers(thread_fetchers)
+
+    return success
+
+
+def fetch_entry(bag, entry, config, keychain, fetchers, force=False, verified=None, **kwargs):
+    """
+    Fetch a single fetch.txt entry. If verification on arrival is enabled in the fetch configuration, or a verified
+    dict is given, the file is hashed as it is transferred and checked against the bag manifests on arrival. When
+    verification on arrival is enabled, a file that fails verification is re-fetched (from an alternate URL, where the
+    entry is an identifier that resolves to more than one) up to the configured number of attempts. If it still fails,
+    the corrupt copy is removed so that a later, non-forced fetch does not mistake it for an already present file and
+    will fetch it again. Files that match are recorded in verified, keyed by their path relative to the bag, as a tuple
+    of the file's stat key at the time it was verified and the verified digests.
+    """
+    filename = urlunquote(entry.filename)
+    output_path = os.path.normpath(os.path.join(bag.path, filename))
+    local_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+    try:
+        remote_size = int(entry.length)
+    except ValueError:
+        remote_size = None
+    missing = True
+    if local_size is not None:
+        if local_size == remote_size or remote_size is None:
+            missing = False
+
+    if not force and not missing:
+        logger.debug("Not fetching already present file: %s" % output_path)
+        return True
+
+    verification = get_fetch_verification_config(config)
+    verify = stob(verification.get(FETCH_VERIFY_ON_ARRIVAL_TAG, True))
+    max_attempts = int(verification.get(FETCH_MAX_REFETCH_ATTEMPTS_TAG, 0)) if verify else 0
+    alternate_urls = stob(verification.get(FETCH_REFETCH_ALTERNATE_URLS_TAG, True))
+    fixity = FixityVerifier(bag.entries.get(filename)) if (verify or verified is not None) else None
+    exclude_urls = set()
+    attempts = 0
+    while True:
+        result_path = fetch_file(entry.url, output_path, config, keychain, fetchers, size=remote_size, fixity=fixity,
+                                 exclude_urls=exclude_urls, **kwargs)
+        if not (result_path and fixity):
+            return True if result_path else False
+        result = fixity.verify(result_path, read_back=verify)
+        if result is not False:
+            if result and verified is not None:
+                verified[filename] = (FixityCache.stat(result_path), fixity.digests())
+            return True
+        if not verify:
+            return True
+        attempts += 1
+        if attempts > max_attempts:
+            logger.error("File [%s] failed verification on arrival%s." %
+                         (output_path, " after %d attempts" % attempts if attempts > 1 else ""))
+            remove_corrupt_file(result_path)
+            return False
+        if alternate_urls and fixity.url and fixity.url != entry.url:
+            exclude_urls.add(fixity.url)
+        logger.warning("Re-fetching file [%s] that failed verification on arrival (attempt %d of %d)." %
+                       (output_path, attempts, max_attempts))
+
+
+def remove_corrupt_file(path):
+    try:
+        os.remove(path)
+        logger.warning("Removed corrupt file [%s]." % path)
+    except OSError as e:
+        logger.warning("Unable to remove corrupt file [%s]: %s" % (path, e))
+
+
+def get_fetch_concurrency_config(config):
+    fetch_config = config.get(FETCH_CONFIG_TAG) or DEFAULT_FETCH_CONFIG
+    concurrency = DEFAULT_FETCH_CONCURRENCY_CONFIG.copy()
+    concurrency.update(fetch_config.get(FETCH_CONCURRENCY_TAG) or {})
+    return concurrency
+
+
+def get_fetch_verification_config(config):
+    fetch_config = config.get(FETCH_CONFIG_TAG) or DEFAULT_FETCH_CONFIG
+    verification = DEFAULT_FETCH_VERIFICATION_CONFIG.copy()
+    verification.update(fetch_config.get(FETCH_VERIFICATION_TAG) or {})
+    return verification
+
+
 def fetch_single_file(url,
                       output_path=None,
                       config_file=None,
@@ -108,18 +293,21 @@ def fetch_file(url, output_path, config, keychain, fetchers, **kwargs):
         if fetcher:
             fetchers[scheme] = fetcher
     if fetcher:
+        if kwargs.get("fixity"):
+            kwargs["fixity"].url = url
         return fetcher.fetch(url, output_path, **kwargs)
 
     # if we get here, assume the url contains an identifier scheme and try to resolve it as such
     resolver_config = config.get(RESOLVER_CONFIG_TAG, DEFAULT_RESOLVER_CONFIG) if config else DEFAULT_RESOLVER_CONFIG
     supported_resolvers = resolver_config.keys()
     if scheme in supported_resolvers:
-        for entry in resolve(url, resolver_config):
-            url = entry.get("url")
-            if url:
-                result_path = fetch_file(url, output_path, config, keychain, fetchers, **kwargs)
-                if result_path:
-                    return result_path
+        urls = [entry.get("url") for entry in resolve(url, resolver_config) if entry.get("url")]
+        # URLs that previously returned corrupt data are skipped, unless there are no alternatives left to try
+        exclude_urls = kwargs.get("exclude_urls") or set()
+        for url in [url for url in urls if url not in exclude_urls] or urls:
+            result_path = fetch_file(url, output_path, config, keychain, fetchers, **kwargs)
+            if result_path:
+                return result_path
         return None
 
     logger.warning(UNIMPLEMENTED % scheme)
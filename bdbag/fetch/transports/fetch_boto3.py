@@ -16,6 +16,8 @@
 import os
 import datetime
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 from bdbag import urlsplit, urlunsplit, stob, get_typed_exception
 from bdbag.bdbag_config import DEFAULT_CONFIG, DEFAULT_FETCH_CONFIG, FETCH_CONFIG_TAG
@@ -28,6 +30,12 @@ logger = logging.getLogger(__name__)
 BOTO3 = None
 BOTOCORE = None
 CHUNK_SIZE = 10 * Megabyte
+GCS_ENDPOINT_URL = "https://storage.googleapis.com"
+ASSUME_ROLE_DURATION_SECONDS = 3600
+DEFAULT_CREDENTIAL_REFRESH_MARGIN_SECONDS = 300
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_MULTIPART_THRESHOLD = 100 * Megabyte
+DEFAULT_MULTIPART_CHUNKSIZE = 100 * Megabyte
 
 
 class BOTO3FetchTransport(BaseFetchTransport):
@@ -35,6 +43,8 @@ class BOTO3FetchTransport(BaseFetchTransport):
     def __init__(self, config, keychain, **kwargs):
         super(BOTO3FetchTransport, self).__init__(config, keychain, **kwargs)
         self.config = config or DEFAULT_FETCH_CONFIG[SCHEME_S3]
+        self.clients = dict()
+        self.clients_lock = threading.Lock()
 
     @staticmethod
     def import_boto3():
@@ -70,85 +80,202 @@ class BOTO3FetchTransport(BaseFetchTransport):
 
         return credentials
 
-    def fetch(self, url, output_path, **kwargs):
-        success = False
-        output_path = ensure_valid_output_path(url, output_path)
+    @staticmethod
+    def get_client_key(url, credentials):
+        upr = urlsplit(url, allow_fragments=False)
+        endpoint_url = GCS_ENDPOINT_URL if upr.scheme == SCHEME_GS else credentials.get("endpoint_url")
+        return (upr.scheme == SCHEME_GS,
+                endpoint_url,
+                credentials.get("profile"),
+                credentials.get("key"),
+                credentials.get("secret"),
+                credentials.get("token"),
+                credentials.get("role_arn"))
 
-        try:
-            self.import_boto3()
+    def is_client_expired(self, expiration):
+        if expiration is None:
+            return False
+        margin = self.config.get("credential_refresh_margin_seconds", DEFAULT_CREDENTIAL_REFRESH_MARGIN_SECONDS)
+        now = datetime.datetime.now(expiration.tzinfo)
+        return now + datetime.timedelta(seconds=margin) >= expiration
 
-            credentials = self.get_credentials(url) or {}
-            key = credentials.get("key")
-            secret = credentials.get("secret")
-            token = credentials.get("token")
-            role_arn = credentials.get("role_arn")
-            profile_name = credentials.get("profile")
+    def create_client(self, client_key):
+        is_gcs, endpoint_url, profile_name, key, secret, token, role_arn = client_key
+        expiration = None
 
+        try:
+            session = BOTO3.session.Session(profile_name=profile_name)
+        except Exception as e:
+            raise RuntimeError("Unable to create Boto3 session: %s" % get_typed_exception(e))
+
+        if role_arn:
             try:
-                session = BOTO3.session.Session(profile_name=profile_name)
+                sts = session.client("sts")
+                response = sts.assume_role(RoleArn=role_arn,
+                                           RoleSessionName="BDBag-Fetch",
+                                           DurationSeconds=ASSUME_ROLE_DURATION_SECONDS)
+                temp_credentials = response["Credentials"]
+                key = temp_credentials["AccessKeyId"]
+                secret = temp_credentials["SecretAccessKey"]
+                token = temp_credentials["SessionToken"]
+                expiration = temp_credentials.get("Expiration")
             except Exception as e:
-                raise RuntimeError("Unable to create Boto3 session: %s" % get_typed_exception(e))
+                raise RuntimeError(
+                    "Unable to get temporary credentials using arn [%s]. %s" % (role_arn, get_typed_exception(e)))
 
-            if role_arn:
+        try:
+            client_args = {"aws_access_key_id": key, "aws_secret_access_key": secret}
+            if is_gcs:
+                client_args.update({"endpoint_url": endpoint_url,
+                                    "config": BOTO3.session.Config(signature_version="s3v4")})
+            else:
+                if token:
+                    client_args.update({"aws_session_token": token})
+                if endpoint_url:
+                    client_args.update({"endpoint_url": endpoint_url})
+            s3_client = session.client("s3", **client_args)
+        except Exception as e:
+            raise RuntimeError("Unable to create Boto3 storage client: %s" % get_typed_exception(e))
+
+        return s3_client, expiration
+
+    def get_client(self, url):
+        """
+        Return a (cached) storage client for the given URL. Clients are shared across fetches with the same
+        credentials, role, and endpoint, and are re-created shortly before any assumed-role credentials expire.
+        """
+        client_key = self.get_client_key(url, self.get_credentials(url) or {})
+        with self.clients_lock:
+            s3_client, expiration = self.clients.get(client_key, (None, None))
+            if s3_client is None or self.is_client_expired(expiration):
+                if s3_client is not None:
+                    logger.debug("Refreshing Boto3 storage client before temporary credentials expire.")
+                    self.close_client(s3_client)
+                s3_client, expiration = self.create_client(client_key)
+                self.clients[client_key] = (s3_client, expiration)
+        return s3_client
+
+    @staticmethod
+    def close_client(s3_client):
+        close = getattr(s3_client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:  # pragma: no cover
+                logger.debug("Error closing Boto3 storage client: %s" % get_typed_exception(e))
+
+    def read_stream(self, stream, write):
+        chunk_size = self.config.get("read_chunk_size", CHUNK_SIZE)
+        max_retries = self.config.get("max_read_retries", 5)
+        retry_count = 0
+        total = 0
+
+        stream.set_socket_timeout(self.config.get("read_timeout_seconds", 120))
+        try:
+            chunk = None
+            while True:
+                while retry_count < max_retries:
+                    try:
+                        chunk = stream.read(chunk_size)
+                        break
+                    except BOTOCORE.exceptions.ReadTimeoutError as rt:
+                        retry_count += 1
+                        logger.warning("Boto3 read timeout. Retrying attempt %s of %s" %
+                                       (retry_count, max_retries))
+                        if retry_count == max_retries:
+                            raise rt
+                if chunk == b"" or chunk is None:
+                    break
+                write(chunk)
+                total += len(chunk)
+        finally:
+            stream.close()
+
+        return total
+
+    def fetch_part(self, s3_client, bucket, key, etag, fd, start, end):
+        get_args = {"Bucket": bucket, "Key": key, "Range": "bytes=%d-%d" % (start, end)}
+        if etag:
+            get_args.update({"IfMatch": etag})
+        response = s3_client.get_object(**get_args)
+        offset = [start]
+
+        def write(chunk):
+            write_at(fd, chunk, offset[0])
+            offset[0] += len(chunk)
+
+        total = self.read_stream(response["Body"], write)
+        if total != end - start + 1:
+            raise RuntimeError("Ranged GET of bytes %d-%d from bucket [%s] key [%s] returned %d bytes" %
+                               (start, end, bucket, key, total))
+        return total
+
+    def fetch_multipart(self, s3_client, bucket, key, size, etag, output_path, max_concurrency):
+        """
+        Download an object as a set of ranged GET requests issued concurrently, writing each part directly into its
+        place in a preallocated output file. The object's ETag is used as a precondition on every part so that a
+        concurrent overwrite of the object fails the transfer rather than producing a mixed file.
+        """
+        chunksize = self.config.get("multipart_chunksize", DEFAULT_MULTIPART_CHUNKSIZE)
+        parts = [(start, min(start + chunksize, size) - 1) for start in range(0, size, chunksize)]
+        max_concurrency = min(max_concurrency, len(parts))
+        logger.info("Transferring file s3://%s/%s to %s in %d parts using %d threads" %
+                    (bucket, key, output_path, len(parts), max_concurrency))
+        total = 0
+        fd = os.open(output_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = [executor.submit(self.fetch_part, s3_client, bucket, key, etag, fd, part[0], part[1])
+                           for part in parts]
                 try:
-                    sts = session.client("sts")
-                    response = sts.assume_role(RoleArn=role_arn, RoleSessionName="BDBag-Fetch", DurationSeconds=3600)
-                    temp_credentials = response["Credentials"]
-                    key = temp_credentials["AccessKeyId"]
-                    secret = temp_credentials["SecretAccessKey"]
-                    token = temp_credentials["SessionToken"]
-                except Exception as e:
-                    raise RuntimeError(
-                        "Unable to get temporary credentials using arn [%s]. %s" % (role_arn, get_typed_exception(e)))
+                    for future in futures:
+                        total += future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+
+        return total
 
+    def fetch(self, url, output_path, **kwargs):
+        success = False
+        output_path = ensure_valid_output_path(url, output_path)
+
+        try:
+            self.import_boto3()
+
+            s3_client = self.get_client(url)
             upr = urlsplit(url, allow_fragments=False)
-            try:
-                if upr.scheme == SCHEME_GS:
-                    endpoint_url = "https://storage.googleapis.com"
-                    session_config = BOTO3.session.Config(signature_version="s3v4")
-                    kwargs = {"aws_access_key_id": key,
-                              "aws_secret_access_key": secret,
-                              "endpoint_url": endpoint_url,
-                              "config": session_config}
-                else:
-                    kwargs = {"aws_access_key_id": key, "aws_secret_access_key": secret}
-                    if token:
-                        kwargs.update({"aws_session_token": token})
-                s3_client = session.client("s3", **kwargs)
-            except Exception as e:
-                raise RuntimeError("Unable to create Boto3 storage client: %s" % get_typed_exception(e))
 
-            logger.info("Attempting GET from URL: %s" % url)
-            response = s3_client.get_object(Bucket=upr.netloc, Key=upr.path.lstrip("/"))
-            chunk_size = self.config.get("read_chunk_size", CHUNK_SIZE)
-            max_retries = self.config.get("max_read_retries", 5)
-            retry_count = 0
-            total = 0
+            bucket = upr.netloc
+            key = upr.path.lstrip("/")
+            size = kwargs.get("size")
+            max_concurrency = max(1, int(self.config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)))
+            threshold = self.config.get("multipart_threshold", DEFAULT_MULTIPART_THRESHOLD)
+            total = None
 
-            logger.debug("Transferring file %s to %s" % (url, output_path))
+            logger.info("Attempting GET from URL: %s" % url)
             start = datetime.datetime.now()
-            with open(output_path, "wb") as data_file:
-                stream = response["Body"]
-                stream.set_socket_timeout(self.config.get("read_timeout_seconds", 120))
-                chunk = None
-                while True:
-                    while retry_count < max_retries:
-                        try:
-                            chunk = stream.read(chunk_size)
-                            break
-                        except BOTOCORE.exceptions.ReadTimeoutError as rt:
-                            retry_count += 1
-                            logger.warning("Boto3 read timeout. Retrying attempt %s of %s" %
-                                           (retry_count, max_retries))
-                            if retry_count == max_retries:
-                                raise rt
-                    if chunk == b"" or chunk is None:
-                        break
-                    data_file.write(chunk)
-                    total += len(chunk)
-                stream.close()
+            if max_concurrency > 1 and not (isinstance(size, int) and size <= threshold):
+                head = s3_client.head_object(Bucket=bucket, Key=key)
+                if head["ContentLength"] > threshold:
+                    total = self.fetch_multipart(s3_client, bucket, key, head["ContentLength"], head.get("ETag"),
+                                                 output_path, max_concurrency)
+            fixity = kwargs.get("fixity")
+            if total is None:
+                response = s3_client.get_object(Bucket=bucket, Key=key)
+                logger.debug("Transferring file %s to %s" % (url, output_path))
+                if fixity:
+                    fixity.reset()
+                with open(output_path, "wb") as data_file:
+                    total = self.read_stream(response["Body"], fixity_writer(data_file, fixity).write)
+            elif fixity:
+                fixity.invalidate()
             elapsed_time = datetime.datetime.now() - start
-            check_transfer_size_mismatch(output_path, kwargs.get("size"), total)
+            check_transfer_size_mismatch(output_path, size, total)
             logger.info("File [%s] transfer complete. %s" % (output_path, get_transfer_summary(total, elapsed_time)))
             success = True
         except BOTOCORE.exceptions.ClientError as e:
@@ -165,4 +292,7 @@ class BOTO3FetchTransport(BaseFetchTransport):
         return output_path if success else None
 
     def cleanup(self):
-        pass
+        with self.clients_lock:
+            for s3_client, expiration in self.clients.values():
+                self.close_client(s3_client)
+            self.clients.clear()
@@ -14,15 +14,19 @@
 # limitations under the License.
 #
 import os
+import shutil
 import datetime
 import logging
-from bdbag import urlsplit, urlunsplit, urlretrieve, urlcleanup, get_typed_exception
+from contextlib import closing
+from bdbag import urlsplit, urlunsplit, urlretrieve, urlopen, urlcleanup, get_typed_exception
 from bdbag.fetch import *
 from bdbag.fetch.transports.base_transport import BaseFetchTransport
 import bdbag.fetch.auth.keychain as kc
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = Megabyte
+
 
 class FTPFetchTransport(BaseFetchTransport):
 
@@ -69,7 +73,14 @@ class FTPFetchTransport(BaseFetchTransport):
                  url_parts.path, url_parts.query, url_parts.fragment))
             start = datetime.datetime.now()
             logger.debug("Transferring file %s to %s" % (url, output_path))
-            urlretrieve(full_url, output_path)
+            fixity = kwargs.get("fixity")
+            if fixity:
+                # stream the transfer so that the file can be verified as it is written
+                fixity.reset()
+                with closing(urlopen(full_url)) as response, open(output_path, "wb") as data_file:
+                    shutil.copyfileobj(response, fixity_writer(data_file, fixity), CHUNK_SIZE)
+            else:
+                urlretrieve(full_url, output_path)
             elapsed = datetime.datetime.now() - start
             total = os.path.getsize(output_path)
             check_transfer_size_mismatch(output_path, kwargs.get("size"), total)
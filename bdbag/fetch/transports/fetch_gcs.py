@@ -103,7 +103,13 @@ class GCSFetchTransport(BaseFetchTransport):
             logger.debug("Transferring file %s to %s" % (url, output_path))
             blob = bucket.blob(upr.path.lstrip("/"))
             start = datetime.datetime.now()
-            blob.download_to_filename(output_path)
+            fixity = kwargs.get("fixity")
+            if fixity:
+                fixity.reset()
+                with open(output_path, "wb") as data_file:
+                    blob.download_to_file(fixity_writer(data_file, fixity))
+            else:
+                blob.download_to_filename(output_path)
             elapsed_time = datetime.datetime.now() - start
             total = os.path.getsize(output_path)
             check_transfer_size_mismatch(output_path, kwargs.get("size"), total)
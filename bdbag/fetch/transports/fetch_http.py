@@ -14,11 +14,14 @@
 # limitations under the License.
 #
 import os
+import re
+import json
 import datetime
 import logging
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from requests.utils import default_user_agent
-from requests.adapters import HTTPAdapter
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 from requests.packages.urllib3.util.retry import Retry
 from bdbag import urlsplit, stob, get_typed_exception, VERSION
 from bdbag.bdbag_config import DEFAULT_CONFIG, DEFAULT_FETCH_CONFIG, FETCH_CONFIG_TAG, \
@@ -31,6 +34,10 @@ import bdbag.fetch.auth.keychain as kc
 logger = logging.getLogger(__name__)
 
 CHUNK_SIZE = 10 * Megabyte
+DEFAULT_MAX_RESUME_ATTEMPTS = 3
+DEFAULT_SEGMENT_SIZE = 100 * Megabyte
+DEFAULT_SEGMENT_CONNECTIONS = 1
+CONTENT_RANGE_REGEX = re.compile(r"^bytes\s+(?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+|\*)$")
 HEADERS = {"User-Agent": "bdbag/%s (%s)" % (VERSION, default_user_agent())}
 
 
@@ -73,17 +80,23 @@ class HTTPFetchTransport(BaseFetchTransport):
         return False
 
     @staticmethod
-    def init_new_session(session_config):
+    def init_new_session(session_config, pool_maxsize=DEFAULT_POOLSIZE):
         session = requests.session()
         retries = Retry(connect=session_config["retry_connect"],
                         read=session_config["retry_read"],
                         backoff_factor=session_config["retry_backoff_factor"],
                         status_forcelist=session_config["retry_status_forcelist"])
-        session.mount("http://", HTTPAdapter(max_retries=retries))
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        session.mount("http://", HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize))
+        session.mount("https://", HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize))
 
         return session
 
+    def get_segment_connections(self):
+        return max(1, int(self.config.get("segment_connections", DEFAULT_SEGMENT_CONNECTIONS)))
+
+    def get_pool_maxsize(self):
+        return max(DEFAULT_POOLSIZE, self.get_segment_connections())
+
     def get_session(self, url):
         session = None
         response = None
@@ -99,7 +112,8 @@ class HTTPFetchTransport(BaseFetchTransport):
                     break
                 else:
                     session = self.init_new_session(
-                        self.config.get("session_config", DEFAULT_FETCH_HTTP_SESSION_CONFIG))
+                        self.config.get("session_config", DEFAULT_FETCH_HTTP_SESSION_CONFIG),
+                        self.get_pool_maxsize())
 
                 auth_type = auth.get("auth_type")
                 auth_params = auth.get("auth_params", {})
@@ -171,14 +185,198 @@ class HTTPFetchTransport(BaseFetchTransport):
             base_url = str("%s://%s" % (url_parts.scheme, url_parts.netloc))
             session = self.sessions.get(base_url, None)
             if not session:
-                session = self.init_new_session(self.config.get("session_config", DEFAULT_FETCH_HTTP_SESSION_CONFIG))
+                session = self.init_new_session(self.config.get("session_config", DEFAULT_FETCH_HTTP_SESSION_CONFIG),
+                                                self.get_pool_maxsize())
                 self.sessions[base_url] = session
 
         return session
 
+    def get_response(self, session, url, headers, allow_redirects, redirect_status_codes, auth_type,
+                     allow_redirects_with_token):
+        authorization = None
+        while True:
+            logger.info("Attempting GET from URL: %s" % url)
+            r = session.get(url,
+                            stream=True,
+                            headers=headers,
+                            allow_redirects=allow_redirects,
+                            verify=False if self.bypass_cert_verify(url) else True,
+                            cookies=self.cookies)
+            if r.status_code in redirect_status_codes:
+                url = r.headers["Location"]
+                logger.info("Server responded with redirect.")
+                if auth_type == "bearer-token":
+                    authorization = session.headers.get("Authorization")
+                    if allow_redirects_with_token:
+                        if authorization:
+                            headers.update({"Authorization": authorization})
+                        else:
+                            logger.warning(
+                                "Unable to locate Authorization header in requests session headers after redirect")
+                    else:
+                        logger.warning("Authorization bearer token propagation on redirect is disabled for "
+                                       "security reasons. If necessary, you can enable token propagation for this "
+                                       "URL in keychain.json.")
+                        if session.headers.get("Authorization"):
+                            del session.headers["Authorization"]
+                elif not allow_redirects:
+                    logger.warning("Redirects for this scheme have been disabled via the configuration file.")
+            else:
+                break
+
+        # restore the bearer-token auth header back to the session if it exists got stripped due to redirect
+        if auth_type == "bearer-token" and authorization is not None and not session.headers.get("Authorization"):
+            session.headers.update({"Authorization": authorization})
+
+        return r, url
+
+    @staticmethod
+    def get_resume_validator(headers):
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return headers.get("Last-Modified")
+
+    @staticmethod
+    def read_partial_state(url, partial_path):
+        state_path = partial_path + PARTIAL_STATE_SUFFIX
+        if not (os.path.isfile(partial_path) and os.path.isfile(state_path)):
+            return 0, None
+        try:
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, IOError, ValueError) as e:
+            logger.warning("Unable to read partial download state file %s: %s" % (state_path, get_typed_exception(e)))
+            return 0, None
+        if state.get("url") != url or not state.get("validator"):
+            return 0, None
+        return os.path.getsize(partial_path), state.get("validator")
+
+    @staticmethod
+    def write_partial_state(url, partial_path, validator):
+        with open(partial_path + PARTIAL_STATE_SUFFIX, "w") as state_file:
+            json.dump({"url": url, "validator": validator}, state_file)
+
+    @staticmethod
+    def remove_partial_state(partial_path, remove_partial_file=False):
+        paths = [partial_path + PARTIAL_STATE_SUFFIX]
+        if remove_partial_file:
+            paths.append(partial_path)
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    @staticmethod
+    def is_expected_range_response(r, offset):
+        content_range = r.headers.get("Content-Range", "")
+        match = CONTENT_RANGE_REGEX.match(content_range)
+        return match is not None and int(match.group("start")) == offset
+
+    def use_segmented_download(self, size):
+        segment_size = int(self.config.get("segment_size", DEFAULT_SEGMENT_SIZE))
+        return (self.get_segment_connections() > 1 and segment_size > 0 and
+                isinstance(size, int) and size > segment_size)
+
+    def fetch_segment(self, session, url, headers, fd, start, end, validator, max_attempts, response=None):
+        offset = start
+        attempts = 0
+        while offset <= end:
+            if response is None:
+                segment_headers = headers.copy()
+                segment_headers["Range"] = "bytes=%d-%d" % (offset, end)
+                if validator:
+                    segment_headers["If-Range"] = validator
+                response = session.get(url,
+                                       stream=True,
+                                       headers=segment_headers,
+                                       allow_redirects=False,
+                                       verify=False if self.bypass_cert_verify(url) else True,
+                                       cookies=self.cookies)
+            r, response = response, None
+            error = "transfer ended early"
+            try:
+                if r.status_code != 206 or not self.is_expected_range_response(r, offset):
+                    raise requests.exceptions.HTTPError(
+                        "Unexpected response to segment request for bytes %d-%d of %s: HTTP %s" %
+                        (offset, end, url, r.status_code), response=r)
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    chunk = chunk[:end + 1 - offset]
+                    write_at(fd, chunk, offset)
+                    offset += len(chunk)
+                    if offset > end:
+                        break
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                error = get_typed_exception(e)
+            finally:
+                r.close()
+            if offset <= end:
+                attempts += 1
+                if attempts > max_attempts:
+                    raise requests.exceptions.ConnectionError(
+                        "Segment transfer of bytes %d-%d of %s failed after %d attempts: %s" %
+                        (start, end, url, max_attempts, error))
+                logger.warning("Segment transfer of bytes %d-%d of %s interrupted at byte %d: %s. Retrying "
+                               "(attempt %d of %d)." % (start, end, url, offset, error, attempts, max_attempts))
+        return offset - start
+
+    def fetch_segmented(self, session, url, output_path, headers, size, max_attempts, **kwargs):
+        """
+        Download a file of known size as a set of byte ranges over concurrent connections, writing each range
+        directly into its place in a preallocated output file. Returns False (without having written anything) if the
+        server does not honor range requests for the URL, so that the caller can fall back to a single stream.
+        """
+        segment_size = int(self.config.get("segment_size", DEFAULT_SEGMENT_SIZE))
+        segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+        probe_headers = headers.copy()
+        probe_headers["Range"] = "bytes=%d-%d" % segments[0]
+        r, final_url = self.get_response(session, url, probe_headers, **kwargs)
+        if r.status_code != 206 or not self.is_expected_range_response(r, 0) or \
+                r.headers.get("Content-Range", "").rsplit("/", 1)[-1] != str(size):
+            logger.info("Server did not honor byte range request for %s, falling back to a single stream." %
+                        final_url)
+            r.close()
+            return False
+
+        # Segment requests are sent directly to the (possibly redirected) final URL with the same headers as the
+        # probe request. If the bearer token was withheld from the redirect target, it must also be withheld from the
+        # segment requests, which would otherwise pick it up from the session headers.
+        segment_headers = probe_headers.copy()
+        del segment_headers["Range"]
+        if final_url != url and kwargs.get("auth_type") == "bearer-token" and \
+                not kwargs.get("allow_redirects_with_token"):
+            segment_headers["Authorization"] = None
+
+        connections = min(self.get_segment_connections(), len(segments))
+        validator = self.get_resume_validator(r.headers)
+        logger.info("Transferring file %s to %s in %d segments using %d connections" %
+                    (final_url, output_path, len(segments), connections))
+        total = 0
+        start = datetime.datetime.now()
+        fd = os.open(output_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                futures = [executor.submit(self.fetch_segment, session, final_url, segment_headers, fd, segment[0],
+                                           segment[1], validator, max_attempts, r if i == 0 else None)
+                           for i, segment in enumerate(segments)]
+                try:
+                    for future in futures:
+                        total += future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+        elapsed_time = datetime.datetime.now() - start
+        logger.info("File [%s] transfer complete. %s" % (output_path, get_transfer_summary(total, elapsed_time)))
+        return True
+
     def fetch(self, url, output_path, **kwargs):
+        resume = False
+        partial_path = None
         try:
-            headers = kwargs.get("headers", {"Connection": "keep-alive"})
+            headers = dict(kwargs.get("headers") or {"Connection": "keep-alive"})
             headers.update(HEADERS)
             redirect_status_codes = self.config.get(
                 FETCH_HTTP_REDIRECT_STATUS_CODES_TAG, DEFAULT_FETCH_HTTP_REDIRECT_STATUS_CODES)
@@ -187,7 +385,6 @@ class HTTPFetchTransport(BaseFetchTransport):
             output_path = ensure_valid_output_path(url, output_path)
             allow_redirects = stob(self.config.get("allow_redirects", True))
             allow_redirects_with_token = False
-            authorization = None
             auth = self.get_auth(url) or {}
             auth_type = auth.get("auth_type")
             auth_params = auth.get("auth_params")
@@ -199,62 +396,124 @@ class HTTPFetchTransport(BaseFetchTransport):
                 if auth_params:
                     allow_redirects_with_token = stob(auth_params.get("allow_redirects_with_token", False))
 
-            while True:
-                logger.info("Attempting GET from URL: %s" % url)
-                r = session.get(url,
-                                stream=True,
-                                headers=headers,
-                                allow_redirects=allow_redirects,
-                                verify=False if self.bypass_cert_verify(url) else True,
-                                cookies=self.cookies)
-                if r.status_code in redirect_status_codes:
-                    url = r.headers["Location"]
-                    logger.info("Server responded with redirect.")
-                    if auth_type == "bearer-token":
-                        authorization = session.headers.get("Authorization")
-                        if allow_redirects_with_token:
-                            if authorization:
-                                headers.update({"Authorization": authorization})
-                            else:
-                                logger.warning(
-                                    "Unable to locate Authorization header in requests session headers after redirect")
-                        else:
-                            logger.warning("Authorization bearer token propagation on redirect is disabled for "
-                                           "security reasons. If necessary, you can enable token propagation for this "
-                                           "URL in keychain.json.")
-                            if session.headers.get("Authorization"):
-                                del session.headers["Authorization"]
-                    elif not allow_redirects:
-                        logger.warning("Redirects for this scheme have been disabled via the configuration file.")
+            # When resuming is enabled, the transfer is written to a sidecar partial file which is only moved to the
+            # output path once complete, so that an interrupted transfer can later be continued with a Range request.
+            resume = stob(self.config.get("resume_partial_downloads", True))
+            max_resume_attempts = self.config.get("max_resume_attempts", DEFAULT_MAX_RESUME_ATTEMPTS)
+            partial_path = output_path + PARTIAL_FILE_SUFFIX if resume else output_path
+            size = kwargs.get("size")
+            fixity = kwargs.get("fixity")
+            attempts = 0
+
+            segmented = False
+            if self.use_segmented_download(size):
+                if resume:
+                    self.remove_partial_state(partial_path, remove_partial_file=True)
+                segmented = self.fetch_segmented(session, url, partial_path, headers, size, max_resume_attempts,
+                                                 allow_redirects=allow_redirects,
+                                                 redirect_status_codes=redirect_status_codes,
+                                                 auth_type=auth_type,
+                                                 allow_redirects_with_token=allow_redirects_with_token)
+                if segmented and fixity:
+                    fixity.invalidate()
+
+            while not segmented:
+                request_headers = headers.copy()
+                offset, validator = self.read_partial_state(url, partial_path) if resume else (0, None)
+                if offset:
+                    logger.info("Attempting to resume partial download of %s at byte offset %d" %
+                                (output_path, offset))
+                    request_headers.update({"Range": "bytes=%d-" % offset, "If-Range": validator})
+
+                r, final_url = self.get_response(session, url, request_headers, allow_redirects,
+                                                 redirect_status_codes, auth_type, allow_redirects_with_token)
+
+                if offset and r.status_code == 416:
+                    r.close()
+                    if isinstance(size, int) and offset == size:
+                        logger.info("Partial download of %s is already complete." % output_path)
+                        if fixity:
+                            fixity.reset(partial_path, offset)
                         break
-                else:
-                    break
+                    logger.warning("Server rejected the requested range for %s, restarting transfer." % output_path)
+                    self.remove_partial_state(partial_path, remove_partial_file=True)
+                    attempts += 1
+                    if attempts > max_resume_attempts:
+                        return None
+                    continue
 
-            # restore the bearer-token auth header back to the session if it exists got stripped due to redirect
-            if auth_type == "bearer-token" and authorization is not None and not session.headers.get("Authorization"):
-                session.headers.update({"Authorization": authorization})
+                if r.status_code not in (200, 206):
+                    logger.error("HTTP GET Failed for URL: %s" % final_url)
+                    logger.error("Host %s responded:\n\n%s" % (urlsplit(final_url).netloc,  r.text))
+                    logger.warning("File transfer failed: [%s]" % output_path)
+                    return None
+
+                if r.status_code == 206:
+                    if not (offset and self.is_expected_range_response(r, offset)):
+                        logger.warning("Unexpected partial content response for %s, restarting transfer." % url)
+                        r.close()
+                        self.remove_partial_state(partial_path, remove_partial_file=True)
+                        attempts += 1
+                        if attempts > max_resume_attempts:
+                            return None
+                        continue
+                    mode = "ab"
+                    if fixity:
+                        fixity.reset(partial_path, offset)
+                else:
+                    if offset:
+                        logger.info("Server did not honor the resume request for %s, restarting transfer." %
+                                    output_path)
+                    offset = 0
+                    mode = "wb"
+                    if fixity:
+                        fixity.reset()
+                    if resume:
+                        validator = self.get_resume_validator(r.headers)
+                        if validator:
+                            self.write_partial_state(url, partial_path, validator)
+                        else:
+                            self.remove_partial_state(partial_path)
 
-            if r.status_code != 200:
-                logger.error("HTTP GET Failed for URL: %s" % url)
-                logger.error("Host %s responded:\n\n%s" % (urlsplit(url).netloc,  r.text))
-                logger.warning("File transfer failed: [%s]" % output_path)
-            else:
                 total = 0
                 start = datetime.datetime.now()
-                logger.debug("Transferring file %s to %s" % (url, output_path))
-                with open(output_path, "wb") as data_file:
-                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
-                        data_file.write(chunk)
-                        total += len(chunk)
+                logger.debug("Transferring file %s to %s" % (final_url, output_path))
+                try:
+                    with open(partial_path, mode) as data_file:
+                        data_file = fixity_writer(data_file, fixity)
+                        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                            data_file.write(chunk)
+                            total += len(chunk)
+                except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                    attempts += 1
+                    if resume and validator and attempts <= max_resume_attempts:
+                        logger.warning("Transfer of %s interrupted after %d bytes: %s. Resuming (attempt %d of %d)." %
+                                       (output_path, offset + total, get_typed_exception(e), attempts,
+                                        max_resume_attempts))
+                        continue
+                    raise
                 elapsed_time = datetime.datetime.now() - start
-                check_transfer_size_mismatch(output_path, kwargs.get("size"), total)
                 logger.info("File [%s] transfer complete. %s" %
                             (output_path, get_transfer_summary(total, elapsed_time)))
-                return output_path
+                break
+
+            if resume:
+                os.replace(partial_path, output_path)
+                self.remove_partial_state(partial_path)
+            check_transfer_size_mismatch(output_path, size, os.path.getsize(output_path))
+            return output_path
 
         except requests.exceptions.RequestException as e:
             logger.error("HTTP Request Exception: %s" % (get_typed_exception(e)))
 
+        finally:
+            # A partial file left behind by a failed transfer is only kept if it can be resumed later, i.e. if a
+            # validator was recorded for it. Otherwise (no ETag or Last-Modified, or a segmented transfer) remove it.
+            if resume and partial_path and os.path.isfile(partial_path) and \
+                    not self.read_partial_state(url, partial_path)[0]:
+                logger.info("Removing partial download %s which cannot be resumed." % partial_path)
+                self.remove_partial_state(partial_path, remove_partial_file=True)
+
         return None
 
     def cleanup(self):
@@ -0,0 +1,104 @@
+#
+# Copyright 2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# archive_compression.py
+#
+# Compares the time taken to create a "tgz" (or "zip") bag archive with the single threaded compression path and with
+# parallel compression using an increasing number of threads, as set with the "bag_archive_threads" parameter of
+# "bag_config". Parallel "tgz" compression splits the archive stream into blocks, while parallel "zip" compression
+# deflates independent members, so use a larger --file-count with "zip".
+
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from bdbag import bdbag_api as bdb
+
+Megabyte = 1024 ** 2
+
+
+def create_payload(path, file_count, file_size):
+    # half of each file is random (incompressible) data and half is repetitive text, so that the compression level
+    # has a realistic amount of work to do
+    os.makedirs(path)
+    words = [b"bag", b"data", b"manifest", b"fetch", b"payload", b"checksum", b"archive", b"metadata"]
+    rng = random.Random(0)
+    text = b" ".join(rng.choice(words) for _ in range(Megabyte // 6))[:Megabyte // 2]
+    for i in range(file_count):
+        with open(os.path.join(path, "file-%04d.bin" % i), "wb") as f:
+            remaining = file_size
+            while remaining > 0:
+                block = os.urandom(Megabyte // 2) + text
+                f.write(block[:remaining])
+                remaining -= len(block)
+
+
+def run(bag_dir, archiver, threads):
+    start = time.perf_counter()
+    archive = bdb.archive_bag(bag_dir, archiver, idempotent=True, threads=threads)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(archive)
+    os.remove(archive)
+    return elapsed, size
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        description="Benchmark single threaded and parallel compression of tgz and zip bag archives.")
+    parser.add_argument("--archiver", choices=["tgz", "zip"], default="tgz",
+                        help="The archive format to benchmark.")
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="The thread counts to benchmark. Defaults to powers of two up to the number of CPUs.")
+    parser.add_argument("--file-count", type=int, default=8,
+                        help="The number of files in the bag payload.")
+    parser.add_argument("--file-size", type=int, default=64,
+                        help="The size in MB of each file in the bag payload.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="The number of times to run each benchmark. The fastest run is reported.")
+    parser.add_argument("--work-dir", default=None,
+                        help="The directory in which to create the test bag. Defaults to the system temp directory.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cli()
+    logging.getLogger().setLevel(logging.WARNING)
+    cpus = os.cpu_count() or 1
+    threads = args.threads or [1] + [2 ** i for i in range(1, cpus.bit_length()) if 2 ** i <= cpus]
+    work_dir = tempfile.mkdtemp(prefix="bdbag-benchmark-", dir=args.work_dir)
+    try:
+        bag_dir = os.path.join(work_dir, "bag")
+        create_payload(bag_dir, args.file_count, args.file_size * Megabyte)
+        bdb.make_bag(bag_dir, algs=["md5"])
+        payload_mb = args.file_count * args.file_size
+        print("Archiver: %s, payload: %d x %d MB" % (args.archiver, args.file_count, args.file_size))
+        print("%-8s %10s %10s %12s" % ("threads", "time (s)", "MB/s", "size (MB)"))
+        for count in threads:
+            results = [run(bag_dir, args.archiver, count) for _ in range(args.repeat)]
+            elapsed = min(result[0] for result in results)
+            print("%-8d %10.3f %10.1f %12.1f" % (count, elapsed, payload_mb / elapsed, results[0][1] / Megabyte))
+    finally:
+        shutil.rmtree(work_dir)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#
+# Copyright 2016 University of Southern California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# hashing_executors.py
+#
+# Compares the time taken to create and fully validate a bag using each of the checksum executors that can be set with
+# the "bag_executor" parameter of "bag_config", for a bag of many small files and a bag of a few large files.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from bdbag import bdbagit
+
+Kilobyte = 1024
+Megabyte = Kilobyte ** 2
+
+
+def create_payload(path, file_count, file_size):
+    os.makedirs(path)
+    block = os.urandom(min(file_size, Megabyte))
+    for i in range(file_count):
+        subdir = os.path.join(path, "%03d" % (i // 1000))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        with open(os.path.join(subdir, "file-%06d.bin" % i), "wb") as f:
+            remaining = file_size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+
+
+def run(payload_dir, work_dir, executor, processes, algorithms):
+    bag_dir = os.path.join(work_dir, "bag")
+    shutil.copytree(payload_dir, bag_dir)
+    try:
+        start = time.perf_counter()
+        bag = bdbagit.make_bag(bag_dir, processes=processes, checksums=algorithms, executor=executor)
+        created = time.perf_counter()
+        bag.validate(processes=processes, executor=executor)
+        validated = time.perf_counter()
+    finally:
+        shutil.rmtree(bag_dir)
+
+    return created - start, validated - created
+
+
+def parse_cli():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bag checksum executors on small-file and large-file bags.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="The number of concurrent workers to use. Defaults to the number of CPUs.")
+    parser.add_argument("--algorithms", nargs="+", default=["md5", "sha256"],
+                        help="The checksum algorithms to use.")
+    parser.add_argument("--small-file-count", type=int, default=5000,
+                        help="The number of files in the small-file bag.")
+    parser.add_argument("--small-file-size", type=int, default=4,
+                        help="The size in KB of each file in the small-file bag.")
+    parser.add_argument("--large-file-count", type=int, default=8,
+                        help="The number of files in the large-file bag.")
+    parser.add_argument("--large-file-size", type=int, default=128,
+                        help="The size in MB of each file in the large-file bag.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="The number of times to run each benchmark. The fastest run is reported.")
+    parser.add_argument("--work-dir", default=None,
+                        help="The directory in which to create the test bags. Defaults to the system temp directory.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cli()
+    work_dir = tempfile.mkdtemp(prefix="bdbag-benchmark-", dir=args.work_dir)
+    try:
+        payloads = [
+            ("small files (%d x %d KB)" % (args.small_file_count, args.small_file_size),
+             os.path.join(work_dir, "small"), args.small_file_count, args.small_file_size * Kilobyte),
+            ("large files (%d x %d MB)" % (args.large_file_count, args.large_file_size),
+             os.path.join(work_dir, "large"), args.large_file_count, args.large_file_size * Megabyte)
+        ]
+        print("Workers: %d, algorithms: %s" % (args.processes, ", ".join(args.algorithms)))
+        for description, payload_dir, file_count, file_size in payloads:
+            create_payload(payload_dir, file_count, file_size)
+            print("\n%s" % description)
+            print("%-10s %12s %12s" % ("executor", "create (s)", "validate (s)"))
+            for executor in bdbagit.SUPPORTED_EXECUTORS:
+                results = [run(payload_dir, work_dir, executor, args.processes, args.algorithms)
+                           for _ in range(args.repeat)]
+                print("%-10s %12.3f %12.3f" % (executor,
+                                               min(result[0] for result in results),
+                                               min(result[1] for result in results)))
+            shutil.rmtree(payload_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,25 +14,34 @@
 # limitations under the License.
 #
 import io
+import gzip
 import os
 import sys
+import time
+import random
+import unicodedata
 import shutil
 import logging
 import mock
 import unittest
 import tarfile
 import zipfile
+import importlib.util
 from datetime import date, datetime
 from tzlocal import get_localzone
 from os.path import join as ospj
 from os.path import exists as ospe
 from os.path import isfile as ospif
 from bdbag import bdbag_api as bdb, bdbag_config as bdbcfg, bdbag_ro as bdbro, bdbagit as bdbagit, bdbagit_profile, \
-    filter_dict, get_typed_exception, DEFAULT_CONFIG_PATH
+    filter_dict, get_typed_exception, DEFAULT_CONFIG_PATH, guess_mime_type
 from bdbag import bdbag_utils as bdbutils
+from bdbag import bdbag_fixity as bdbfx
+from bdbag import bdbag_archive as bdbarc
 from bdbag.fetch.auth import keychain
 from test.test_common import BaseTest
 
+HAS_ZSTANDARD = importlib.util.find_spec("zstandard") is not None
+
 logger = logging.getLogger()
 
 
@@ -364,6 +373,33 @@ class TestAPI(BaseTest):
         except Exception as e:
             self.fail(get_typed_exception(e))
 
+    def test_update_bag_incremental(self):
+        logger.info(self.getTestHeader('update bag incremental'))
+        try:
+            with mock.patch.object(bdbagit, "MANIFEST_MTIME_MARGIN_NS", 0):
+                bdb.make_bag(self.test_bag_dir, update=True)
+                with open(ospj(self.test_bag_dir, 'data', 'NEWFILE.txt'), 'w') as nf:
+                    nf.write('Additional file added via unit test.')
+                with open(ospj(self.test_bag_dir, 'data', 'README.txt'), 'a') as f:
+                    f.writelines('Additional data added via unit test.')
+                # a file replaced by a copy which preserved an older modification time must also be re-hashed
+                replacement = ospj(self.tmpdir, 'test1.txt')
+                with open(replacement, 'w') as f:
+                    f.write('Replacement file added via unit test.')
+                os.utime(replacement, (0, 0))
+                os.replace(replacement, ospj(self.test_bag_dir, 'data', 'test1', 'test1.txt'))
+                bag = bdb.make_bag(self.test_bag_dir, update=True, incremental=True)
+            output = self.stream.getvalue()
+            self.assertIsInstance(bag, bdbagit.BDBag)
+            self.assertExpectedMessages(['Reusing existing manifest entries for 1 of 4 files'], output)
+            payload_bytes = sum(os.path.getsize(ospj(dirpath, f))
+                                for dirpath, dirnames, filenames in os.walk(ospj(self.test_bag_dir, 'data'))
+                                for f in filenames)
+            self.assertEqual('%d.4' % payload_bytes, bag.info['Payload-Oxum'])
+            bdb.validate_bag(self.test_bag_dir, fast=False)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def test_update_bag_change_file_with_skip_override(self):
         logger.info(self.getTestHeader('update bag change file with no save manifest attempt'))
         try:
@@ -374,6 +410,113 @@ class TestAPI(BaseTest):
         except Exception as e:
             self.fail(get_typed_exception(e))
 
+    def _write_fixity_cache_config(self, trust_on_validate=False):
+        config = bdbcfg.read_config(ospj(self.test_config_dir, 'test-config.json'), create_default=False)
+        config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_FIXITY_CACHE_TAG] = {
+            bdbcfg.BAG_FIXITY_CACHE_ENABLED_TAG: True,
+            bdbcfg.BAG_FIXITY_CACHE_PATH_TAG: ospj(self.tmpdir, 'fixity-cache.db'),
+            bdbcfg.BAG_FIXITY_CACHE_TRUST_ON_VALIDATE_TAG: trust_on_validate
+        }
+        config_file = ospj(self.tmpdir, 'fixity-cache-config.json')
+        bdbcfg.write_config(config, config_file)
+        return config_file
+
+    def _write_checkpoint_config(self, executor="processes", processes=1):
+        config = bdbcfg.read_config(ospj(self.test_config_dir, 'test-config.json'), create_default=False)
+        config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_PROCESSES_TAG] = processes
+        config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_EXECUTOR_TAG] = executor
+        config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_VALIDATION_CHECKPOINT_TAG] = {
+            bdbcfg.BAG_VALIDATION_CHECKPOINT_ENABLED_TAG: True,
+            bdbcfg.BAG_VALIDATION_CHECKPOINT_STATE_DIR_TAG: ospj(self.tmpdir, 'state'),
+            bdbcfg.BAG_VALIDATION_CHECKPOINT_INTERVAL_ENTRIES_TAG: 1
+        }
+        config_file = ospj(self.tmpdir, 'checkpoint-config.json')
+        bdbcfg.write_config(config, config_file)
+        return config_file
+
+    def _make_nfd_bag(self):
+        # a bag whose payload file name is NFD normalized on the filesystem but NFC normalized in the manifests
+        bag_dir = ospj(self.tmpdir, 'nfd-bag')
+        os.makedirs(bag_dir)
+        with open(ospj(bag_dir, unicodedata.normalize('NFD', 'café.txt')), 'w') as f:
+            f.write('This is a test filename written using NFD normalization\n')
+        bag = bdb.make_bag(bag_dir)
+        # the fixity cache does not trust the fixities of files modified too recently
+        for file_name in os.listdir(ospj(bag_dir, 'data')):
+            os.utime(ospj(bag_dir, 'data', file_name), (time.time() - 3600, time.time() - 3600))
+        for manifest_file in bag.manifest_files():
+            with open(manifest_file, 'rb') as f:
+                contents = f.read().decode('utf-8')
+            with open(manifest_file, 'wb') as f:
+                f.write(unicodedata.normalize('NFC', contents).encode('utf-8'))
+        for alg in bag.algorithms:
+            bdbagit._make_tagmanifest_file(alg, bag_dir, encoding=bag.encoding)
+        return bag_dir
+
+    def _write_executor_config(self, executor, processes=2):
+        config = bdbcfg.read_config(ospj(self.test_config_dir, 'test-config.json'), create_default=False)
+        config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_PROCESSES_TAG] = processes
+        config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_EXECUTOR_TAG] = executor
+        config_file = ospj(self.tmpdir, 'executor-config.json')
+        bdbcfg.write_config(config, config_file)
+        return config_file
+
+    def test_update_bag_with_thread_executor(self):
+        logger.info(self.getTestHeader('update bag with thread executor'))
+        try:
+            config_file = self._write_executor_config("threads")
+            bdb.make_bag(self.test_bag_dir, update=True, save_manifests=True, config_file=config_file)
+            self.assertExpectedMessages(['Using 2 threads to generate manifests'], self.stream.getvalue())
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_create_bag_with_invalid_executor(self):
+        logger.info(self.getTestHeader('create bag with invalid executor'))
+        try:
+            config_file = self._write_executor_config("fibers")
+            self.assertRaisesRegex(RuntimeError, "Unsupported executor: fibers",
+                                   bdb.make_bag, self.test_data_dir, config_file=config_file)
+            self.assertFalse(bdb.is_bag(self.test_data_dir))
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_update_bag_with_fixity_cache(self):
+        logger.info(self.getTestHeader('update bag with fixity cache'))
+        try:
+            config_file = self._write_fixity_cache_config()
+            bdb.make_bag(self.test_bag_dir, update=True, config_file=config_file)
+            self.assertExpectedMessages(['Using cached fixities for 0 of 3 files'], self.stream.getvalue())
+            self.assertTrue(ospif(ospj(self.tmpdir, 'fixity-cache.db')))
+
+            with open(ospj(self.test_bag_dir, 'data', 'README.txt'), 'a') as f:
+                f.writelines('Additional data added via unit test.')
+            bdb.make_bag(self.test_bag_dir, update=True, config_file=config_file)
+            self.assertExpectedMessages(['Using cached fixities for 2 of 3 files'], self.stream.getvalue())
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file)
+            self.assertUnexpectedMessages(['Trusting cached fixities'], self.stream.getvalue())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_fixity_cache_invalidation(self):
+        logger.info(self.getTestHeader('fixity cache invalidation'))
+        try:
+            test_file = ospj(self.test_bag_dir, 'data', 'README.txt')
+            with bdbfx.FixityCache(ospj(self.tmpdir, 'fixity-cache.db'), max_entries=1) as cache:
+                key = cache.stat(test_file)
+                self.assertTrue(cache.put(key, {"md5": "ABC123"}))
+                self.assertEqual({"md5": "abc123"}, cache.get(key, ["md5"]))
+                self.assertIsNone(cache.get(key, ["md5", "sha256"]))
+                changed_key = key[:2] + (key[2] + 1, key[3])
+                self.assertIsNone(cache.get(changed_key, ["md5"]))
+                # digests of files modified too recently to trust their mtime are not recorded
+                self.assertFalse(cache.put(key[:3] + (time.time_ns(),), {"md5": "def456"}))
+                cache.put(cache.stat(ospj(self.test_bag_dir, 'bag-info.txt')), {"md5": "def456"})
+            with bdbfx.FixityCache(ospj(self.tmpdir, 'fixity-cache.db')) as cache:
+                self.assertEqual(1, cache.connection.execute("SELECT COUNT(*) FROM fixity").fetchone()[0])
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def _test_create_or_update_bag_with_metadata(
             self, update=False, override_file_metadata=False, no_file_metadata=False):
         try:
@@ -587,6 +730,46 @@ class TestAPI(BaseTest):
         except Exception as e:
             self.fail(get_typed_exception(e))
 
+    def test_archive_bag_zip_store_compressed(self):
+        logger.info(self.getTestHeader('archive bag zip format storing already compressed files'))
+        try:
+            with gzip.open(ospj(self.test_data_dir, 'reads.fastq.gz'), 'wb') as reads:
+                reads.write(b'@read\nACGT\n+\nIIII\n' * 1000)
+            with open(ospj(self.test_data_dir, 'noise.dat'), 'wb') as noise:
+                noise.write(os.urandom(32768))
+            with open(ospj(self.test_data_dir, 'notes.txt'), 'w') as notes:
+                notes.write('notes ' * 2000)
+            bdb.make_bag(self.test_data_dir)
+            config = bdbcfg.read_config(ospj(self.test_config_dir, 'test-config.json'), create_default=False)
+            config[bdbcfg.BAG_CONFIG_TAG][bdbcfg.BAG_ARCHIVE_ZIP_STORE_TAG] = {
+                bdbcfg.BAG_ARCHIVE_ZIP_STORE_ENABLED_TAG: True}
+            config_file = ospj(self.tmpdir, 'zip-store-config.json')
+            bdbcfg.write_config(config, config_file)
+            archive_file = bdb.archive_bag(self.test_data_dir, 'zip', config_file=config_file)
+            with zipfile.ZipFile(archive_file) as archive:
+                self.assertIsNone(archive.testzip())
+                compression = dict((os.path.basename(info.filename), info.compress_type)
+                                   for info in archive.infolist() if not info.is_dir())
+            # stored by extension, by trial compression, and deflated
+            self.assertEqual(zipfile.ZIP_STORED, compression['reads.fastq.gz'])
+            self.assertEqual(zipfile.ZIP_STORED, compression['noise.dat'])
+            self.assertEqual(zipfile.ZIP_DEFLATED, compression['notes.txt'])
+            self.assertEqual(zipfile.ZIP_DEFLATED, compression['manifest-sha256.txt'])
+            self.assertExpectedMessages(["Stored 2 already compressed file(s)"], self.stream.getvalue())
+            bag_path = bdb.extract_bag(archive_file, temp=True)
+            bdb.validate_bag(bag_path)
+            bdb.cleanup_bag(os.path.dirname(bag_path))
+            os.remove(archive_file)
+
+            # disabled by default
+            archive_file = bdb.archive_bag(self.test_data_dir, 'zip',
+                                           config_file=ospj(self.test_config_dir, 'test-config.json'))
+            with zipfile.ZipFile(archive_file) as archive:
+                self.assertEqual(set([zipfile.ZIP_DEFLATED]),
+                                 set(info.compress_type for info in archive.infolist() if not info.is_dir()))
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def test_archive_bag_tgz(self):
         logger.info(self.getTestHeader('archive bag tgz format'))
         try:
@@ -620,6 +803,21 @@ class TestAPI(BaseTest):
         except Exception as e:
             self.fail(get_typed_exception(e))
 
+    @unittest.skipIf(not HAS_ZSTANDARD, 'The zstandard package is not installed')
+    def test_archive_bag_zst(self):
+        logger.info(self.getTestHeader('archive bag zst format'))
+        try:
+            archive_file = bdb.archive_bag(self.test_bag_dir, 'zst', threads=2)
+            self.assertTrue(ospif(archive_file))
+            self.assertTrue(archive_file.endswith(".tar.zst"))
+            self.assertEqual("application/x-tar+zstd", guess_mime_type(archive_file))
+            bag_path = bdb.extract_bag(archive_file, temp=True)
+            self.assertTrue(bdb.is_bag(bag_path))
+            bdb.validate_bag(bag_path)
+            bdb.cleanup_bag(os.path.dirname(bag_path))
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def _test_archive_bag_idempotent(self, archive_format, hash_function="sha256"):
         logger.info(self.getTestHeader('archive bag idempotent %s format' % archive_format))
         try:
@@ -646,6 +844,133 @@ class TestAPI(BaseTest):
     def test_archive_bag_idempotent_tgz(self):
         self._test_archive_bag_idempotent("tgz")
 
+    def test_archive_bag_idempotent_tgz_single_pass(self):
+        logger.info(self.getTestHeader('archive bag idempotent tgz format in a single pass'))
+        try:
+            # the reference archive is created the way it used to be: by gzipping an idempotent tar file with mtime=0
+            tar_file = bdb.archive_bag(self.test_bag_dir, "tar", idempotent=True)
+            reference_file = os.path.splitext(tar_file)[0] + "-reference.tgz"
+            with open(tar_file, "rb") as f_in, open(reference_file, "wb") as f_out:
+                with gzip.GzipFile(filename=tar_file, mode="wb", fileobj=f_out, mtime=0) as gzf:
+                    shutil.copyfileobj(f_in, gzf)
+            os.remove(tar_file)
+
+            with mock.patch("bdbag.bdbag_api.tarfile.open", side_effect=tarfile.open) as tar_open:
+                archive_file = bdb.archive_bag(self.test_bag_dir, "tgz", idempotent=True)
+                self.assertIn("fileobj", tar_open.call_args.kwargs)
+            self.assertFalse(ospif(tar_file))
+            with open(reference_file, "rb") as reference, open(archive_file, "rb") as archive:
+                self.assertEqual(reference.read(), archive.read())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_archive_bag_tgz_parallel(self):
+        logger.info(self.getTestHeader('archive bag tgz format with parallel compression'))
+        try:
+            archives = list()
+            for threads in (2, 4):
+                archive_file = bdb.archive_bag(self.test_bag_dir, "tgz", idempotent=True, threads=threads)
+                archives.append(os.path.splitext(archive_file)[0] + "-%d.tgz" % threads)
+                os.rename(archive_file, archives[-1])
+            with open(archives[0], "rb") as archive1, open(archives[1], "rb") as archive2:
+                self.assertEqual(archive1.read(), archive2.read())
+            with tarfile.open(archives[0], "r:gz") as archive, tarfile.open(
+                    bdb.archive_bag(self.test_bag_dir, "tar", idempotent=True)) as reference:
+                self.assertEqual([(m.name, m.size, m.mtime) for m in reference.getmembers()],
+                                 [(m.name, m.size, m.mtime) for m in archive.getmembers()])
+            bdb.validate_bag(bdb.extract_bag(archives[0], temp=True))
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_parallel_gzip_file_blocks(self):
+        logger.info(self.getTestHeader('parallel gzip compression of multiple blocks'))
+        try:
+            rng = random.Random(0)
+            data = b"".join(bytes(rng.getrandbits(8) for _ in range(256)) + b"bdbag " * 300 for _ in range(40))
+            outputs = list()
+            for threads in (1, 2, 4):
+                output = io.BytesIO()
+                # a small block size splits the data into many blocks, each compressed with the preceding block as a
+                # preset dictionary and sync flushed, except the last which finishes the stream
+                with bdbarc.ParallelGzipFile(output, threads, mtime=0, block_size=4096) as gzf:
+                    for i in range(0, len(data), 1000):
+                        gzf.write(data[i:i + 1000])
+                self.assertEqual(data, gzip.decompress(output.getvalue()))
+                outputs.append(output.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertEqual(outputs[0], outputs[2])
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_archive_bag_zip_parallel(self):
+        logger.info(self.getTestHeader('archive bag zip format with parallel compression'))
+        try:
+            archives = list()
+            for threads in (1, 4):
+                archive_file = bdb.archive_bag(self.test_bag_dir, "zip", idempotent=True, threads=threads)
+                archives.append(os.path.splitext(archive_file)[0] + "-%d.zip" % threads)
+                os.rename(archive_file, archives[-1])
+            with open(archives[0], "rb") as archive1, open(archives[1], "rb") as archive2:
+                self.assertEqual(archive1.read(), archive2.read())
+            with zipfile.ZipFile(archives[1]) as archive:
+                self.assertIsNone(archive.testzip())
+            bdb.validate_bag(bdb.extract_bag(archives[1], temp=True))
+
+            # where the ZipFile internals are not known to be compatible, members are compressed serially instead
+            with mock.patch("bdbag.bdbag_archive.can_write_deflated_members", return_value=False), \
+                    mock.patch("bdbag.bdbag_archive.deflate_files") as deflate_files:
+                archive_file = bdb.archive_bag(self.test_bag_dir, "zip", idempotent=True, threads=4)
+                self.assertFalse(deflate_files.called)
+            with open(archives[0], "rb") as archive1, open(archive_file, "rb") as archive2:
+                self.assertEqual(archive1.read(), archive2.read())
+            self.assertExpectedMessages(["Compressing members using a single thread"], self.stream.getvalue())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_deflate_files_closed_early(self):
+        logger.info(self.getTestHeader('parallel zip member compression closed before all files are written'))
+        try:
+            spools = list()
+
+            def deflate_file(path, level):
+                spools.append(mock.Mock())
+                return 0, 0, spools[-1]
+
+            with mock.patch("bdbag.bdbag_archive.deflate_file", new=deflate_file):
+                deflated = bdbarc.deflate_files(["file-%d" % i for i in range(10)], 2)
+                next(deflated)
+                deflated.close()
+            # the first result was consumed (and is closed by the consumer), and the rest are closed by the generator
+            self.assertTrue(len(spools) > 1)
+            self.assertFalse(spools[0].close.called)
+            for spool in spools[1:]:
+                self.assertTrue(spool.close.called)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    @unittest.skipIf(not HAS_ZSTANDARD, 'The zstandard package is not installed')
+    def test_archive_bag_idempotent_zst(self):
+        self._test_archive_bag_idempotent("zst")
+        try:
+            # the payload must be large enough (several MB) for Zstandard to emit more than one job's worth of output,
+            # which is where single threaded and multi-threaded compression differ
+            bag_dir = ospj(self.tmpdir, "test-bag-zst")
+            shutil.copytree(self.test_bag_dir, bag_dir)
+            rng = random.Random(0)
+            with open(ospj(bag_dir, "data", "large.bin"), "wb") as large:
+                for _ in range(64):
+                    large.write(bytes(rng.getrandbits(8) for _ in range(4096)) + b"A" * 61440)
+            bdb.make_bag(bag_dir, update=True)
+            archives = list()
+            for threads in (1, 4):
+                archive_file = bdb.archive_bag(bag_dir, "zst", idempotent=True, threads=threads)
+                archives.append(archive_file.replace(".tar.zst", "-%d.tar.zst" % threads))
+                os.rename(archive_file, archives[-1])
+            with open(archives[0], "rb") as archive1, open(archives[1], "rb") as archive2:
+                self.assertEqual(archive1.read(), archive2.read())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def test_archive_bag_idempotent_bz2(self):
         self._test_archive_bag_idempotent("bz2")
 
@@ -791,6 +1116,10 @@ class TestAPI(BaseTest):
     def test_extract_bag_archive_xz(self):
         self._test_extract_bag_archive_tar("xz")
 
+    @unittest.skipIf(not HAS_ZSTANDARD, 'The zstandard package is not installed')
+    def test_extract_bag_archive_zst(self):
+        self._test_extract_bag_archive_tar("tar.zst")
+
     def _test_extract_bag_archive_tar(self, archive_format):
         logger.info(self.getTestHeader('extract bag %s format' % archive_format))
         try:
@@ -859,6 +1188,176 @@ class TestAPI(BaseTest):
         except Exception as e:
             self.fail(get_typed_exception(e))
 
+    def test_validate_complete_bag_full_with_callback_and_processes(self):
+        logger.info(self.getTestHeader('test full validation complete bag with callback and multiple processes'))
+        try:
+            config_file = self._write_executor_config("processes")
+            total = len(bdbagit.BDBag(self.test_bag_dir).entries)
+            progress = list()
+
+            def callback(current, total):
+                progress.append((current, total))
+                return True
+
+            bdb.validate_bag(self.test_bag_dir, fast=False, callback=callback, config_file=config_file)
+            self.assertEqual([(i, total) for i in range(1, total + 1)], progress)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_complete_bag_full_with_callback_and_cancel_threads(self):
+        logger.info(self.getTestHeader('test full validation complete bag with callback and cancel using threads'))
+        try:
+            config_file = self._write_executor_config("threads")
+
+            def callback(current, total):
+                return current < 2
+
+            self.assertRaises(bdbagit.BaggingInterruptedError,
+                              bdb.validate_bag,
+                              self.test_bag_dir,
+                              fast=False,
+                              callback=callback,
+                              config_file=config_file)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def _test_validate_complete_bag_full_with_checkpoint(self, executor, processes):
+        config_file = self._write_checkpoint_config(executor, processes)
+        journal = bdbfx.ValidationCheckpoint.get_journal_path(self.test_bag_dir, ospj(self.tmpdir, 'state'))
+        total = len(bdbagit.BDBag(self.test_bag_dir).entries)
+
+        def callback(current, total):
+            return current < 2
+
+        self.assertRaises(bdbagit.BaggingInterruptedError, bdb.validate_bag, self.test_bag_dir, fast=False,
+                          callback=callback, config_file=config_file)
+        self.assertTrue(ospif(journal))
+        with open(journal) as f:
+            self.assertEqual(2, len(f.readlines()))
+
+        bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file)
+        self.assertExpectedMessages(["Resuming validation from checkpoint journal",
+                                     "Skipping 2 of %d files already verified before the last checkpoint" % total],
+                                    self.stream.getvalue())
+        self.assertFalse(ospif(journal))
+
+    def test_validate_complete_bag_full_with_checkpoint(self):
+        logger.info(self.getTestHeader('test full validation complete bag resumed from checkpoint'))
+        try:
+            self._test_validate_complete_bag_full_with_checkpoint("serial", 1)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_complete_bag_full_with_checkpoint_threads(self):
+        logger.info(self.getTestHeader('test full validation complete bag resumed from checkpoint using threads'))
+        try:
+            self._test_validate_complete_bag_full_with_checkpoint("threads", 2)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_bag_sample_report(self):
+        logger.info(self.getTestHeader('test sampled validation returns sample report'))
+        try:
+            self.assertIsNone(bdb.validate_bag(self.test_bag_dir, fast=False))
+            report = bdb.validate_bag(self.test_bag_dir, fast=False, sample=bdbagit.ValidationSample(count=2, seed=42))
+            self.assertEqual(42, report["seed"])
+            self.assertEqual(2, report["sampled"])
+            self.assertEqual(0.95, report["confidence"])
+            self.assertIn("max_corrupt", report)
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_bag_sampled_and_filtered_ignore_checkpoint(self):
+        logger.info(self.getTestHeader('test sampled and filtered validation do not use the checkpoint'))
+        try:
+            config_file = self._write_checkpoint_config()
+            journal = bdbfx.ValidationCheckpoint.get_journal_path(self.test_bag_dir, ospj(self.tmpdir, 'state'))
+            total = len(bdbagit.BDBag(self.test_bag_dir).entries)
+
+            def callback(current, total):
+                return current < 2
+
+            self.assertRaises(bdbagit.BaggingInterruptedError, bdb.validate_bag, self.test_bag_dir, fast=False,
+                              callback=callback, config_file=config_file)
+            self.assertTrue(ospif(journal))
+            offset = len(self.stream.getvalue())
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file,
+                             sample=bdbagit.ValidationSample(count=1, seed=1))
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file,
+                             filter_expr="filename^*data/test1/")
+            self.assertNotIn("already verified before the last checkpoint", self.stream.getvalue()[offset:])
+            self.assertTrue(ospif(journal))
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file)
+            self.assertExpectedMessages(["Skipping 2 of %d files already verified before the last checkpoint" % total],
+                                        self.stream.getvalue())
+            self.assertFalse(ospif(journal))
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_bag_full_with_checkpoint_modified_file(self):
+        logger.info(self.getTestHeader('test full validation with checkpoint re-verifies modified files'))
+        try:
+            config_file = self._write_checkpoint_config()
+
+            def callback(current, total):
+                return current < total - 1
+
+            self.assertRaises(bdbagit.BaggingInterruptedError, bdb.validate_bag, self.test_bag_dir, fast=False,
+                              callback=callback, config_file=config_file)
+            with open(ospj(self.test_bag_dir, 'data', 'README.txt'), 'r+b') as f:
+                f.write(b"X")
+            self.assertRaises(bdbagit.BagValidationError, bdb.validate_bag, self.test_bag_dir, fast=False,
+                              config_file=config_file)
+            self.assertExpectedMessages(["data/README.txt md5 validation failed"], self.stream.getvalue())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_bag_full_with_checkpoint_normalized_name(self):
+        logger.info(self.getTestHeader('test full validation with checkpoint and unicode normalized file name'))
+        try:
+            bag_dir = self._make_nfd_bag()
+            config_file = self._write_checkpoint_config()
+            journal = bdbfx.ValidationCheckpoint.get_journal_path(bag_dir, ospj(self.tmpdir, 'state'))
+            total = len(bdbagit.BDBag(bag_dir).entries)
+
+            def callback(current, total):
+                return current < total
+
+            self.assertRaises(bdbagit.BaggingInterruptedError, bdb.validate_bag, bag_dir, fast=False,
+                              callback=callback, config_file=config_file)
+            bdb.validate_bag(bag_dir, fast=False, config_file=config_file)
+            self.assertExpectedMessages(["Skipping %d of %d files already verified before the last checkpoint" %
+                                         (total - 1, total)], self.stream.getvalue())
+            self.assertFalse(ospif(journal))
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_complete_bag_full_with_fixity_cache(self):
+        logger.info(self.getTestHeader('test full validation complete bag with trusted fixity cache'))
+        try:
+            config_file = self._write_fixity_cache_config(trust_on_validate=True)
+            total = len(bdbagit.BDBag(self.test_bag_dir).entries)
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file)
+            self.assertExpectedMessages(['Trusting cached fixities for 0 of %d files' % total], self.stream.getvalue())
+            bdb.validate_bag(self.test_bag_dir, fast=False, config_file=config_file)
+            self.assertExpectedMessages(['Trusting cached fixities for %d of %d files' % (total, total)],
+                                        self.stream.getvalue())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
+    def test_validate_bag_full_with_fixity_cache_normalized_name(self):
+        logger.info(self.getTestHeader('test full validation with fixity cache and unicode normalized file name'))
+        try:
+            bag_dir = self._make_nfd_bag()
+            config_file = self._write_fixity_cache_config(trust_on_validate=True)
+            total = len(bdbagit.BDBag(bag_dir).entries)
+            bdb.validate_bag(bag_dir, fast=False, config_file=config_file)
+            bdb.validate_bag(bag_dir, fast=False, config_file=config_file)
+            self.assertExpectedMessages(['Trusting cached fixities for %d of %d files' % (total, total)],
+                                        self.stream.getvalue())
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def test_validate_complete_bag_fast(self):
         logger.info(self.getTestHeader('test fast validation complete bag'))
         try:
@@ -891,6 +1390,19 @@ class TestAPI(BaseTest):
         except Exception as e:
             self.fail(get_typed_exception(e))
 
+    def test_validate_incomplete_bag_full_with_filter(self):
+        logger.info(self.getTestHeader('test full validation incomplete bag with filter expression'))
+        try:
+            bdb.validate_bag(self.test_bag_incomplete_dir, fast=False, filter_expr="filename!*test-fetch")
+            bdb.validate_bag(self.test_bag_incomplete_dir, fast=False, filter_expr="filename^*data/test1/")
+            self.assertRaisesRegex(
+                bdbagit.BagValidationError,
+                "^Bag validation failed:.*test-fetch-http[.]txt",
+                bdb.validate_bag,
+                self.test_bag_incomplete_dir, fast=False, filter_expr="url=*raw.githubusercontent.com")
+        except Exception as e:
+            self.fail(get_typed_exception(e))
+
     def test_validate_unexpected_bag_fetch(self):
         logger.info(self.getTestHeader('test bag validation with unexpected entries bag in fetch.txt'))
         try:
@@ -130,6 +130,86 @@ class TestSingleProcessValidation(SelfCleaningTestCase):
         self.assertTrue(self.validate(bag, fast=True))
         self.assertTrue(self.validate(bag, completeness_only=True))
 
+    def test_validate_fail_fast(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir)
+        for path in (j(self.tmpdir, "data", "README"), j(self.tmpdir, "data", "loc", "3314493806_6f1db86d66_o_d.jpg")):
+            with open(path, "r+b") as f:
+                f.write(b"X")
+        bag = bagit.BDBag(self.tmpdir)
+        with self.assertRaises(bagit.BagValidationError) as ar:
+            self.validate(bag)
+        self.assertEqual(4, len(ar.exception.details))
+        with self.assertRaises(bagit.BagValidationError) as ar:
+            self.validate(bag, fail_fast=True)
+        self.assertEqual(2, len(ar.exception.details))
+        self.assertEqual(1, len(set(e.path for e in ar.exception.details)))
+        with self.assertRaises(bagit.BagValidationError) as ar:
+            self.validate(bag, processes=2, executor="threads", fail_fast=True)
+        self.assertEqual(1, len(set(e.path for e in ar.exception.details)))
+
+    def test_validate_filter_expr(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir)
+        with open(j(self.tmpdir, "data", "README"), "r+b") as f:
+            f.write(b"X")
+        os.remove(j(self.tmpdir, "data", "loc", "2478433644_2839c5e8b8_o_d.jpg"))
+        bag = bagit.BDBag(self.tmpdir)
+        self.assertRaises(bagit.BagValidationError, self.validate, bag)
+        self.assertTrue(self.validate(bag, filter_expr="filename=~^data/si/"))
+        self.assertTrue(self.validate(bag, processes=2, executor="threads", filter_expr="filename$*.json"))
+        with self.assertRaises(bagit.BagValidationError) as ar:
+            self.validate(bag, filter_expr="filename!*/loc/")
+        self.assertEqual(2, len(ar.exception.details))
+        self.assertEqual({"data/README"}, set(e.path for e in ar.exception.details))
+        with self.assertRaises(bagit.BagValidationError) as ar:
+            self.validate(bag, filter_expr="filename^*data/loc/")
+        self.assertEqual(1, len(ar.exception.details))
+        self.assertIsInstance(ar.exception.details[0], bagit.FileMissing)
+        self.assertRaises(bagit.BagValidationError, self.validate, bag, fast=True, filter_expr="filename^*data/si/")
+
+    def test_validate_sample(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir)
+        bag = bagit.BDBag(self.tmpdir)
+        with self.assertLogs(bagit.LOGGER, level="INFO") as cm:
+            self.assertTrue(self.validate(bag, sample=bagit.ValidationSample(count=2, seed=42)))
+        self.assertEqual(2, bag.sample_report["sampled"])
+        self.assertEqual(5, bag.sample_report["population"])
+        self.assertEqual(42, bag.sample_report["seed"])
+        self.assertTrue(any("Sampling 2 of 5 payload files" in line for line in cm.output))
+        self.assertTrue(any("at most 3 files" in line for line in cm.output))
+
+        # the same seed always selects the same files
+        with open(j(self.tmpdir, "data", "README"), "r+b") as f:
+            f.write(b"X")
+        results = set()
+        for _ in range(3):
+            try:
+                self.validate(bag, sample=bagit.ValidationSample(count=2, seed=42))
+                results.add(True)
+            except bagit.BagValidationError:
+                results.add(False)
+        self.assertEqual(1, len(results))
+
+        # a sample of every file finds the mismatch, and a byte budget smaller than any file still checks one file
+        self.assertRaises(bagit.BagValidationError, self.validate, bag, sample=bagit.ValidationSample(count=5))
+        self.assertRaises(bagit.BagValidationError, self.validate, bag, fast=True, sample=bagit.ValidationSample())
+        try:
+            self.validate(bag, sample=bagit.ValidationSample(bytes=1, seed=7, weight_recent=True))
+        except bagit.BagValidationError:
+            pass
+        self.assertEqual(1, bag.sample_report["sampled"])
+        self.assertTrue(bag.sample_report["weighted"])
+
+    def test_sample_confidence_bound(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        self.assertEqual(0, bagit.sample_confidence_bound(100, 100))
+        self.assertEqual(100, bagit.sample_confidence_bound(100, 0))
+        self.assertLessEqual(bagit.sample_confidence_bound(100000, 300), 1000)
+        self.assertGreater(bagit.sample_confidence_bound(100000, 300), 900)
+        self.assertLess(bagit.sample_confidence_bound(100000, 3000), bagit.sample_confidence_bound(100000, 300))
+
     def test_validate_fast(self):
         logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
         bag = bagit.make_bag(self.tmpdir)
@@ -706,6 +786,228 @@ Tag-File-Character-Encoding: UTF-8
         bagit.make_bag(self.tmpdir, processes=2)
         self.assertTrue(os.path.isdir(j(self.tmpdir, 'data')))
 
+    def test_make_bag_thread_executor(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        with self.assertLogs(bagit.LOGGER, level="INFO") as logs:
+            bag = bagit.make_bag(self.tmpdir, processes=2, executor="threads")
+        self.assertIn("Using 2 threads to generate manifests", "\n".join(logs.output))
+        self.assertTrue(bag.validate(processes=2, executor="threads"))
+        readme = j(self.tmpdir, "data", "README")
+        txt = slurp_text_file(readme)
+        with io.open(readme, "w", newline="\n") as r:
+            r.write('A' + txt[1:])
+        bag = bagit.BDBag(self.tmpdir)
+        self.assertRaises(bagit.BagValidationError, bag.validate, processes=2, executor="threads")
+
+    def test_make_bag_serial_executor(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        with self.assertLogs(bagit.LOGGER, level="INFO") as logs:
+            bag = bagit.make_bag(self.tmpdir, processes=2, executor="serial")
+        self.assertIn("Using 1 processes to generate manifests", "\n".join(logs.output))
+        self.assertTrue(bag.validate(processes=2, executor="serial"))
+
+    def test_schedule_tasks_largest_first(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        mb = 1024 * 1024
+        sizes = [10, 100 * mb, 20, 5 * mb, 30, 400 * mb] + [1] * 100
+        tasks = bagit.schedule_tasks(sizes, workers=2)
+        # large files are dispatched individually, largest first
+        self.assertEqual([[5], [1], [3]], tasks[:3])
+        # small files are batched, and every file is scheduled exactly once
+        self.assertTrue(all(len(task) > 1 for task in tasks[3:]))
+        self.assertEqual(list(range(len(sizes))), sorted(index for task in tasks for index in task))
+        # small files are never batched so coarsely that workers are left idle
+        self.assertGreaterEqual(len(tasks[3:]), 2 * bagit.HASHING_TASKS_PER_WORKER)
+
+    def test_make_bag_deterministic_manifest_order(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        serial_dir = tempfile.mkdtemp()
+        try:
+            shutil.rmtree(serial_dir)
+            shutil.copytree(self.tmpdir, serial_dir)
+            bagit.make_bag(serial_dir, executor="serial")
+            bagit.make_bag(self.tmpdir, processes=3, executor="threads")
+            for alg in ("sha256", "sha512"):
+                manifest = "manifest-%s.txt" % alg
+                self.assertEqual(slurp_text_file(j(serial_dir, manifest)), slurp_text_file(j(self.tmpdir, manifest)))
+        finally:
+            shutil.rmtree(serial_dir)
+
+    def test_payload_inventory(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        inventory = bagit.PayloadInventory(self.tmpdir)
+        self.assertEqual(list(bagit._walk(self.tmpdir)), [j(self.tmpdir, e.path) for e in inventory.files])
+        for entry in inventory.files:
+            self.assertEqual(os.path.getsize(j(self.tmpdir, entry.path)), entry.size)
+            self.assertTrue(entry.readable)
+        self.assertEqual(["loc", "si"], [e.path for e in inventory.directories])
+        self.assertEqual([], inventory.unbaggable())
+        self.assertEqual(((), ()), inventory.unreadable())
+        relocated = inventory.relocate("data")
+        self.assertEqual(j("data", "README"), relocated.files[0].path)
+        self.assertEqual(relocated.files[0], relocated.get("data/./README"))
+        self.assertEqual(2, len(relocated.subset(j("data", "si")).files))
+
+    def test_payload_inventory_permission_checks(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        os.chmod(j(self.tmpdir, "README"), 0o444)
+        os.chmod(j(self.tmpdir, "si"), 0o555)
+        try:
+            inventory = bagit.PayloadInventory(self.tmpdir)
+            self.assertEqual(bagit._can_bag(self.tmpdir), inventory.unbaggable())
+            self.assertEqual(bagit._can_read(self.tmpdir), inventory.unreadable())
+        finally:
+            os.chmod(j(self.tmpdir, "si"), 0o755)
+
+    def test_payload_files_after_save(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bag = bagit.make_bag(self.tmpdir, checksums=["md5"])
+        self.assertNotIn(j("data", "newfile"), list(bag.payload_files()))
+        bag.save()
+        with open(j(self.tmpdir, "data", "newfile"), "w") as nf:
+            nf.write("newfile")
+        self.assertIn(j("data", "newfile"), list(bag.payload_files()))
+
+    def test_make_bag_and_validate_walk_payload_once(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        walk = mock.Mock(side_effect=AssertionError("payload walked without the inventory"))
+        with mock.patch.multiple("bdbag.bdbagit", _walk=walk, _can_bag=walk, _can_read=walk):
+            with mock.patch.object(bagit.PayloadInventory, "_scan", autospec=True,
+                                   side_effect=bagit.PayloadInventory._scan) as scan:
+                bag = bagit.make_bag(self.tmpdir, checksums=["md5"])
+                self.assertEqual(3, scan.call_count)
+                scan.reset_mock()
+                self.assertTrue(bag.validate(fast=True))
+                self.assertTrue(bag.validate())
+                # one walk of the payload directory (data, loc and si) for each validation
+                self.assertEqual(6, scan.call_count)
+
+    def test_make_manifests_streamed_and_sorted(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bag = bagit.make_bag(self.tmpdir, checksums=["md5", "sha256"])
+        expected = dict((alg, slurp_text_file(j(self.tmpdir, "manifest-%s.txt" % alg)))
+                        for alg in ["md5", "sha256"])
+        old_dir = os.path.abspath(os.path.curdir)
+        os.chdir(self.tmpdir)
+        try:
+            # a sort buffer of two lines forces the external merge of several sorted runs
+            oxum = bagit.make_manifests("data", 4, algorithms=["md5", "sha256"], strict=True,
+                                        executor=bagit.THREADS_EXECUTOR, sort_buffer_lines=2)
+            self.assertEqual(bag.info["Payload-Oxum"], "%s.%s" % oxum)
+            for alg, manifest in expected.items():
+                self.assertEqual(manifest, slurp_text_file("manifest-%s.txt" % alg))
+
+            oxum = bagit.make_manifests("data", 4, algorithms=["md5", "sha256"], executor=bagit.THREADS_EXECUTOR,
+                                        sort=False)
+            self.assertEqual(bag.info["Payload-Oxum"], "%s.%s" % oxum)
+            for alg, manifest in expected.items():
+                self.assertEqual(sorted(manifest.splitlines()),
+                                 sorted(slurp_text_file("manifest-%s.txt" % alg).splitlines()))
+        finally:
+            os.chdir(old_dir)
+
+    def test_make_manifests_remote_entries_last(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir, checksums=["md5"])
+        expected = slurp_text_file(j(self.tmpdir, "manifest-md5.txt")).splitlines()
+        remote = {"data/aaa.txt": {"url": "https://example.org/aaa.txt", "length": 3,
+                                   "md5": "47bce5c74f589f4867dbd57e9ca9f808"}}
+        old_dir = os.path.abspath(os.path.curdir)
+        os.chdir(self.tmpdir)
+        try:
+            bagit.make_manifests("data", 1, algorithms=["md5"], remote=remote, sort_buffer_lines=2)
+            self.assertEqual(expected + ["47bce5c74f589f4867dbd57e9ca9f808  data/aaa.txt"],
+                             slurp_text_file("manifest-md5.txt").splitlines())
+        finally:
+            os.chdir(old_dir)
+
+    def test_make_manifests_error_keeps_existing(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir, checksums=["md5"])
+        expected = slurp_text_file(j(self.tmpdir, "manifest-md5.txt"))
+        generate_manifest_lines = bagit.generate_manifest_lines
+        calls = list()
+
+        def failing_generate_manifest_lines(filename, algorithms):
+            calls.append(filename)
+            if len(calls) > 2:
+                raise IOError("Simulated read error: %s" % filename)
+            return generate_manifest_lines(filename, algorithms)
+
+        old_dir = os.path.abspath(os.path.curdir)
+        os.chdir(self.tmpdir)
+        try:
+            for sort in (True, False):
+                del calls[:]
+                with mock.patch.object(bagit, "generate_manifest_lines", new=failing_generate_manifest_lines):
+                    self.assertRaises(IOError, bagit.make_manifests, "data", 1, algorithms=["md5"], sort=sort)
+                self.assertEqual(expected, slurp_text_file("manifest-md5.txt"))
+                self.assertEqual(sorted(["bag-info.txt", "bagit.txt", "data", "manifest-md5.txt",
+                                         "tagmanifest-md5.txt"]), sorted(os.listdir(".")))
+        finally:
+            os.chdir(old_dir)
+
+    def test_compact_manifests(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir, checksums=["md5", "sha256"])
+        # an upper case digest can't be stored as raw bytes, but must still read back as written
+        with open(j(self.tmpdir, "manifest-md5.txt"), "r") as manifest:
+            lines = manifest.read().splitlines()
+        lines[0] = lines[0].split(None, 1)[0].upper() + "  " + lines[0].split(None, 1)[1]
+        with open(j(self.tmpdir, "manifest-md5.txt"), "w") as manifest:
+            manifest.write("\n".join(lines) + "\n")
+        for alg in ["md5", "sha256"]:
+            bagit._make_tagmanifest_file(alg, self.tmpdir)
+
+        bag = bagit.BDBag(self.tmpdir)
+        compact_bag = bagit.BDBag(self.tmpdir, compact_manifests=True)
+        self.assertIsInstance(compact_bag.entries, bagit.CompactManifestStore)
+        self.assertEqual(bag.entries, dict(compact_bag.entries))
+        self.assertEqual(bag.payload_entries(), dict(compact_bag.payload_entries()))
+        self.assertEqual(set(bag.algorithms), set(compact_bag.algorithms))
+        for path in bag.entries:
+            self.assertEqual(path, compact_bag.normalized_manifest_names[bagit.normalize_unicode(path)])
+        self.assertTrue(compact_bag.validate(processes=1))
+        self.assertTrue(compact_bag.validate(processes=2, executor=bagit.PROCESSES_EXECUTOR))
+
+        with open(j(self.tmpdir, "data", "README"), "a") as readme:
+            readme.write("modified")
+        compact_bag = bagit.BDBag(self.tmpdir, compact_manifests=True)
+        self.assertRaises(bagit.BagValidationError, compact_bag.validate, processes=2)
+
+    def test_normalized_name_indexes_memoized(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        bagit.make_bag(self.tmpdir, checksums=["md5"])
+        bag = bagit.BDBag(self.tmpdir)
+        self.assertEqual(([], [], []), bag.compare_manifests_with_fs_and_fetch())
+        manifest_index = bag.manifest_name_index()
+        filesystem_index = bag.filesystem_name_index()
+        with mock.patch("bdbag.bdbagit.normalize_unicode", side_effect=AssertionError("names normalized again")):
+            self.assertEqual(([], [], []), bag.compare_manifests_with_fs_and_fetch())
+
+        # modifying fetch.txt only invalidates the fetch index
+        with open(j(self.tmpdir, "fetch.txt"), "w") as fetch_file:
+            fetch_file.write("https://example.org/remote.txt 10 data/remote.txt\n")
+        self.assertEqual(([], [], [j("data", "remote.txt")]), bag.compare_manifests_with_fs_and_fetch())
+        self.assertIs(manifest_index, bag.manifest_name_index())
+        self.assertIs(filesystem_index, bag.filesystem_name_index())
+
+        # reloading the manifests and refreshing the payload inventory invalidate the other indexes
+        os.remove(j(self.tmpdir, "fetch.txt"))
+        with open(j(self.tmpdir, "data", "new-file"), "w") as new_file:
+            new_file.write("new")
+        bag.payload_inventory(refresh=True)
+        self.assertEqual(([], [j("data", "new-file")], []), bag.compare_manifests_with_fs_and_fetch())
+        bag.save(manifests=True)
+        self.assertIsNot(manifest_index, bag.manifest_name_index())
+        self.assertIn(j("data", "new-file"), bag.manifest_name_index())
+        self.assertEqual(([], [], []), bag.compare_manifests_with_fs_and_fetch())
+
+    def test_make_bag_unknown_executor(self):
+        logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
+        self.assertRaises(RuntimeError, bagit.make_bag, self.tmpdir, processes=2, executor="not-an-executor")
+        self.assertFalse(os.path.isdir(j(self.tmpdir, 'data')))
+
     def test_multiple_meta_values(self):
         logger.info(self.getTestHeader(sys._getframe().f_code.co_name))
         baginfo = {"Multival-Meta": [7, 4, 8, 6, 8]}
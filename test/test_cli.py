@@ -120,6 +120,13 @@ class TestCli(BaseTest):
                                                 "tagmanifest-sha512.txt"],
                                                ["Generating manifest lines for file"])
 
+    def test_update_incremental(self):
+        args = ARGS + [self.test_bag_dir, '--update', '--incremental']
+        logfile.writelines(self.getTestHeader('update bag incremental', args))
+        with open(ospj(self.test_bag_dir, 'data', 'NEWFILE.txt'), 'w') as nf:
+            nf.write('Additional file added via unit test.')
+        self._test_successful_invocation(args, ["Reusing existing manifest entries for", "NEWFILE.txt"])
+
     def _test_archive(self, archive_format, idempotent=False):
         args = ARGS + [self.test_bag_dir, '--archive', archive_format]
         if idempotent:
@@ -173,6 +180,21 @@ class TestCli(BaseTest):
         logfile.writelines(self.getTestHeader('validate bag', args))
         self._test_successful_invocation(args, ["test-bag is valid"])
 
+    def test_validate_full_fail_fast(self):
+        args = ARGS + [self.test_bag_dir, '--validate', 'full', '--fail-fast']
+        logfile.writelines(self.getTestHeader('validate bag fail fast', args))
+        self._test_successful_invocation(args, ["test-bag is valid"])
+
+    def test_validate_full_filter(self):
+        args = ARGS + [self.test_bag_dir, '--validate', 'full', '--validate-filter', 'filename$*.txt']
+        logfile.writelines(self.getTestHeader('validate bag with filter', args))
+        self._test_successful_invocation(args, ["using filter expression [filename$*.txt]", "test-bag is valid"])
+
+    def test_validate_sample(self):
+        args = ARGS + [self.test_bag_dir, '--validate', 'sample', '--sample-size', '2', '--sample-seed', '1']
+        logfile.writelines(self.getTestHeader('validate bag sample', args))
+        self._test_successful_invocation(args, ["test-bag is valid"])
+
     def test_validate_fast(self):
         args = ARGS + [self.test_bag_dir, '--validate', 'fast']
         logfile.writelines(self.getTestHeader('validate bag', args))
@@ -243,6 +265,35 @@ class TestCliArgParsing(BaseTest):
             logfile.writelines(output)
             self.assertExpectedMessages(["is already a bag"], output)
 
+    def test_update_bag_incremental_without_update(self):
+        args = ARGS + [self.test_bag_dir, '--incremental']
+        logfile.writelines(self.getTestHeader('incremental without update', args))
+        self._test_bad_argument_error_handling(args, ["Error: Specifying --incremental requires the --update argument"])
+
+    def test_fail_fast_without_validate_full(self):
+        args = ARGS + [self.test_bag_dir, '--validate', 'fast', '--fail-fast']
+        logfile.writelines(self.getTestHeader('fail fast without validate full', args))
+        self._test_bad_argument_error_handling(
+            args, ["Error: The --fail-fast argument can only be used with the --validate argument set to \"full\""])
+
+    def test_validate_filter_without_validate_full(self):
+        args = ARGS + [self.test_bag_dir, '--validate', 'fast', '--validate-filter', 'filename$*.txt']
+        logfile.writelines(self.getTestHeader('validate filter without validate full', args))
+        self._test_bad_argument_error_handling(
+            args, ["Error: The --validate-filter argument can only be used with the --validate argument set to \"full\""])
+
+    def test_sample_size_without_validate_sample(self):
+        args = ARGS + [self.test_bag_dir, '--validate', 'full', '--sample-size', '2']
+        logfile.writelines(self.getTestHeader('sample size without validate sample', args))
+        self._test_bad_argument_error_handling(
+            args, ["Error: The --sample-size argument can only be used with the --validate argument set to \"sample\""])
+
+    def test_compression_threads_without_compressing_archiver(self):
+        args = ARGS + [self.test_bag_dir, '--archiver', 'tar', '--compression-threads', '4']
+        logfile.writelines(self.getTestHeader('compression threads without compressing archiver', args))
+        self._test_bad_argument_error_handling(
+            args, ["Error: The --compression-threads argument can only be used with the --archiver argument set to \"tgz\""])
+
     def test_create_bag_bad_path(self):
         args = ARGS + ['./not_found']
         logfile.writelines(self.getTestHeader('create bag with bad path', args))
@@ -21,6 +21,7 @@ import shutil
 import tempfile
 import unittest
 import logging
+import requests
 from bdbag.bdbag_api import configure_logging
 from bdbag.bdbagit import open_text_file
 
@@ -145,3 +146,24 @@ class BaseTest(unittest.TestCase):
 
         def json(self):
             return self.json_data
+
+    class MockStreamingResponse:
+        def __init__(self, content, status_code=200, headers=None, error_after=None):
+            self.content = content
+            self.status_code = status_code
+            self.headers = headers or {}
+            self.error_after = error_after
+
+        @property
+        def text(self):
+            return self.content.decode("utf-8", errors="replace")
+
+        def iter_content(self, chunk_size=1):
+            content = self.content if self.error_after is None else self.content[:self.error_after]
+            for i in range(0, len(content), chunk_size):
+                yield content[i:i + chunk_size]
+            if self.error_after is not None:
+                raise requests.exceptions.ChunkedEncodingError("Connection broken: simulated interruption")
+
+        def close(self):
+            pass
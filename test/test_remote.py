@@ -17,6 +17,7 @@
 #
 import os
 import io
+import datetime
 import logging
 import mock
 import json
@@ -26,13 +27,21 @@ import bdbag.bdbagit as bdbagit
 import bdbag.bdbagit_profile as bdbagit_profile
 from os.path import join as ospj
 from os.path import isfile as ospif
-from bdbag import bdbag_api as bdb, bdbag_config as bdbcfg
-from bdbag.fetch import fetcher
+from bdbag import bdbag_api as bdb, bdbag_config as bdbcfg, urlsplit
+from bdbag.fetch import fetcher, FixityVerifier, PARTIAL_FILE_SUFFIX, PARTIAL_STATE_SUFFIX
 from bdbag.fetch.transports.fetch_http import BaseFetchTransport, HTTPFetchTransport
+from bdbag.fetch.transports import fetch_boto3
+from bdbag.fetch.transports.fetch_boto3 import BOTO3FetchTransport
 from bdbag.fetch.auth import cookies
 from bdbag.fetch.auth.keychain import read_keychain, update_keychain, get_auth_entries
 from test.test_common import BaseTest
 
+try:
+    import boto3
+    import moto
+except ImportError:
+    boto3 = moto = None
+
 logger = logging.getLogger()
 
 class CustomTestFetchTransport(HTTPFetchTransport):
@@ -260,6 +269,412 @@ class TestRemoteAPI(BaseTest):
         except Exception as e:
             self.fail(bdbag.get_typed_exception(e))
 
+    def _mocked_http_get(self, url, etag=None, honor_range=True, error_after=None, **kwargs):
+        path = ospj(self.test_http_dir, os.path.basename(urlsplit(url).path))
+        if not ospif(path):
+            return BaseTest.MockStreamingResponse(b"Not Found", 404)
+        with open(path, "rb") as test_file:
+            content = test_file.read()
+        headers = {"ETag": etag} if etag else {}
+        request_headers = kwargs.get("headers") or {}
+        byte_range = request_headers.get("Range")
+        if byte_range and honor_range and request_headers.get("If-Range", etag) == etag:
+            start, end = byte_range[len("bytes="):].split("-")
+            start, end = int(start), int(end) if end else len(content) - 1
+            if start >= len(content):
+                return BaseTest.MockStreamingResponse(b"", 416, headers)
+            end = min(end, len(content) - 1)
+            headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, len(content))
+            return BaseTest.MockStreamingResponse(content[start:end + 1], 206, headers)
+        return BaseTest.MockStreamingResponse(content, 200, headers, error_after=error_after)
+
+    def _assert_no_partial_files(self, bag_path):
+        for dirpath, dirnames, filenames in os.walk(bag_path):
+            for filename in filenames:
+                self.assertFalse(filename.endswith(PARTIAL_FILE_SUFFIX) or
+                                 filename.endswith(PARTIAL_FILE_SUFFIX + PARTIAL_STATE_SUFFIX),
+                                 "Unexpected partial download file: %s" % filename)
+
+    def test_resolve_fetch_http_resume_interrupted(self):
+        logger.info(self.getTestHeader('test resolve fetch http resume interrupted transfer'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, etag='"abc123"', error_after=50, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["interrupted after 50 bytes", "Resuming (attempt 1 of 3)",
+                                         "Attempting to resume partial download"], output)
+            self._assert_no_partial_files(self.test_bag_fetch_http_dir)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_interrupted_validate(self):
+        logger.info(self.getTestHeader('test resolve fetch http interrupted transfer then validate'))
+        try:
+            partial_path = ospj(self.test_bag_fetch_http_dir, "data", "test-fetch-http.txt" + PARTIAL_FILE_SUFFIX)
+
+            # without a validator the partial files cannot be resumed, so they are removed
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, error_after=50, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertFalse(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False))
+            self.assertExpectedMessages(["which cannot be resumed"], self.stream.getvalue())
+            self._assert_no_partial_files(self.test_bag_fetch_http_dir)
+
+            # with a validator the partial files are kept for a later resume, but are not part of the payload
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, etag='"abc123"', honor_range=False, error_after=50, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertFalse(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False))
+            self.assertTrue(ospif(partial_path))
+            self.assertTrue(ospif(partial_path + PARTIAL_STATE_SUFFIX))
+            bag = bdbagit.BDBag(self.test_bag_fetch_http_dir)
+            self.assertEqual(["data/README.txt"], [path.replace(os.sep, "/") for path in bag.payload_files()])
+            with self.assertRaises(bdbagit.BagValidationError) as ar:
+                bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+            self.assertNotIn(PARTIAL_FILE_SUFFIX, str(ar.exception))
+            bdb.validate_bag_structure(self.test_bag_fetch_http_dir)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_resume_existing_partial(self):
+        logger.info(self.getTestHeader('test resolve fetch http resume existing partial file'))
+        try:
+            partial_path = ospj(self.test_bag_fetch_http_dir, "data", "test-fetch-http.txt" + PARTIAL_FILE_SUFFIX)
+            with open(ospj(self.test_http_dir, "test-fetch-http.txt"), "rb") as test_file, \
+                    open(partial_path, "wb") as partial_file:
+                partial_file.write(test_file.read(100))
+            url = "https://raw.githubusercontent.com/fair-research/bdbag/master/test/test-data/test-http/" \
+                  "test-fetch-http.txt"
+            with open(partial_path + PARTIAL_STATE_SUFFIX, "w") as state_file:
+                json.dump({"url": url, "validator": '"abc123"'}, state_file)
+
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, etag='"abc123"', **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["Attempting to resume partial download", "at byte offset 100"], output)
+            self._assert_no_partial_files(self.test_bag_fetch_http_dir)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_segmented(self):
+        logger.info(self.getTestHeader('test resolve fetch http segmented'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, etag='"abc123"', **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir,
+                                                  config_file=ospj(self.test_config_dir, 'test-config-15.json'),
+                                                  cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["in 5 segments using 4 connections"], output)
+            self._assert_no_partial_files(self.test_bag_fetch_http_dir)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_segmented_interrupted(self):
+        logger.info(self.getTestHeader('test resolve fetch http segmented with interrupted segment'))
+        try:
+            interrupted = set()
+
+            def mocked_get(session, url, **kwargs):
+                response = self._mocked_http_get(url, etag='"abc123"', **kwargs)
+                byte_range = (kwargs.get("headers") or {}).get("Range")
+                if byte_range == "bytes=100-149" and byte_range not in interrupted:
+                    interrupted.add(byte_range)
+                    response.error_after = 20
+                return response
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir,
+                                                  config_file=ospj(self.test_config_dir, 'test-config-15.json'),
+                                                  cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["Segment transfer of bytes 100-149", "interrupted at byte 120"], output)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_segmented_not_honored(self):
+        logger.info(self.getTestHeader('test resolve fetch http segmented with range not honored'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, honor_range=False, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir,
+                                                  config_file=ospj(self.test_config_dir, 'test-config-15.json'),
+                                                  cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["falling back to a single stream"], output)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_segmented_redirect_without_token(self):
+        logger.info(self.getTestHeader('test resolve fetch http segmented with disallowed token redirect'))
+        try:
+            redirected_authorizations = list()
+
+            def mocked_get(session, url, **kwargs):
+                headers = kwargs.get("headers") or {}
+                # emulate requests' merging of request and session headers, where a None value removes the header
+                authorization = headers["Authorization"] if "Authorization" in headers else \
+                    session.headers.get("Authorization")
+                if urlsplit(url).netloc == "raw.githubusercontent.com":
+                    return BaseTest.MockStreamingResponse(
+                        b"", 302, {"Location": "https://mirror.example.org/" + os.path.basename(urlsplit(url).path)})
+                redirected_authorizations.append(authorization)
+                return self._mocked_http_get(url, etag='"abc123"', **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir,
+                                                  config_file=ospj(self.test_config_dir, 'test-config-15.json'),
+                                                  keychain_file=ospj(self.test_config_dir, 'test-keychain-7.json'),
+                                                  cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["Authorization bearer token propagation on redirect is disabled",
+                                         "in 5 segments using 4 connections"], output)
+            self.assertTrue(redirected_authorizations)
+            self.assertEqual([None] * len(redirected_authorizations), redirected_authorizations)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_resume_not_honored(self):
+        logger.info(self.getTestHeader('test resolve fetch http resume with range not honored'))
+        try:
+            partial_path = ospj(self.test_bag_fetch_http_dir, "data", "test-fetch-http.txt" + PARTIAL_FILE_SUFFIX)
+            with open(partial_path, "wb") as partial_file:
+                partial_file.write(b"stale partial content")
+            url = "https://raw.githubusercontent.com/fair-research/bdbag/master/test/test-data/test-http/" \
+                  "test-fetch-http.txt"
+            with open(partial_path + PARTIAL_STATE_SUFFIX, "w") as state_file:
+                json.dump({"url": url, "validator": '"stale"'}, state_file)
+
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, etag='"abc123"', honor_range=False, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["Server did not honor the resume request"], output)
+            self._assert_no_partial_files(self.test_bag_fetch_http_dir)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_verified_in_stream(self):
+        logger.info(self.getTestHeader('test resolve fetch http with files verified during transfer'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, **kwargs)
+
+            verified = dict()
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False, verified=verified),
+                                "Fetch incomplete")
+            self.assertEqual(["data/test-fetch-http.txt", "data/test-fetch-identifier.txt"], sorted(verified.keys()))
+            self.assertEqual("f3ad851f4213d41ce9690542010bffa0", verified["data/test-fetch-http.txt"][1]["md5"])
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False, verified=verified)
+            self.assertExpectedMessages(["Skipping 2 of 8 files already verified during transfer"],
+                                        self.stream.getvalue())
+
+            # a file modified after it was verified is hashed again
+            with open(ospj(self.test_bag_fetch_http_dir, "data", "test-fetch-http.txt"), "ab") as f:
+                f.write(b"modified")
+            self.assertRaises(bdbagit.BagValidationError, bdb.validate_bag, self.test_bag_fetch_http_dir,
+                              fast=False, verified=verified)
+            self.assertExpectedMessages(["Skipping 1 of 8 files already verified during transfer"],
+                                        self.stream.getvalue())
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_verified_in_stream_resumed(self):
+        logger.info(self.getTestHeader('test resolve fetch http resumed transfer verified during transfer'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, etag='"abc123"', error_after=50, **kwargs)
+
+            verified = dict()
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False, verified=verified),
+                                "Fetch incomplete")
+            self.assertExpectedMessages(["Attempting to resume partial download"], self.stream.getvalue())
+            self.assertIn("data/test-fetch-http.txt", verified)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_verified_in_stream_mismatch(self):
+        logger.info(self.getTestHeader('test resolve fetch http with checksum mismatch on arrival'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return BaseTest.MockStreamingResponse(b"Unexpected content", 200)
+
+            verified = dict()
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertFalse(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False,
+                                                   verified=verified))
+            self.assertEqual(dict(), verified)
+            self.assertExpectedMessages(["md5 checksum mismatch on arrival",
+                                         "that failed verification on arrival (attempt 2 of 2)",
+                                         "failed verification on arrival after 3 attempts"], self.stream.getvalue())
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_verified_in_stream_mismatch_retried(self):
+        logger.info(self.getTestHeader('test resolve fetch http retries a corrupt file of the expected size'))
+        try:
+            def mocked_corrupt_get(session, url, **kwargs):
+                response = self._mocked_http_get(url, **kwargs)
+                response.content = b"x" * len(response.content)
+                return response
+
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, **kwargs)
+
+            output_path = ospj(self.test_bag_fetch_http_dir, "data", "test-fetch-http.txt")
+            with mock.patch("requests.Session.get", new=mocked_corrupt_get):
+                self.assertFalse(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False))
+            self.assertFalse(ospif(output_path))
+            self.assertExpectedMessages(["Removed corrupt file"], self.stream.getvalue())
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False), "Fetch incomplete")
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_refetch_corrupt(self):
+        logger.info(self.getTestHeader('test resolve fetch http re-fetch of corrupted download'))
+        try:
+            corrupted = set()
+
+            def mocked_get(session, url, **kwargs):
+                if url not in corrupted:
+                    corrupted.add(url)
+                    return BaseTest.MockStreamingResponse(b"Corrupted content", 200)
+                return self._mocked_http_get(url, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False), "Fetch incomplete")
+            self.assertExpectedMessages(["checksum mismatch on arrival",
+                                         "that failed verification on arrival (attempt 1 of 2)"],
+                                        self.stream.getvalue())
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_verify_on_arrival_disabled(self):
+        logger.info(self.getTestHeader('test resolve fetch http with verification on arrival disabled'))
+        try:
+            config = bdbcfg.read_config(ospj(self.test_config_dir, 'test-config.json'), create_default=False)
+            config.setdefault(bdbcfg.FETCH_CONFIG_TAG, dict())[bdbcfg.FETCH_VERIFICATION_TAG] = \
+                {bdbcfg.FETCH_VERIFY_ON_ARRIVAL_TAG: False}
+            config_file = ospj(self.tmpdir, 'verification-config.json')
+            bdbcfg.write_config(config, config_file)
+
+            def mocked_get(session, url, **kwargs):
+                return BaseTest.MockStreamingResponse(b"Corrupted content", 200)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, config_file=config_file,
+                                                  cookie_scan=False), "Fetch incomplete")
+            self.assertUnexpectedMessages(["checksum mismatch on arrival"], self.stream.getvalue())
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_identifier_refetch_alternate_url(self):
+        logger.info(self.getTestHeader('test resolve fetch identifier re-fetch of corrupted download from alternate url'))
+        try:
+            urls = ["https://mirror-a.example.org/test-fetch-identifier.txt",
+                    "https://mirror-b.example.org/test-fetch-identifier.txt"]
+            requested = list()
+
+            def mocked_get(session, url, **kwargs):
+                requested.append(url)
+                if "mirror-a" in url:
+                    return BaseTest.MockStreamingResponse(b"Corrupted content", 200)
+                return self._mocked_http_get(url, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get), \
+                    mock.patch.object(fetcher, "resolve", return_value=[{"url": url} for url in urls]):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_ark2_dir, cookie_scan=False), "Fetch incomplete")
+            self.assertEqual(urls, requested)
+            bdb.validate_bag(self.test_bag_fetch_ark2_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_concurrent(self):
+        logger.info(self.getTestHeader('test resolve fetch http concurrent'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, **kwargs)
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir,
+                                                  config_file=ospj(self.test_config_dir, 'test-config-14.json'),
+                                                  cookie_scan=False), "Fetch incomplete")
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["Fetching with 4 concurrent workers (max 2 per host)."], output)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=True)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_fetch_bag_files_concurrent_with_caller_fetchers(self):
+        logger.info(self.getTestHeader('test fetch bag files concurrent with caller supplied fetchers'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, **kwargs)
+
+            def caller_fetch(url, output_path, **kwargs):
+                with open(ospj(self.test_http_dir, os.path.basename(urlsplit(url).path)), "rb") as test_file, \
+                        open(output_path, "wb") as output_file:
+                    output_file.write(test_file.read())
+                return output_path
+
+            caller_fetcher = mock.Mock(spec=BaseFetchTransport)
+            caller_fetcher.fetch.side_effect = caller_fetch
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertTrue(fetcher.fetch_bag_files(bdbagit.BDBag(self.test_bag_fetch_http_dir),
+                                                        config_file=ospj(self.test_config_dir, 'test-config-14.json'),
+                                                        fetchers={"https": caller_fetcher}), "Fetch incomplete")
+            self.assertTrue(caller_fetcher.fetch.called)
+            self.assertEqual(1, caller_fetcher.cleanup.call_count)
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_resolve_fetch_http_concurrent_with_callback_cancel(self):
+        logger.info(self.getTestHeader('test resolve fetch http concurrent with callback cancel'))
+        try:
+            def mocked_get(session, url, **kwargs):
+                return self._mocked_http_get(url, **kwargs)
+
+            def callback(current, total):
+                return False
+
+            with mock.patch("requests.Session.get", new=mocked_get):
+                self.assertFalse(bdb.resolve_fetch(self.test_bag_fetch_http_dir,
+                                                   callback=callback,
+                                                   config_file=ospj(self.test_config_dir, 'test-config-14.json'),
+                                                   cookie_scan=False))
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["Fetch cancelled by user..."], output)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
     def test_resolve_fetch_http_bad_request(self):
         logger.info(self.getTestHeader('test resolve fetch http bad url path'))
         try:
@@ -744,15 +1159,17 @@ class TestRemoteAPI(BaseTest):
     def test_resolve_fetch_ftp_no_auth(self):
         logger.info(self.getTestHeader('test resolve fetch ftp'))
         try:
-            patched_urlretrieve = None
+            with open(ospj(self.test_bag_fetch_ftp_dir, 'data', '1KB.zip'), 'rb') as payload:
+                content = payload.read()
+            patched_urlopen = None
 
-            def mocked_urlretrieve_success(*args, **kwargs):
-                patched_urlretrieve.stop()
-                return
+            def mocked_urlopen_success(*args, **kwargs):
+                patched_urlopen.stop()
+                return io.BytesIO(content)
 
-            patched_urlretrieve = mock.patch.multiple("bdbag.fetch.transports.fetch_ftp",
-                                                      urlretrieve=mocked_urlretrieve_success)
-            patched_urlretrieve.start()
+            patched_urlopen = mock.patch.multiple("bdbag.fetch.transports.fetch_ftp",
+                                                  urlopen=mocked_urlopen_success)
+            patched_urlopen.start()
 
             self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_ftp_dir, force=True), "Fetch incomplete")
             bdb.validate_bag(self.test_bag_fetch_ftp_dir, fast=True)
@@ -763,15 +1180,17 @@ class TestRemoteAPI(BaseTest):
     def test_resolve_fetch_ftp_auth(self):
         logger.info(self.getTestHeader('test resolve fetch ftp with auth'))
         try:
-            patched_urlretrieve = None
+            with open(ospj(self.test_bag_fetch_auth_dir, 'data', '1KB.zip'), 'rb') as payload:
+                content = payload.read()
+            patched_urlopen = None
 
-            def mocked_urlretrieve_success(*args, **kwargs):
-                patched_urlretrieve.stop()
-                return
+            def mocked_urlopen_success(*args, **kwargs):
+                patched_urlopen.stop()
+                return io.BytesIO(content)
 
-            patched_urlretrieve = mock.patch.multiple("bdbag.fetch.transports.fetch_ftp",
-                                                      urlretrieve=mocked_urlretrieve_success)
-            patched_urlretrieve.start()
+            patched_urlopen = mock.patch.multiple("bdbag.fetch.transports.fetch_ftp",
+                                                  urlopen=mocked_urlopen_success)
+            patched_urlopen.start()
 
             self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_auth_dir, force=True,
                             keychain_file=ospj(self.test_config_dir, 'test-keychain-5.json')), "Fetch incomplete")
@@ -1176,6 +1595,173 @@ class TestRemoteAPI(BaseTest):
         except Exception as e:
             self.fail(bdbag.get_typed_exception(e))
 
+    @staticmethod
+    def _mock_boto3_session(expiration=None):
+        session = mock.MagicMock()
+
+        def client(service_name, **kwargs):
+            service_client = mock.MagicMock(name=service_name)
+            if service_name == "sts":
+                service_client.assume_role.return_value = {
+                    "Credentials": {"AccessKeyId": "key", "SecretAccessKey": "secret", "SessionToken": "token",
+                                    "Expiration": expiration}}
+            return service_client
+
+        session.client.side_effect = client
+        return session
+
+    def test_boto3_client_cache(self):
+        logger.info(self.getTestHeader('test boto3 client cache'))
+        try:
+            keychain = [{"uri": "s3://bucket-a/", "auth_type": "aws-credentials",
+                         "auth_params": {"key": "foo", "secret": "bar"}}]
+            transport = BOTO3FetchTransport(None, keychain)
+            with mock.patch.object(fetch_boto3, "BOTO3") as mocked_boto3:
+                mocked_boto3.session.Session.return_value = self._mock_boto3_session()
+                client = transport.get_client("s3://bucket-a/file1.txt")
+                self.assertIs(client, transport.get_client("s3://bucket-a/dir/file2.txt"))
+                self.assertEqual(1, mocked_boto3.session.Session.call_count)
+                self.assertIsNot(client, transport.get_client("s3://bucket-b/file3.txt"))
+                self.assertEqual(2, mocked_boto3.session.Session.call_count)
+                transport.cleanup()
+                client.close.assert_called_once_with()
+                self.assertFalse(transport.clients)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_boto3_client_cache_refresh_assumed_role(self):
+        logger.info(self.getTestHeader('test boto3 client cache refresh assumed role credentials'))
+        try:
+            keychain = [{"uri": "s3://bucket-a/", "auth_type": "aws-credentials",
+                         "auth_params": {"role_arn": "arn:aws:iam::123456789012:role/bdbag"}}]
+            transport = BOTO3FetchTransport(None, keychain)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            with mock.patch.object(fetch_boto3, "BOTO3") as mocked_boto3:
+                mocked_boto3.session.Session.return_value = self._mock_boto3_session(
+                    now + datetime.timedelta(hours=1))
+                client = transport.get_client("s3://bucket-a/file1.txt")
+                self.assertIs(client, transport.get_client("s3://bucket-a/file2.txt"))
+
+                mocked_boto3.session.Session.return_value = self._mock_boto3_session(
+                    now + datetime.timedelta(seconds=60))
+                transport.clients.clear()
+                expiring_client = transport.get_client("s3://bucket-a/file1.txt")
+                refreshed_client = transport.get_client("s3://bucket-a/file2.txt")
+                self.assertIsNot(expiring_client, refreshed_client)
+                expiring_client.close.assert_called_once_with()
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    class MockS3Body:
+        def __init__(self, content, timeouts=0):
+            self.stream = io.BytesIO(content)
+            self.timeouts = timeouts
+
+        def set_socket_timeout(self, timeout):
+            pass
+
+        def read(self, amt=None):
+            if self.timeouts:
+                self.timeouts -= 1
+                raise fetch_boto3.BOTOCORE.exceptions.ReadTimeoutError()
+            return self.stream.read(amt)
+
+        def close(self):
+            pass
+
+    def _mock_s3_fetch(self, config, timeouts=None, fixity=None):
+        with open(ospj(self.test_http_dir, "test-fetch-http.txt"), "rb") as test_file:
+            content = test_file.read()
+        timeouts = timeouts or {}
+        s3_client = mock.MagicMock()
+        s3_client.head_object.return_value = {"ContentLength": len(content), "ETag": '"abc123"'}
+
+        def get_object(Bucket, Key, Range=None, IfMatch=None):
+            if Range:
+                start, end = [int(x) for x in Range[len("bytes="):].split("-")]
+                return {"Body": self.MockS3Body(content[start:end + 1], timeouts.get(Range, 0))}
+            return {"Body": self.MockS3Body(content)}
+
+        s3_client.get_object.side_effect = get_object
+        mocked_botocore = mock.MagicMock()
+        mocked_botocore.exceptions.ReadTimeoutError = type("ReadTimeoutError", (Exception,), {})
+        mocked_botocore.exceptions.ClientError = type("ClientError", (Exception,), {})
+        mocked_botocore.exceptions.BotoCoreError = type("BotoCoreError", (Exception,), {})
+        output_path = ospj(self.tmpdir, "test-fetch-s3.txt")
+        transport = BOTO3FetchTransport(config, [])
+        with mock.patch.object(fetch_boto3, "BOTO3"), mock.patch.object(fetch_boto3, "BOTOCORE", mocked_botocore), \
+                mock.patch.object(transport, "get_client", return_value=s3_client):
+            self.assertEqual(output_path, transport.fetch("s3://bucket-a/test-fetch-http.txt", output_path,
+                                                          size=len(content), fixity=fixity))
+        with open(output_path, "rb") as output_file:
+            self.assertEqual(content, output_file.read())
+        return s3_client
+
+    def test_boto3_fetch_multipart(self):
+        logger.info(self.getTestHeader('test boto3 fetch multipart'))
+        try:
+            config = {"max_concurrency": 4, "multipart_threshold": 50, "multipart_chunksize": 50,
+                      "max_read_retries": 3}
+            s3_client = self._mock_s3_fetch(config, timeouts={"bytes=100-149": 2})
+            self.assertEqual(5, s3_client.get_object.call_count)
+            for call in s3_client.get_object.call_args_list:
+                self.assertEqual('"abc123"', call[1]["IfMatch"])
+            output = self.stream.getvalue()
+            self.assertExpectedMessages(["in 5 parts using 4 threads", "Retrying attempt 2 of 3"], output)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_boto3_fetch_below_multipart_threshold(self):
+        logger.info(self.getTestHeader('test boto3 fetch below multipart threshold'))
+        try:
+            config = {"max_concurrency": 4, "multipart_threshold": 1024, "multipart_chunksize": 50}
+            s3_client = self._mock_s3_fetch(config)
+            s3_client.head_object.assert_not_called()
+            self.assertEqual(1, s3_client.get_object.call_count)
+            self.assertNotIn("Range", s3_client.get_object.call_args[1])
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    def test_boto3_fetch_verified_in_stream(self):
+        logger.info(self.getTestHeader('test boto3 fetch verified during transfer'))
+        try:
+            output_path = ospj(self.tmpdir, "test-fetch-s3.txt")
+            fixity = FixityVerifier({"md5": "f3ad851f4213d41ce9690542010bffa0"})
+            self._mock_s3_fetch({}, fixity=fixity)
+            self.assertTrue(fixity.verify(output_path))
+
+            # parts written out of order cannot be verified in-stream, and are left to bag validation
+            config = {"max_concurrency": 4, "multipart_threshold": 100, "multipart_chunksize": 50}
+            self._mock_s3_fetch(config, fixity=fixity)
+            self.assertIsNone(fixity.verify(output_path))
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
+    @unittest.skipIf(moto is None, "The \"boto3\" and \"moto\" packages are required for this test")
+    def test_resolve_fetch_s3_local(self):
+        logger.info(self.getTestHeader('test resolve fetch s3 against local stand-in'))
+        try:
+            mock_aws = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+            environ = {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing",
+                       "AWS_DEFAULT_REGION": "us-east-1"}
+            with mock.patch.dict(os.environ, environ), mock_aws():
+                s3 = boto3.client("s3")
+                s3.create_bucket(Bucket="bdbag-test")
+                fetch_file = ospj(self.test_bag_fetch_http_dir, "fetch.txt")
+                with open(fetch_file) as ff:
+                    lines = ff.readlines()
+                with open(fetch_file, "w") as ff:
+                    for line in lines:
+                        url, length, path = line.rstrip("\n").split("\t")
+                        filename = os.path.basename(urlsplit(url).path)
+                        with open(ospj(self.test_http_dir, filename), "rb") as test_file:
+                            s3.put_object(Bucket="bdbag-test", Key=filename, Body=test_file.read())
+                        ff.write("s3://bdbag-test/%s\t%s\t%s\n" % (filename, length, path))
+                self.assertTrue(bdb.resolve_fetch(self.test_bag_fetch_http_dir, cookie_scan=False), "Fetch incomplete")
+            bdb.validate_bag(self.test_bag_fetch_http_dir, fast=False)
+        except Exception as e:
+            self.fail(bdbag.get_typed_exception(e))
+
     @unittest.skip("Not implemented")
     def test_resolve_fetch_globus(self):
         # TODO